@@ -0,0 +1,160 @@
+from array import array
+import numpy as np
+from resources import GI, parse_quantity, pod_counted
+
+PRIORITY_LABEL = 'deploy.cloud.sealos.io/priority'
+# 未调度的 Pod 和没有优先级标签的 Pod 归入的分组
+UNSCHEDULED = ''
+NO_PRIORITY = ''
+
+class _Codes:
+    """把字符串映射为从 0 开始的整数编码，用于 bincount 分组"""
+
+    def __init__(self):
+        self.index = {}
+        self.names = []
+
+    def code(self, name):
+        code = self.index.get(name)
+        if code is None:
+            code = self.index[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+def _quantity(resources, key):
+    value = resources.get(key)
+    if value is None:
+        return 0.0
+    try:
+        return parse_quantity(value)
+    except ValueError:
+        return 0.0
+
+class ResourceTable:
+    """按列保存容器的 requests/limits，用向量运算统计集群、节点、命名空间、优先级维度的总和
+
+    CPU 单位为核，内存单位为字节
+    """
+
+    COLUMNS = ('cpu_requests', 'cpu_limits', 'memory_requests', 'memory_limits')
+
+    def __init__(self):
+        self.nodes = _Codes()
+        self.namespaces = _Codes()
+        self.priorities = _Codes()
+        self.pod_count = 0
+        # 每个容器一行，先用 array 追加，统计时一次性转成 numpy 数组
+        self._node = array('l')
+        self._namespace = array('l')
+        self._priority = array('l')
+        self._pod = array('l')
+        self._columns = {name: array('d') for name in self.COLUMNS}
+        self._capacity = {'cpu': array('d'), 'memory': array('d')}
+        self._allocatable = {'cpu': array('d'), 'memory': array('d')}
+
+    @classmethod
+    def build(cls, nodes, pods):
+        table = cls()
+        for node in nodes:
+            table.add_node(node)
+        for pod in pods:
+            table.add_pod(pod)
+        return table
+
+    def _node_code(self, name):
+        code = self.nodes.code(name)
+        if code >= len(self._capacity['cpu']):
+            for values in (self._capacity, self._allocatable):
+                values['cpu'].append(0.0)
+                values['memory'].append(0.0)
+        return code
+
+    def add_node(self, node):
+        code = self._node_code(node['metadata']['name'])
+        status = node.get('status', {})
+        for target, source in ((self._capacity, status.get('capacity', {})),
+                               (self._allocatable, status.get('allocatable', {}))):
+            target['cpu'][code] = _quantity(source, 'cpu')
+            target['memory'][code] = _quantity(source, 'memory')
+
+    def add_pod(self, pod):
+        if not pod_counted(pod):
+            return
+        metadata = pod['metadata']
+        spec = pod.get('spec', {})
+        node = self._node_code(spec.get('nodeName') or UNSCHEDULED)
+        namespace = self.namespaces.code(metadata.get('namespace', ''))
+        priority = self.priorities.code((metadata.get('labels') or {}).get(PRIORITY_LABEL, NO_PRIORITY))
+        pod_index = self.pod_count
+        self.pod_count += 1
+        for container in spec.get('containers', []):
+            resources = container.get('resources', {})
+            requests = resources.get('requests', {})
+            limits = resources.get('limits', {})
+            self._node.append(node)
+            self._namespace.append(namespace)
+            self._priority.append(priority)
+            self._pod.append(pod_index)
+            self._columns['cpu_requests'].append(_quantity(requests, 'cpu'))
+            self._columns['cpu_limits'].append(_quantity(limits, 'cpu'))
+            self._columns['memory_requests'].append(_quantity(requests, 'memory'))
+            self._columns['memory_limits'].append(_quantity(limits, 'memory'))
+
+    def column(self, name):
+        return np.array(self._columns[name], dtype=np.float64)
+
+    def _codes(self, dimension):
+        return np.array({'node': self._node, 'namespace': self._namespace, 'priority': self._priority}[dimension],
+                        dtype=np.int64)
+
+    def totals(self):
+        """集群总和"""
+        totals = {name: float(self.column(name).sum()) for name in self.COLUMNS}
+        totals['cpu_capacity'] = float(np.array(self._capacity['cpu'], dtype=np.float64).sum())
+        totals['memory_capacity'] = float(np.array(self._capacity['memory'], dtype=np.float64).sum())
+        totals['pods'] = self.pod_count
+        totals['containers'] = len(self._pod)
+        return totals
+
+    def aggregate(self, dimension):
+        """按 node/namespace/priority 分组求和，返回 {分组: {列名: 总和}}"""
+        codes_map = {'node': self.nodes, 'namespace': self.namespaces, 'priority': self.priorities}[dimension]
+        size = len(codes_map.names)
+        codes = self._codes(dimension)
+        sums = {name: np.bincount(codes, weights=self.column(name), minlength=size) for name in self.COLUMNS}
+        # 每组的 Pod 数：同一个 Pod 的容器编码相同，只计第一个容器
+        pods = np.array(self._pod, dtype=np.int64)
+        first = np.ones(len(pods), dtype=bool)
+        first[1:] = pods[1:] != pods[:-1]
+        pod_counts = np.bincount(codes[first], minlength=size)
+        result = {}
+        for code, name in enumerate(codes_map.names):
+            entry = {column: float(sums[column][code]) for column in self.COLUMNS}
+            entry['pods'] = int(pod_counts[code])
+            if dimension == 'node':
+                entry['cpu_capacity'] = self._capacity['cpu'][code]
+                entry['memory_capacity'] = self._capacity['memory'][code]
+                entry['cpu_allocatable'] = self._allocatable['cpu'][code]
+                entry['memory_allocatable'] = self._allocatable['memory'][code]
+            result[name] = entry
+        return result
+
+    def usage(self):
+        """返回 (CPU 百分比, 内存百分比)，基于 limits 与节点容量"""
+        totals = self.totals()
+        if not totals['cpu_capacity'] or not totals['memory_capacity']:
+            return None, None
+        return (totals['cpu_limits'] / totals['cpu_capacity'] * 100,
+                totals['memory_limits'] / totals['memory_capacity'] * 100)
+
+    def summary(self):
+        def readable(entry):
+            # 内存输出为 Gi，便于阅读
+            return {key: round(value / GI, 3) if key.startswith('memory') else round(value, 3)
+                    for key, value in entry.items()}
+        return {
+            'totals': readable(self.totals()),
+            'nodes': {name: readable(entry) for name, entry in self.aggregate('node').items()},
+            'namespaces': {name: readable(entry) for name, entry in self.aggregate('namespace').items()},
+            'priorities': {name: readable(entry) for name, entry in self.aggregate('priority').items()}
+        }
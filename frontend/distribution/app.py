@@ -1,5 +1,5 @@
 import socket
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, send_file
 import subprocess
 import os
 import json
@@ -7,10 +7,30 @@ import yaml
 import time
 import shutil
 import zipfile
+import tarfile
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from apscheduler.schedulers.background import BackgroundScheduler
 import re
 import requests
 from node import add_node_to_cluster, delete_node_from_cluster
+from image_export import export_images, EXPORT_FORMAT
+from image_layout import FORMAT_DOCKER_ARCHIVE, FORMAT_OCI_LAYOUT, docker_load
+from archive import cached_archive, stream_zip
+from ingest import app_target, extract_zip_stream, multipart_file_chunks, new_staging_dir, raw_chunks, swap_into_place
+from jobs import JOB_DATABASE, JobEngine, JobStore, STATUS_FAILED, STATUS_SKIPPED, STATUS_SUCCEEDED, StageFailed, sse_events, stage, stage_recorder
+from registry import LOCAL_REGISTRY, LOCAL_REGISTRY_PASS, LOCAL_REGISTRY_USER, REGISTRY_UPLOAD_CONCURRENCY, RegistryClient, RegistryError
+from registry import local_config_digest, push_archive, push_layout, split_reference, target_image_name
+from kube import PATCH_MERGE, KubeError, cordon_node, drain_node, get_client, list_nodes, list_pods, list_workloads, node_ready, uncordon_node
+from informer import ENABLE_INFORMER, WORKLOAD_TYPES, ClusterCache, WorkloadCache, priority_candidate
+from accounting import PRIORITY_LABEL, ResourceTable
+from resources import node_capacity, node_deficit
+from preemption import PAUSE_COOLDOWN, LaunchpadClient, select_workloads
+from resume import ResumeController
+from cache import SharedSnapshots, SingleFlightCache
+from metrics import METRICS_INTERVAL, SCALING_MODE, STATE_HIGH, STATE_LOW, Hysteresis, UsageTracker
+from forecast import ENABLE_PREDICTIVE_SCALING, Forecaster
 from stress_test import *
 
 
@@ -35,6 +55,16 @@ ENABLE_WORKLOAD_SCALING = bool((os.getenv('ENABLE_WORKLOAD_SCALING') or 'false')
 ENABLE_NODE_SCALING = bool((os.getenv('ENABLE_NODE_SCALING') or 'false') == 'true')
 NODE_DELETE_THRESHOLD = os.getenv('NODE_DOWN_THRESHOLD') or '15'
 NODE_ADD_THRESHOLD = os.getenv('NODE_UP_THRESHOLD') or '70'
+# 环境变量：缩容时同时驱逐的节点数
+NODE_DRAIN_CONCURRENCY = int(os.getenv('NODE_DRAIN_CONCURRENCY') or '3')
+# 环境变量：下载模式，archive（缓存压缩包，支持断点续传）或 stream（边打包边下载）
+DOWNLOAD_MODE = os.getenv('DOWNLOAD_MODE') or 'archive'
+# 环境变量：部署时同时加载和推送的镜像数
+DEPLOY_CONCURRENCY = int(os.getenv('DEPLOY_CONCURRENCY') or '3')
+# 环境变量：推送前检查仓库，已存在相同镜像时跳过
+DEPLOY_SKIP_EXISTING = bool((os.getenv('DEPLOY_SKIP_EXISTING') or 'true') == 'true')
+# 环境变量：推送方式，registry（直接从制品推送到仓库）或 docker（docker load/tag/push）
+DEPLOY_PUSH_MODE = os.getenv('DEPLOY_PUSH_MODE') or 'registry'
 
 MASTER_IP = ''
 #如果CLUSTER_DOMAIN是IP地址，MASTER_IP就是CLUSTER_DOMAIN
@@ -55,9 +85,152 @@ def run_command(command):
         print("Error executing command: " + e.stderr.decode().strip())
         return e.stderr.decode().strip()
 
-def upload_deploy_helper(file_path, namespace, appname, images):
+job_engine = JobEngine(store=JobStore(JOB_DATABASE) if JOB_DATABASE else None)
+cluster_cache = ClusterCache()
+workload_cache = WorkloadCache()
+launchpad = LaunchpadClient('http://{}:32293'.format(CLUSTER_DOMAIN))
+resume_controller = ResumeController(float(RESOURCE_THRESHOLD))
+# 界面轮询的只读接口共享同一次查询
+read_cache = SingleFlightCache()
+# 多进程部署时 leader 把缩放状态写入 sqlite，其他 worker 从中读取
+shared_state = SharedSnapshots(JOB_DATABASE) if JOB_DATABASE else None
+usage_tracker = UsageTracker(capacity_source=lambda: cluster_cache.node_capacities() if ENABLE_INFORMER else None)
+
+def run_job(job_type, work, *args, description=''):
+    """请求参数 async=true 时提交后台任务并立即返回任务ID，否则在请求内同步执行"""
+    if request.args.get('async') != 'true':
+        return work(*args)
+
+    def target(job):
+        with app.app_context():
+            response, status_code = work(*args, job=job)
+            return response.get_json(), status_code
+
+    job = job_engine.submit(job_type, target, description=description)
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': '/api/jobs/' + job.id,
+        'events_url': '/api/jobs/' + job.id + '/events'
+    }), 202
+
+def push_image(file_path, image, image_format=FORMAT_DOCKER_ARCHIVE, registry=None):
+    """加载单个镜像，替换域名后推送到 sealos.hub
+
+    返回 (是否跳过, 错误信息, HTTP 状态码)，在线程池中执行，因此不直接构造响应
+    """
+    name = image['name'].strip()
+    new_name = target_image_name(name)
+    if not new_name:
+        return False, 'Invalid image name: ' + name, 400
+
+    # 仓库中已有相同镜像时跳过加载和推送
+    if DEPLOY_SKIP_EXISTING:
+        local_digest = local_config_digest(file_path, image, image_format)
+        if local_digest:
+            try:
+                remote_digest = registry.remote_config_digest(*split_reference(new_name))
+            except (requests.RequestException, ValueError) as e:
+                print('Failed to check registry for ' + new_name + ': ' + str(e), flush=True)
+                remote_digest = None
+            if remote_digest == local_digest:
+                print('Skip pushing ' + new_name + ', already in registry', flush=True)
+                return True, None, 200
+
+    # 不经过 docker，直接从制品读取 blob 推送到仓库
+    if DEPLOY_PUSH_MODE == 'registry':
+        try:
+            if image_format == FORMAT_OCI_LAYOUT:
+                push_layout(registry, file_path, image['manifest'], new_name)
+            else:
+                push_archive(registry, image['path'], new_name)
+        except (RegistryError, requests.RequestException, OSError, KeyError, ValueError, tarfile.TarError) as e:
+            return False, 'Failed to push image, ' + str(e), 500
+        return False, None, 200
+
+    # 加载镜像
+    if image_format == FORMAT_OCI_LAYOUT:
+        err = docker_load(file_path, image['manifest'], name)
+    else:
+        err = run_command('docker load -i ' + image['path'])
+    if err:
+        return False, 'Failed to load image, ' + err, 500
+    # 替换域名并推送镜像
+    err = run_command('docker tag ' + name + ' ' + new_name)
+    if err:
+        return False, 'Failed to tag image, ' + err, 500
+    err = run_command('docker push ' + new_name)
+    if err:
+        return False, 'Failed to push image, ' + err, 500
+    return False, None, 200
+
+def push_images(file_path, images, image_format=FORMAT_DOCKER_ARCHIVE, job=None):
+    """并发加载制品中的镜像并推送到 sealos.hub，出错时返回错误响应"""
+    if not images:
+        return None
+
+    # 每次部署只登录一次镜像仓库
+    if DEPLOY_PUSH_MODE != 'registry':
+        try:
+            with stage(job, 'login'):
+                err = run_command('docker login -u ' + LOCAL_REGISTRY_USER + ' -p ' + LOCAL_REGISTRY_PASS + ' ' + LOCAL_REGISTRY)
+                if err:
+                    raise StageFailed('Failed to login, ' + err)
+        except StageFailed as e:
+            return jsonify({'error': str(e)}), 500
+
+    registry = RegistryClient(pool_size=DEPLOY_CONCURRENCY * REGISTRY_UPLOAD_CONCURRENCY)
+
+    def push(image):
+        started_at = time.time()
+        skipped, err, status_code = push_image(file_path, image, image_format, registry)
+        if job:
+            job.add_stage('push ' + image['name'].strip(), started_at, time.time(),
+                          STATUS_FAILED if err else (STATUS_SKIPPED if skipped else STATUS_SUCCEEDED),
+                          **({'error': err} if err else {}))
+        return err, status_code
+
+    with ThreadPoolExecutor(max_workers=min(DEPLOY_CONCURRENCY, len(images))) as executor:
+        results = list(executor.map(push, images))
+    for err, status_code in results:
+        if err:
+            return jsonify({'error': err}), status_code
+    return None
+
+def apply_app(namespace, yaml_content, job=None):
+    """创建命名空间并部署应用，出错时返回错误响应"""
+    # 替换yaml中的CLUSTER_DOMAIN，每次部署使用独立的临时文件，避免并发部署互相覆盖
+    yaml_content = yaml_content.replace('CLUSTER_DOMAIN', CLUSTER_DOMAIN)
+    fd, yaml_path = tempfile.mkstemp(suffix='.yaml')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(yaml_content)
+
+        with stage(job, 'apply'):
+            # 调用kubectl创建命名空间
+            create_namespace_command = 'kubectl create namespace ' + namespace + ' --kubeconfig=/etc/kubernetes/admin.conf'
+            err = run_command(create_namespace_command)
+
+            if err:
+                if 'already exists' not in err:
+                    raise StageFailed('Failed to create namespace, ' + err)
+
+            # 调用kubectl部署应用
+            apply_command = 'kubectl apply -n ' + namespace + ' --kubeconfig=/etc/kubernetes/admin.conf -f ' + yaml_path
+            err = run_command(apply_command)
+
+            if err:
+                raise StageFailed('Failed to apply application, ' + err)
+    except StageFailed as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        os.remove(yaml_path)
+    return None
+
+def upload_deploy_helper(file_path, namespace, appname, images, image_format=FORMAT_DOCKER_ARCHIVE, job=None):
     for image in images:
-        image['path'] = os.path.join(file_path, image['path'].split('/')[-1])
+        if image.get('path'):
+            image['path'] = os.path.join(file_path, image['path'].split('/')[-1])
     with open(os.path.join(file_path, 'app.yaml'), 'r') as file:
         yaml_content = file.read()
 
@@ -80,55 +253,13 @@ def upload_deploy_helper(file_path, namespace, appname, images):
     print('deployAppWithImage, appname:', appname, 'namespace:', namespace, flush=True)
 
     # 加载和推送镜像
-    for image in images:
-        name = image['name'].strip()
-        path = image['path']
+    err_response = push_images(file_path, images, image_format, job)
+    if err_response:
+        return err_response
 
-        # 登录镜像仓库
-        err = run_command('docker login -u admin -p passw0rd sealos.hub:5000')
-        if err:
-            return jsonify({'error': 'Failed to login, ' + err}), 500
-
-        # 加载镜像
-        err = run_command('docker load -i ' + path)
-        if err:
-            return jsonify({'error': 'Failed to load image, ' + err}), 500
-        # 替换域名并推送镜像
-        parts = name.split('/')
-        if len(parts) == 3:
-            new_name = 'sealos.hub:5000/' + '/'.join(parts[1:])
-        elif len(parts) == 1:
-            new_name = 'sealos.hub:5000/library/' + name
-        elif len(parts) == 2:
-            new_name = 'sealos.hub:5000/' + name
-        else:
-            return jsonify({'error': 'Invalid image name: ' + name}), 400
-        err = run_command('docker tag ' + name + ' ' + new_name)
-        if err:
-            return jsonify({'error': 'Failed to tag image, ' + err}), 500
-        err = run_command('docker push ' + new_name)
-        if err:
-            return jsonify({'error': 'Failed to push image, ' + err}), 500
-
-    # 替换yaml中的CLUSTER_DOMAIN
-    new_yaml_content = new_yaml_content.replace('CLUSTER_DOMAIN', CLUSTER_DOMAIN)
-    with open('temp.yaml', 'w') as file:
-        file.write(new_yaml_content)
-
-    # 调用kubectl创建命名空间
-    create_namespace_command = 'kubectl create namespace ' + namespace + ' --kubeconfig=/etc/kubernetes/admin.conf'
-    err = run_command(create_namespace_command)
-
-    if err:
-        if 'already exists' not in err:
-            return jsonify({'error': 'Failed to create namespace, ' + err}), 500
-
-    # 调用kubectl部署应用
-    apply_command = 'kubectl apply -n ' + namespace + ' --kubeconfig=/etc/kubernetes/admin.conf -f temp.yaml'
-    err = run_command(apply_command)
-
-    if err:
-        return jsonify({'error': 'Failed to apply application, ' + err}), 500
+    err_response = apply_app(namespace, new_yaml_content, job)
+    if err_response:
+        return err_response
 
     # 返回成功响应
     detail_url = 'http://' + CLUSTER_DOMAIN + ':32293/app/detail'
@@ -150,19 +281,20 @@ def export_app():
     namespace = request.args.get('namespace')
     if not namespace:
         return jsonify({'error': 'Namespace is required'}), 400
+    # 导出格式：docker-archive（每个镜像一个tar包）或 oci-layout（按层去重）
+    image_format = request.json.get('format') or EXPORT_FORMAT
+    if image_format not in (FORMAT_DOCKER_ARCHIVE, FORMAT_OCI_LAYOUT):
+        return jsonify({'error': 'Invalid format: ' + image_format}), 400
 
     print('exportApp, appname:', request.args.get('appname'), 'namespace:', request.args.get('namespace'), flush=True)
 
-    workdir = os.path.join(SAVE_PATH, namespace, appname)
-    
-    if os.path.exists(workdir):
-        os.system('rm -rf ' + workdir)
-    os.makedirs(workdir)
+    return run_job('export', export_app_job, yaml_content, images, appname, namespace, image_format,
+                   description=namespace + '/' + appname)
 
-    # 保存yaml文件至本地
-    print('write yaml file to:', os.path.join(workdir, 'app.yaml'), flush=True)
-    with open(os.path.join(workdir, 'app.yaml'), 'w') as file:
-        file.write(yaml_content)
+def export_app_job(yaml_content, images, appname, namespace, image_format, job=None):
+    # 保留已有的制品目录，未变化的镜像会被复用，导出完成后再清理不再引用的文件
+    workdir = os.path.join(SAVE_PATH, namespace, appname)
+    os.makedirs(workdir, exist_ok=True)
 
     # 检索yaml中的所有nodeport端口和对应的内部port
     nodeports = []
@@ -173,41 +305,41 @@ def export_app():
                     nodeports.append({'internal_port': str(single_yaml['spec']['ports'][port_index]['port']), 'external_port': ''})
     print('nodeports:', nodeports, flush=True)
 
-    image_pairs = []
-    
     # 登录镜像仓库
     print('login to registry', flush=True)
-    err = run_command('docker login -u admin -p passw0rd sealos.hub:5000')
-    if err:
-        return jsonify({'error': 'Failed to login, ' + err}), 500
+    try:
+        with stage(job, 'login'):
+            err = run_command('docker login -u admin -p passw0rd sealos.hub:5000')
+            if err:
+                raise StageFailed('Failed to login, ' + err)
+    except StageFailed as e:
+        return jsonify({'error': str(e)}), 500
     
-    # 拉取镜像并保存到本地
-    for image in images:
-        name = image['name'].strip()
-        print('pull image:', name, flush=True)
-        image_file_name = name.replace('/', '_').replace(':', '_') + '.tar'
-        path = os.path.join(workdir, image_file_name)
-        image_pairs.append({'name': name, 'path': path})
-        err = run_command('docker pull ' + name)
-        if err:
-            return jsonify({'error': 'Failed to pull image, ' + err}), 500
-        print('save image:', name, flush=True)
-        err = run_command('docker save ' + name + ' -o ' + path)
-        if err:
-            return jsonify({'error': 'Failed to save image, ' + err}), 500
+    # 并发拉取镜像并保存到本地
+    image_pairs, timings, err = export_images([image['name'].strip() for image in images], workdir, image_format,
+                                              keep=('app.yaml', 'metadata.json'), on_stage=stage_recorder(job))
+    if err:
+        return jsonify({'error': err, 'timings': timings}), 500
     
-    # 保存元数据信息
+    # 所有镜像保存完成后再写入yaml文件，导出失败时保留上一次的yaml，与元数据和镜像保持一致
+    print('write yaml file to:', os.path.join(workdir, 'app.yaml'), flush=True)
+    with open(os.path.join(workdir, 'app.yaml'), 'w') as file:
+        file.write(yaml_content)
+
+    # 写入元数据信息
     metadata = {
         'name': appname,
         'namespace': namespace,
+        'format': image_format,
         'images': image_pairs,
-        'nodeports': nodeports
+        'nodeports': nodeports,
+        'timings': timings
     }
     with open(os.path.join(workdir, 'metadata.json'), 'w') as file:
         file.write(json.dumps(metadata))
     
     # 返回成功响应
-    return jsonify({'message': 'Application exported successfully', 'path': workdir, 'url': 'http://' + CLUSTER_DOMAIN + ':5002/api/downloadApp?appname=' + appname + '&namespace=' + namespace}), 200
+    return jsonify({'message': 'Application exported successfully', 'path': workdir, 'timings': timings, 'url': 'http://' + CLUSTER_DOMAIN + ':5002/api/downloadApp?appname=' + appname + '&namespace=' + namespace}), 200
 
 # API端点：打包并下载应用程序
 @app.route('/api/downloadApp', methods=['GET'])
@@ -220,86 +352,75 @@ def download_app():
     if not namespace:
         return jsonify({'error': 'Namespace is required'}), 400
 
-    print('downloadApp, appname:', appname, 'namespace:', namespace, flush=True)
+    mode = request.args.get('mode') or DOWNLOAD_MODE
+
+    print('downloadApp, appname:', appname, 'namespace:', namespace, 'mode:', mode, flush=True)
 
-    # 打包应用程序为zip文件
     workdir = os.path.join(SAVE_PATH, namespace, appname)
+    if not os.path.isdir(workdir):
+        return jsonify({'error': 'Application not found'}), 404
+
+    # 流式模式：边打包边发送，压缩包不落盘
+    if mode == 'stream':
+        response = Response(stream_zip(workdir), content_type='application/zip')
+        response.headers['Content-Disposition'] = 'attachment; filename=' + appname + '.zip'
+        return response
+
+    # 打包应用程序为zip文件，制品内容未变化时复用已有的压缩包
     zip_path = os.path.join(SAVE_PATH, namespace, appname + '.zip')
-    shutil.make_archive(base_name=os.path.splitext(zip_path)[0], format='zip', root_dir=workdir)
-
-    # 以流的形式返回文件
-    def generate():
-        with open(zip_path, 'rb') as file:
-            while True:
-                data = file.read(1024)
-                if not data:
-                    break
-                yield data
-
-    response = Response(generate(), content_type='application/zip')
-    response.headers['Content-Disposition'] = 'attachment; filename=' + appname + '.zip'
-    return response
+    zip_path, etag = cached_archive(workdir, zip_path)
+
+    # 支持 Range/If-Range/If-None-Match，WSGI 服务器支持时通过 sendfile 零拷贝发送
+    return send_file(zip_path, mimetype='application/zip', as_attachment=True, download_name=appname + '.zip',
+                     conditional=True, etag=etag, max_age=0)
 
 # API端点：上传应用程序
 @app.route('/api/uploadApp', methods=['POST'])
 def upload_app():
-    # 检查文件上传
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part in the request'}), 400
-
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No file selected for uploading'}), 400
-
-    # 检查并创建保存路径
-    workdir = os.path.join(SAVE_PATH, 'temp')
-    if not os.path.exists(workdir):
-        os.makedirs(workdir)
-
-    # 保存上传的zip文件
-    zip_path = os.path.join(workdir, file.filename)
-    file.save(zip_path)
-    print('Saved file to:', zip_path, flush=True)
+    # 不经过 request.files，直接从请求体中边接收边解压，支持 multipart 表单和原始 zip 请求体
+    if request.mimetype == 'multipart/form-data':
+        boundary = request.mimetype_params.get('boundary')
+        if not boundary:
+            return jsonify({'error': 'No file part in the request'}), 400
+        chunks = multipart_file_chunks(request.stream, boundary)
+    else:
+        chunks = raw_chunks(request.stream)
 
-    # 解压上传的zip文件
+    # 每个请求使用独立的暂存目录，并发上传互不影响；无论成功与否都删除暂存目录，换入成功后它已不存在
+    staging = new_staging_dir(SAVE_PATH)
     try:
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(workdir)
-        print('Extracted zip file successfully.', flush=True)
-    except zipfile.BadZipFile as e:
-        return jsonify({'error': 'Failed to extract zip file, ' + str(e)}), 500
-
-    # 删除上传的zip文件以释放空间
-    os.remove(zip_path)
+        names = extract_zip_stream(chunks, staging)
+        print('Extracted {} files to: {}'.format(len(names), staging), flush=True)
 
-    # 读取元数据文件（如存在）
-    metadata_path = os.path.join(workdir, 'metadata.json')
-    if os.path.exists(metadata_path):
+        # 读取元数据文件
+        metadata_path = os.path.join(staging, 'metadata.json')
+        if not os.path.exists(metadata_path):
+            return jsonify({'error': 'metadata.json not found in the uploaded file'}), 400
         with open(metadata_path, 'r') as file:
             metadata = json.load(file)
         namespace = metadata['namespace']
         appname = metadata['name']
         images = metadata['images']
+        image_format = metadata.get('format', FORMAT_DOCKER_ARCHIVE)
         print('Loaded metadata:', metadata, flush=True)
-    else:
-        metadata = {}
-
-    new_workdir = os.path.join(SAVE_PATH, namespace, appname)
-    if not os.path.exists(new_workdir):
-        os.makedirs(new_workdir)
-
-    # 移动 workdir 下的所有内容到 new_workdir
-    for item in os.listdir(workdir):
-        src_path = os.path.join(workdir, item)
-        dest_path = os.path.join(new_workdir, item)
-        shutil.move(src_path, dest_path)
 
-    # 删除工作目录
-    os.rmdir(workdir)
-
-    deploy_response = upload_deploy_helper(new_workdir, namespace, appname, images)
+        # 解压完成后整体换入最终目录，目录必须位于 SAVE_PATH 之内
+        new_workdir = app_target(SAVE_PATH, namespace, appname)
+        swap_into_place(staging, new_workdir)
+    except zipfile.BadZipFile as e:
+        return jsonify({'error': 'Failed to extract zip file, ' + str(e)}), 500
+    except KeyError as e:
+        return jsonify({'error': 'Missing key in metadata.json: ' + str(e)}), 400
+    except ValueError as e:
+        # 包括 multipart 解析错误、metadata.json 格式错误和不合法的命名空间或应用名
+        return jsonify({'error': 'Invalid upload, ' + str(e)}), 400
+    except OSError as e:
+        return jsonify({'error': 'Failed to save uploaded file, ' + str(e)}), 500
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
 
-    return deploy_response
+    return run_job('upload', upload_deploy_helper, new_workdir, namespace, appname, images, image_format,
+                   description=namespace + '/' + appname)
 
 # API端点：部署应用程序
 @app.route('/api/deployAppWithImage', methods=['POST'])
@@ -316,7 +437,11 @@ def deploy_app_with_image():
         return jsonify({'error': 'Ports are required'}), 400
     namespace = request.args.get('namespace')
     appname = request.args.get('appname')  # 获取新的appname参数
-    
+
+    return run_job('deploy', deploy_app_job, file_path, ports, namespace, appname, modelName, modelCode,
+                   description=file_path)
+
+def deploy_app_job(file_path, ports, namespace, appname, modelName, modelCode, job=None):
     with open(os.path.join(file_path, 'metadata.json'), 'r') as file:
         metadata = json.load(file)
     old_appname = metadata['name']  # 保存原始appname用于替换
@@ -326,8 +451,10 @@ def deploy_app_with_image():
         appname = old_appname  # 如果没有提供新的appname，使用原来的
         
     images = metadata['images']
+    image_format = metadata.get('format', FORMAT_DOCKER_ARCHIVE)
     for image in images:
-        image['path'] = os.path.join(file_path, image['path'].split('/')[-1])
+        if image.get('path'):
+            image['path'] = os.path.join(file_path, image['path'].split('/')[-1])
     with open(os.path.join(file_path, 'app.yaml'), 'r') as file:
         yaml_content = file.read()
 
@@ -397,55 +524,13 @@ def deploy_app_with_image():
     print('deployAppWithImage, appname:', appname, 'namespace:', namespace, flush=True)
 
     # 加载和推送镜像
-    for image in images:
-        name = image['name'].strip()
-        path = image['path']
-
-        # 登录镜像仓库
-        err = run_command('docker login -u admin -p passw0rd sealos.hub:5000')
-        if err:
-            return jsonify({'error': 'Failed to login, ' + err}), 500
-
-        # 加载镜像
-        err = run_command('docker load -i ' + path)
-        if err:
-            return jsonify({'error': 'Failed to load image, ' + err}), 500
-        # 替换域名并推送镜像
-        parts = name.split('/')
-        if len(parts) == 3:
-            new_name = 'sealos.hub:5000/' + '/'.join(parts[1:])
-        elif len(parts) == 1:
-            new_name = 'sealos.hub:5000/library/' + name
-        elif len(parts) == 2:
-            new_name = 'sealos.hub:5000/' + name
-        else:
-            return jsonify({'error': 'Invalid image name: ' + name}), 400
-        err = run_command('docker tag ' + name + ' ' + new_name)
-        if err:
-            return jsonify({'error': 'Failed to tag image, ' + err}), 500
-        err = run_command('docker push ' + new_name)
-        if err:
-            return jsonify({'error': 'Failed to push image, ' + err}), 500
+    err_response = push_images(file_path, images, image_format, job)
+    if err_response:
+        return err_response
 
-    # 替换yaml中的CLUSTER_DOMAIN
-    new_yaml_content = new_yaml_content.replace('CLUSTER_DOMAIN', CLUSTER_DOMAIN)
-    with open('temp.yaml', 'w') as file:
-        file.write(new_yaml_content)
-
-    # 调用kubectl创建命名空间
-    create_namespace_command = 'kubectl create namespace ' + namespace + ' --kubeconfig=/etc/kubernetes/admin.conf'
-    err = run_command(create_namespace_command)
-
-    if err:
-        if 'already exists' not in err:
-            return jsonify({'error': 'Failed to create namespace, ' + err}), 500
-
-    # 调用kubectl部署应用
-    apply_command = 'kubectl apply -n ' + namespace + ' --kubeconfig=/etc/kubernetes/admin.conf -f temp.yaml'
-    err = run_command(apply_command)
-
-    if err:
-        return jsonify({'error': 'Failed to apply application, ' + err}), 500
+    err_response = apply_app(namespace, new_yaml_content, job)
+    if err_response:
+        return err_response
 
     # 返回成功响应
     detail_url = 'http://' + CLUSTER_DOMAIN + ':32293/app/detail?namespace=' + namespace + '&&name=' + appname
@@ -484,24 +569,41 @@ def load_and_push_image():
     workdir = os.path.join(SAVE_PATH, 'temp')
     os.makedirs(workdir, exist_ok=True)
 
-    # 保存上传的镜像文件
-    image_path = os.path.join(workdir, image_file.filename)
+    # 保存上传的镜像文件，文件名加上随机前缀避免并发上传同名文件时互相覆盖
+    image_path = os.path.join(workdir, uuid.uuid4().hex + '-' + os.path.basename(image_file.filename))
     image_file.save(image_path)
     print('Saved image file to: {}'.format(image_path), flush=True)
 
+    return run_job('push', load_and_push_image_job, image_path, image_name, tag, namespace,
+                   description=namespace + '/' + image_name + ':' + tag)
+
+def load_and_push_image_job(image_path, image_name, tag, namespace, job=None):
     try:
+        # 给镜像打标签，并加上命名空间
+        full_image_name = 'sealos.hub:5000/{}/{}:{}'.format(namespace, image_name, tag)
+        if DEPLOY_PUSH_MODE == 'registry':
+            # 直接从上传的 tar 包推送，不经过 docker
+            try:
+                with stage(job, 'push'):
+                    push_archive(RegistryClient(pool_size=REGISTRY_UPLOAD_CONCURRENCY), image_path, full_image_name)
+            except (RegistryError, requests.RequestException, OSError, KeyError, ValueError, tarfile.TarError) as e:
+                return jsonify({'error': 'Failed to push image: ' + str(e)}), 500
+            print("Pushed image to {}".format(full_image_name), flush=True)
+            return jsonify({'message': 'Image {} loaded, tagged, and pushed successfully'.format(full_image_name)}), 200
+
         # 加载镜像并获取镜像的名称
-        load_output = run_command_loadAndPushImage('docker load -i {}'.format(image_path))
-        print('load_output: {}'.format(load_output))
-        
-        if isinstance(load_output, subprocess.CompletedProcess):
-            load_output_str = load_output.stdout.decode().strip()
-        else:
-            load_output_str = load_output
+        with stage(job, 'load'):
+            load_output = run_command_loadAndPushImage('docker load -i {}'.format(image_path))
+            print('load_output: {}'.format(load_output))
+
+            if isinstance(load_output, subprocess.CompletedProcess):
+                load_output_str = load_output.stdout.decode().strip()
+            else:
+                load_output_str = load_output
 
-        # 确认加载输出中是否包含 'Loaded' 字样
-        if 'Loaded' not in load_output_str:
-            return jsonify({'error': 'Failed to load image: ' + load_output_str}), 500
+            # 确认加载输出中是否包含 'Loaded' 字样
+            if 'Loaded' not in load_output_str:
+                raise StageFailed('Failed to load image: ' + load_output_str)
         print("Loaded image from {}".format(image_path), flush=True)
 
         # 从docker load的输出中提取镜像名称
@@ -509,33 +611,35 @@ def load_and_push_image():
         base_image_name = load_output_str.split('Loaded image: ')[-1]
         print("Base image name extracted: {}".format(base_image_name), flush=True)
 
-        # 给镜像打标签，并加上命名空间
-        full_image_name = 'sealos.hub:5000/{}/{}:{}'.format(namespace, image_name, tag)
         docker_tag_command = 'docker tag {} {}'.format(base_image_name, full_image_name)
         print("Running command: {}".format(docker_tag_command))  # 打印出完整命令
-        err = run_command_loadAndPushImage(docker_tag_command)
+        with stage(job, 'tag'):
+            err = run_command_loadAndPushImage(docker_tag_command)
 
-        # 判断是否出错
-        if isinstance(err, subprocess.CalledProcessError):
-            error_message = err.stderr.decode().strip()  # 获取标准错误信息
-            print("Error during docker tag: {}".format(error_message))
-            return jsonify({'error': 'Failed to tag image: ' + error_message}), 500
+            # 判断是否出错
+            if isinstance(err, subprocess.CalledProcessError):
+                error_message = err.stderr.decode().strip()  # 获取标准错误信息
+                print("Error during docker tag: {}".format(error_message))
+                raise StageFailed('Failed to tag image: ' + error_message)
 
         print("Tagged image as {}".format(full_image_name), flush=True)
 
         # 推送镜像到 sealos.hub
         docker_push_command = 'docker push {}'.format(full_image_name)
         print("Running push command: {}".format(docker_push_command))
-        err = run_command_loadAndPushImage(docker_push_command)
+        with stage(job, 'push'):
+            err = run_command_loadAndPushImage(docker_push_command)
 
-        # 判断推送是否成功
-        if isinstance(err, subprocess.CalledProcessError):
-            error_message = err.stderr.decode().strip()  # 获取标准错误信息
-            print("Error during docker push: {}".format(error_message))
-            return jsonify({'error': 'Failed to push image: ' + error_message}), 500
+            # 判断推送是否成功
+            if isinstance(err, subprocess.CalledProcessError):
+                error_message = err.stderr.decode().strip()  # 获取标准错误信息
+                print("Error during docker push: {}".format(error_message))
+                raise StageFailed('Failed to push image: ' + error_message)
 
         print("Pushed image to {}".format(full_image_name), flush=True)
 
+    except StageFailed as e:
+        return jsonify({'error': str(e)}), 500
     finally:
         # 确保删除临时镜像文件
         if os.path.exists(image_path):
@@ -544,68 +648,44 @@ def load_and_push_image():
     # 返回成功响应
     return jsonify({'message': 'Image {} loaded, tagged, and pushed successfully'.format(full_image_name)}), 200
 
+# API端点：查询后台任务列表
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    jobs = job_engine.list(request.args.get('type'))
+    return jsonify({'jobs': [job.snapshot() for job in jobs]}), 200
+
+# API端点：查询后台任务状态和各阶段耗时
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_engine.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.snapshot()), 200
+
+# API端点：以 SSE 推送后台任务进度
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def get_job_events(job_id):
+    job = job_engine.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0)
+    except ValueError:
+        return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+    response = Response(sse_events(job, last_event_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 def get_cluster_resources():
     """获取集群资源使用情况（基于limits）"""
     try:
-        # 获取节点总容量
-        cmd = "kubectl get nodes --no-headers -o custom-columns=':status.capacity.cpu',':status.capacity.memory' --kubeconfig=/etc/kubernetes/admin.conf"
-        result = subprocess.run(cmd, shell=True, check=True, capture_output=True, universal_newlines=True)
-        
-        # 解析节点容量
-        lines = result.stdout.strip().split('\n')
-        total_cpu = 0
-        total_memory = 0
-        
-        for line in lines:
-            cap_cpu, cap_mem = line.split()
-            total_cpu += float(re.sub(r'[^0-9.]', '', cap_cpu))
-            
-            # 转换内存值为Gi
-            mem_gi = float(re.sub(r'[^0-9.]', '', cap_mem))
-            if 'Ki' in cap_mem:
-                mem_gi /= 1048576
-            elif 'Mi' in cap_mem:
-                mem_gi /= 1024
-            total_memory += mem_gi
-
-        # 获取所有Pod的资源限制
-        cmd = "kubectl get pods --all-namespaces -o json --kubeconfig=/etc/kubernetes/admin.conf"
-        result = subprocess.run(cmd, shell=True, check=True, capture_output=True, universal_newlines=True)
-        pods = json.loads(result.stdout)
-
-        total_cpu_limits = 0
-        total_memory_limits = 0
-
-        for pod in pods['items']:
-            if pod['status']['phase'] in ['Running', 'Pending']:
-                containers = pod['spec'].get('containers', [])
-                for container in containers:
-                    limits = container.get('resources', {}).get('limits', {})
-                    
-                    # 计算CPU限制
-                    if 'cpu' in limits:
-                        cpu_limit = limits['cpu']
-                        if cpu_limit.endswith('m'):
-                            total_cpu_limits += float(cpu_limit[:-1]) / 1000
-                        else:
-                            total_cpu_limits += float(cpu_limit)
-
-                    # 计算内存限制
-                    if 'memory' in limits:
-                        mem_limit = limits['memory']
-                        mem_value = float(re.sub(r'[^0-9.]', '', mem_limit))
-                        if 'Ki' in mem_limit:
-                            total_memory_limits += mem_value / 1048576
-                        elif 'Mi' in mem_limit:
-                            total_memory_limits += mem_value / 1024
-                        elif 'Gi' in mem_limit:
-                            total_memory_limits += mem_value
-                        elif 'Ti' in mem_limit:
-                            total_memory_limits += mem_value * 1024
-
-        # 计算资源使用百分比（基于limits）
-        cpu_usage_percent = (total_cpu_limits / total_cpu) * 100
-        memory_usage_percent = (total_memory_limits / total_memory) * 100
+        if ENABLE_INFORMER and cluster_cache.synced():
+            # 直接读取 watch 维护的总和
+            cpu_usage_percent, memory_usage_percent = cluster_cache.usage()
+        else:
+            # 逐页读取节点和Pod，按列统计limits
+            cpu_usage_percent, memory_usage_percent = ResourceTable.build(list_nodes(), list_pods()).usage()
         
         print("Cluster resources - CPU: {}%, Memory: {}%".format(cpu_usage_percent, memory_usage_percent), flush=True)
         
@@ -614,8 +694,150 @@ def get_cluster_resources():
         print("Error getting cluster resources: {}".format(str(e)))
         return None, None
 
+# API端点：查询集群、节点、命名空间的资源占用，detail=true 时返回包含 requests 和优先级分组的完整统计
+@app.route('/api/clusterResources', methods=['GET'])
+def cluster_resources():
+    if request.args.get('detail') == 'true':
+        try:
+            if ENABLE_INFORMER and cluster_cache.synced():
+                table = ResourceTable.build(cluster_cache.node_informer.items(), cluster_cache.pod_informer.items())
+            else:
+                table = ResourceTable.build(list_nodes(), list_pods())
+        except Exception as e:
+            return jsonify({'error': 'Failed to get cluster resources, ' + str(e)}), 500
+        return jsonify(table.summary()), 200
+    if ENABLE_INFORMER and cluster_cache.synced():
+        return jsonify(cluster_cache.snapshot()), 200
+    cpu_usage, memory_usage = get_cluster_resources()
+    if cpu_usage is None:
+        return jsonify({'error': 'Failed to get cluster resources'}), 500
+    return jsonify({'synced': False, 'cpu_usage_percent': cpu_usage, 'memory_usage_percent': memory_usage}), 200
+
+def get_scaling_usage():
+    """返回缩放判断使用的 (CPU 百分比, 内存百分比)，usage 模式下为 EWMA 平滑后的实际用量"""
+    if SCALING_MODE == 'usage':
+        return usage_tracker.current()
+    return get_cluster_resources()
+
+# usage 模式下的滞回判断，CPU 和内存取较高者
+workload_trigger = Hysteresis(float(RESOURCE_THRESHOLD))
+node_trigger = Hysteresis(float(NODE_ADD_THRESHOLD), float(NODE_DELETE_THRESHOLD))
+# 节点扩容的趋势预测，样本在每次 scale_nodes 时加入
+node_forecaster = Forecaster(float(NODE_ADD_THRESHOLD))
+
+def scaling_metrics_state():
+    result = usage_tracker.snapshot()
+    result['workload_state'] = workload_trigger.state
+    result['node_state'] = node_trigger.state
+    result['history'] = usage_tracker.history()
+    return result
+
+def scaling_forecast_state():
+    result = node_forecaster.forecast()
+    result['enabled'] = ENABLE_PREDICTIVE_SCALING
+    result['history'] = [{'time': t, 'usage': value} for t, value in list(node_forecaster.samples)]
+    return result
+
+def publish_scaling_state():
+    """leader 定时发布缩放状态，供其他 worker 的查询接口使用"""
+    try:
+        shared_state.put('scaling_metrics', scaling_metrics_state())
+        shared_state.put('scaling_forecast', scaling_forecast_state())
+    except Exception as e:
+        print("Error publishing scaling state: {}".format(str(e)), flush=True)
+
+def read_scaling_state(key, build):
+    """leader 或单进程时直接读取内存中的状态，其他 worker 读取 leader 最近发布的快照"""
+    if background_started or shared_state is None:
+        return build()
+    result, published_at = shared_state.get(key)
+    if result is None:
+        return build()
+    result['published_at'] = published_at
+    return result
+
+# API端点：查询缩放使用的实际用量和滞回状态
+@app.route('/api/scalingMetrics', methods=['GET'])
+def scaling_metrics():
+    result = read_scaling_state('scaling_metrics', scaling_metrics_state)
+    if request.args.get('history') != 'true':
+        result.pop('history', None)
+    return jsonify(result), 200
+
+# API端点：查询节点扩容的趋势预测和判断依据
+@app.route('/api/scalingForecast', methods=['GET'])
+def scaling_forecast():
+    result = read_scaling_state('scaling_forecast', scaling_forecast_state)
+    if request.args.get('history') != 'true':
+        result.pop('history', None)
+    return jsonify(result), 200
+
 scale_workloads_flag = False
 
+def get_priority_workloads():
+    """返回带优先级标签的工作负载，优先使用 watch 缓存，否则按标签在服务端过滤后列出"""
+    if ENABLE_INFORMER and workload_cache.synced():
+        return workload_cache.candidates()
+    candidates = []
+    for workload_type in WORKLOAD_TYPES:
+        for workload in list_workloads(workload_type, labelSelector=PRIORITY_LABEL):
+            candidate = priority_candidate(workload_type, workload)
+            if candidate:
+                candidates.append(candidate)
+    return candidates
+
+def get_cluster_capacity():
+    """返回集群总容量 (CPU 核数, 内存 Gi)"""
+    if ENABLE_INFORMER and cluster_cache.synced():
+        return cluster_cache.total_capacity()
+    cpu = memory = 0.0
+    for node in list_nodes():
+        node_cpu, node_memory = node_capacity(node)
+        cpu += node_cpu
+        memory += node_memory
+    return cpu, memory
+
+def workload_key(workload):
+    return workload['type'], workload['namespace'], workload['name']
+
+def workload_exists(workload):
+    try:
+        get_client().get('/apis/apps/v1/namespaces/{}/{}s/{}'.format(workload['namespace'], workload['type'], workload['name']))
+    except KubeError as e:
+        if e.status == 404:
+            return False
+        raise
+    return True
+
+def forget_deleted_workloads(paused):
+    """不再记录已被删除的工作负载，否则它们会一直排在恢复队列中，挡住后面的工作负载"""
+    existing = set(workload_key(workload) for workload in get_priority_workloads())
+    remaining = []
+    for workload in paused:
+        if workload_key(workload) not in existing and not workload_exists(workload):
+            resume_controller.forget(workload)
+            print("Forgot deleted {} {}/{}".format(workload['type'], workload['namespace'], workload['name']))
+        else:
+            remaining.append(workload)
+    return remaining
+
+def resume_paused_workloads(cpu_usage, memory_usage):
+    """使用率回落后按优先级恢复之前暂停的工作负载"""
+    paused = resume_controller.paused()
+    if not paused or not forget_deleted_workloads(paused):
+        return
+    cpu_capacity, memory_capacity = get_cluster_capacity()
+    workloads = resume_controller.select(cpu_usage, memory_usage, cpu_capacity, memory_capacity)
+    resume_controller.record_results(launchpad.resume_workloads(workloads))
+
+# API端点：查询缩放任务暂停、等待恢复的工作负载
+@app.route('/api/pausedWorkloads', methods=['GET'])
+def paused_workloads():
+    try:
+        return jsonify({'workloads': resume_controller.paused()}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 def scale_high_priority_workloads():
     """检查资源使用情况并根据需要缩放工作负载"""
     global scale_workloads_flag
@@ -623,42 +845,41 @@ def scale_high_priority_workloads():
         return
     scale_workloads_flag = True
     try:
-        cpu_usage, memory_usage = get_cluster_resources()
+        cpu_usage, memory_usage = get_scaling_usage()
         if cpu_usage is None or memory_usage is None:
             scale_workloads_flag = False
             return
         
         # 如果CPU或内存使用率超过RESOURCE_THRESHOLD
-        if cpu_usage > float(RESOURCE_THRESHOLD) or memory_usage > float(RESOURCE_THRESHOLD):
+        if SCALING_MODE == 'usage':
+            usage_high = workload_trigger.update(max(cpu_usage, memory_usage)) == STATE_HIGH
+        else:
+            usage_high = cpu_usage > float(RESOURCE_THRESHOLD) or memory_usage > float(RESOURCE_THRESHOLD)
+        since_pause = time.time() - resume_controller.last_times()[0]
+        if usage_high and since_pause < PAUSE_COOLDOWN:
+            # 刚暂停的 Pod 还在平滑值和 metrics-server 的采样窗口中，避免为已经释放的负载再暂停一批
+            print("Resource usage is high, but last pause was {:.0f}s ago, waiting".format(since_pause), flush=True)
+        elif usage_high:
             print("Resource usage is high - CPU: {}%, Memory: {}%".format(cpu_usage, memory_usage))
             
-            # 获取所有deployment和statefulset
-            workload_types = ['deployment', 'statefulset']
-            for workload_type in workload_types:
-                cmd = "kubectl get {} --all-namespaces -o json --kubeconfig=/etc/kubernetes/admin.conf".format(workload_type)
-                result = subprocess.run(cmd, shell=True, check=True, capture_output=True, universal_newlines=True)
-                workloads = json.loads(result.stdout)
-                
-                for workload in workloads['items']:
-                    labels = workload['metadata'].get('labels', {})
-                    priority = labels.get('deploy.cloud.sealos.io/priority', '')
-                    
-                    try:
-                        priority_value = int(priority)
-                        if priority_value > 1:
-                            namespace = workload['metadata']['namespace']
-                            name = workload['metadata']['name']
-                            
-                            # 调用暂停应用的接口
-                            pause_url = "http://{}:32293/api/pauseApp?namespace={}&&appName={}&&isStop=none".format(CLUSTER_DOMAIN, namespace, name)
-                            response = requests.get(pause_url)
-                            
-                            if response.status_code == 200:
-                                print("Paused {} {}/{} successfully".format(workload_type, namespace, name))
-                            else:
-                                print("Failed to pause {} {}/{}: {}".format(workload_type, namespace, name, response.text))
-                    except ValueError:
-                        continue
+            # 只暂停足够让使用率回到阈值以下的工作负载，usage 模式下要回到滞回区间以下
+            target = float(RESOURCE_THRESHOLD) - (workload_trigger.margin if SCALING_MODE == 'usage' else 0)
+            cpu_capacity, memory_capacity = get_cluster_capacity()
+            cpu_excess = (cpu_usage - target) / 100 * cpu_capacity
+            memory_excess = (memory_usage - target) / 100 * memory_capacity
+            workloads = select_workloads(get_priority_workloads(), cpu_excess, memory_excess, cpu_capacity, memory_capacity)
+            print("Pausing {} workloads to free {:.2f} cores, {:.2f}Gi".format(
+                len(workloads), max(cpu_excess, 0), max(memory_excess, 0)), flush=True)
+
+            # 并发调用暂停应用的接口
+            for workload, ok, _, message in launchpad.pause_workloads(workloads):
+                if ok:
+                    resume_controller.record_paused(workload)
+                    print("Paused {} {}/{} successfully".format(workload['type'], workload['namespace'], workload['name']))
+                else:
+                    print("Failed to pause {} {}/{}: {}".format(workload['type'], workload['namespace'], workload['name'], message))
+        else:
+            resume_paused_workloads(cpu_usage, memory_usage)
         
         scale_workloads_flag = False
     except Exception as e:
@@ -681,6 +902,7 @@ def add_node():
     
     try:
         add_node_to_cluster(node_ip, MASTER_IP, cluster_name, user, passwd, pk, pk_passwd, port)
+        read_cache.invalidate('cluster-nodes')
         return jsonify({'message': 'Node added successfully'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -697,49 +919,116 @@ def delete_node():
     
     try:
         delete_node_from_cluster(node_ip, MASTER_IP, cluster_name, force)
+        read_cache.invalidate('cluster-nodes')
         return jsonify({'message': 'Node deleted successfully'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 CONFIGMAP_NAME = "backup-nodes-config"
+# 更新备用节点列表遇到冲突时的最多尝试次数
+CONFIGMAP_UPDATE_RETRIES = 5
 NAMESPACE = "default"
 
+CONFIGMAP_PATH = f"/api/v1/namespaces/{NAMESPACE}/configmaps"
+
 def init_configmap():
-    cmd = f"kubectl create configmap {CONFIGMAP_NAME} -n {NAMESPACE} --from-literal=backup_nodes='[]' --kubeconfig=/etc/kubernetes/admin.conf"
     try:
-        subprocess.run(cmd, shell=True, check=True)
-    except subprocess.CalledProcessError as e:
-        # print(f"Error creating configmap: {e}")
-        pass
+        get_client().post(CONFIGMAP_PATH, {
+            'apiVersion': 'v1',
+            'kind': 'ConfigMap',
+            'metadata': {'name': CONFIGMAP_NAME, 'namespace': NAMESPACE},
+            'data': {'backup_nodes': '[]'}
+        })
+    except KubeError as e:
+        # 已存在时返回 409
+        if e.status != 409:
+            print(f"Error creating configmap: {e}", flush=True)
+    except Exception as e:
+        print(f"Error creating configmap: {e}", flush=True)
 
 def get_configmap():
-    cmd = f"kubectl get configmap {CONFIGMAP_NAME} -n {NAMESPACE} -o json --kubeconfig=/etc/kubernetes/admin.conf"
-    result = subprocess.run(cmd, shell=True, check=True, capture_output=True, universal_newlines=True)
-    return json.loads(result.stdout)
+    return get_client().get(f"{CONFIGMAP_PATH}/{CONFIGMAP_NAME}")
 
-def update_configmap(data):
-    cmd = f"kubectl patch configmap {CONFIGMAP_NAME} -n {NAMESPACE} --patch '{json.dumps(data)}' --kubeconfig=/etc/kubernetes/admin.conf"
-    subprocess.run(cmd, shell=True, check=True)
+def update_backup_nodes(change):
+    """用 change(当前列表) 返回的新列表更新 backup_nodes，返回 (更新前, 更新后)
+
+    只 patch backup_nodes 一个键，并带上读取时的 resourceVersion，被其他请求抢先修改时重新读取后重试
+    """
+    for attempt in range(CONFIGMAP_UPDATE_RETRIES):
+        configmap = get_configmap()
+        backup_nodes = json.loads((configmap.get('data') or {}).get('backup_nodes', '[]'))
+        updated = change(list(backup_nodes))
+        if updated == backup_nodes:
+            return backup_nodes, updated
+        try:
+            get_client().patch(f"{CONFIGMAP_PATH}/{CONFIGMAP_NAME}", {
+                'metadata': {'resourceVersion': configmap['metadata']['resourceVersion']},
+                'data': {'backup_nodes': json.dumps(updated)}
+            }, PATCH_MERGE)
+        except KubeError as e:
+            if e.status != 409:
+                raise
+            time.sleep(0.1 * (attempt + 1))
+            continue
+        read_cache.invalidate('backup-nodes')
+        return backup_nodes, updated
+    raise KubeError(409, 'Conflict updating {} after {} attempts'.format(CONFIGMAP_NAME, CONFIGMAP_UPDATE_RETRIES))
+
+def request_node_ips():
+    """读取批量接口的 node_ips 参数，去重并保持顺序，参数不合法时返回 None"""
+    node_ips = (request.json or {}).get('node_ips')
+    if not isinstance(node_ips, list) or not node_ips or not all(isinstance(ip, str) and ip for ip in node_ips):
+        return None
+    return list(dict.fromkeys(node_ips))
 
 def get_cluster_node_ips():
-    cmd = "kubectl get nodes --no-headers -o custom-columns=':status.addresses[0].address' --kubeconfig=/etc/kubernetes/admin.conf"
-    result = subprocess.run(cmd, shell=True, check=True, capture_output=True, universal_newlines=True)
-    return result.stdout.strip().split('\n')
+    return [node['status']['addresses'][0]['address'] for node in list_nodes()]
+
+def drain_backup_nodes(node_ips):
+    """并发驱逐节点上的 Pod，返回驱逐完成的节点 IP；未完成的节点取消封锁后保留"""
+    names = {node['status']['addresses'][0]['address']: node['metadata']['name'] for node in list_nodes()}
+
+    def drain(node_ip):
+        name = names.get(node_ip)
+        if name is None:
+            return True
+        try:
+            if drain_node(name):
+                return True
+            print("Timed out draining node {}, keeping it".format(node_ip), flush=True)
+        except Exception as e:
+            print("Error draining node {}: {}".format(node_ip, str(e)), flush=True)
+        uncordon_node(name)
+        return False
+
+    with ThreadPoolExecutor(max_workers=max(1, NODE_DRAIN_CONCURRENCY)) as executor:
+        drained = list(executor.map(drain, node_ips))
+    return [node_ip for node_ip, ok in zip(node_ips, drained) if ok]
+
+def cached_json(key, loader):
+    """从 read_cache 读取结果，带 ETag 返回；If-None-Match 与当前 ETag 相同时返回 304"""
+    value, etag = read_cache.get(key, loader)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(value)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/cluster-nodes', methods=['GET'])
 def get_cluster_nodes():
     try:
-        nodes = get_cluster_node_ips()
-        return jsonify({'nodes': nodes}), 200
+        return cached_json('cluster-nodes', lambda: {'nodes': get_cluster_node_ips()})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/backup-nodes', methods=['GET'])
 def get_backup_nodes():
     try:
-        configmap = get_configmap()
-        backup_nodes = configmap['data'].get('backup_nodes', '[]')
-        return jsonify({'backup_nodes': json.loads(backup_nodes)}), 200
+        return cached_json('backup-nodes', lambda: {
+            'backup_nodes': json.loads(get_configmap()['data'].get('backup_nodes', '[]'))
+        })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -750,15 +1039,10 @@ def add_backup_node():
         if not node_ip:
             return jsonify({'error': 'node_ip is required'}), 400
         
-        configmap = get_configmap()
-        backup_nodes = json.loads(configmap['data'].get('backup_nodes', '[]'))
+        backup_nodes, _ = update_backup_nodes(lambda nodes: nodes if node_ip in nodes else nodes + [node_ip])
         if node_ip in backup_nodes:
             return jsonify({'error': 'Node already exists'}), 400
         
-        backup_nodes.append(node_ip)
-        configmap['data']['backup_nodes'] = json.dumps(backup_nodes)
-        update_configmap(configmap)
-        
         return jsonify({'message': 'Node added successfully'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -770,20 +1054,64 @@ def delete_backup_node():
         if not node_ip:
             return jsonify({'error': 'node_ip is required'}), 400
         
-        configmap = get_configmap()
-        backup_nodes = json.loads(configmap['data'].get('backup_nodes', '[]'))
+        backup_nodes, _ = update_backup_nodes(lambda nodes: [node for node in nodes if node != node_ip])
         if node_ip not in backup_nodes:
             return jsonify({'error': 'Node not found'}), 404
         
-        backup_nodes.remove(node_ip)
-        configmap['data']['backup_nodes'] = json.dumps(backup_nodes)
-        update_configmap(configmap)
-        
         return jsonify({'message': 'Node deleted successfully'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# API端点：批量添加备用节点，一次读取和一次 patch
+@app.route('/backup-nodes/batch', methods=['POST'])
+def add_backup_nodes():
+    try:
+        node_ips = request_node_ips()
+        if node_ips is None:
+            return jsonify({'error': 'node_ips must be a non-empty list'}), 400
+        backup_nodes, _ = update_backup_nodes(lambda nodes: nodes + [ip for ip in node_ips if ip not in nodes])
+        return jsonify({
+            'added': [ip for ip in node_ips if ip not in backup_nodes],
+            'existing': [ip for ip in node_ips if ip in backup_nodes]
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# API端点：批量删除备用节点
+@app.route('/backup-nodes/batch', methods=['DELETE'])
+def delete_backup_nodes():
+    try:
+        node_ips = request_node_ips()
+        if node_ips is None:
+            return jsonify({'error': 'node_ips must be a non-empty list'}), 400
+        backup_nodes, _ = update_backup_nodes(lambda nodes: [node for node in nodes if node not in node_ips])
+        return jsonify({
+            'removed': [ip for ip in node_ips if ip in backup_nodes],
+            'not_found': [ip for ip in node_ips if ip not in backup_nodes]
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 scale_nodes_flag = False
+# 已执行 sealos add、等待 Ready 的批次：(开始加入的时间, 节点 IP 集合)
+pending_node_adds = []
+# 超过该秒数仍未 Ready 的批次不再等待，也不计入加入耗时
+NODE_READY_WAIT_SECONDS = 3600
+
+def record_ready_nodes(nodes):
+    """批次中的节点全部 Ready 后，把从开始加入到 Ready 的耗时计入预测的提前量"""
+    now = time.time()
+    ready_ips = set(node['status']['addresses'][0]['address'] for node in nodes if node_ready(node) == 'True')
+    for batch in list(pending_node_adds):
+        started, node_ips = batch
+        node_ips -= ready_ips
+        if not node_ips:
+            pending_node_adds.remove(batch)
+            print("Nodes became ready {:.0f}s after adding".format(now - started), flush=True)
+            node_forecaster.record_add_duration(now - started)
+        elif now - started > NODE_READY_WAIT_SECONDS:
+            pending_node_adds.remove(batch)
+            print("Nodes {} not ready after {}s".format(sorted(node_ips), NODE_READY_WAIT_SECONDS), flush=True)
 
 def scale_nodes():
     global scale_nodes_flag
@@ -803,13 +1131,32 @@ def scale_nodes():
         backup_nodes_in = [node for node in backup_nodes if node in current_nodes]
 
         # if current cpu usage is above 80%
-        cpu_usage, memory_usage = get_cluster_resources()
+        cpu_usage, memory_usage = get_scaling_usage()
         if cpu_usage is None or memory_usage is None:
             print("Error getting cluster resources")
             scale_nodes_flag = False
             return
 
-        if cpu_usage > float(NODE_ADD_THRESHOLD) or memory_usage > float(NODE_ADD_THRESHOLD):
+        if SCALING_MODE == 'usage':
+            state = node_trigger.update(max(cpu_usage, memory_usage))
+            scale_up, scale_down = state == STATE_HIGH, state == STATE_LOW
+        else:
+            scale_up = cpu_usage > float(NODE_ADD_THRESHOLD) or memory_usage > float(NODE_ADD_THRESHOLD)
+            scale_down = cpu_usage < float(NODE_DELETE_THRESHOLD) and memory_usage < float(NODE_DELETE_THRESHOLD)
+
+        # 加入节点需要几分钟，预测到在节点 Ready 之前会超过阈值时提前扩容
+        forecast = node_forecaster.observe(max(cpu_usage, memory_usage))
+        if not scale_up and ENABLE_PREDICTIVE_SCALING and forecast['scale_up']:
+            print("Predictive scale up: {}".format(forecast['reason']), flush=True)
+            scale_up = True
+
+        # 按平均节点容量估算需要增减的节点数，预测扩容时按预测值计算
+        usage = max(cpu_usage, memory_usage)
+        if ENABLE_PREDICTIVE_SCALING and forecast['scale_up'] and forecast['projected'] is not None:
+            usage = max(usage, forecast['projected'])
+        node_count = len(current_nodes)
+
+        if scale_up:
             print("Cluster resources - CPU: {}%, Memory: {}%".format(cpu_usage, memory_usage))
             print("Current nodes: {}".format(current_nodes))
             print("Backup nodes: {}".format(backup_nodes))
@@ -820,28 +1167,38 @@ def scale_nodes():
             pk = '/root/.ssh/id_rsa'
             pk_passwd = ''
             port = 22
-            # if there are backup nodes available
-            if len(backup_nodes_out) > 0:
-                add_node_to_cluster(backup_nodes_out[0], MASTER_IP, cluster_name, user, passwd, pk, pk_passwd, port)
+            # sealos add 一次加入多个节点，节点之间并行加入
+            nodes_to_add = backup_nodes_out[:max(1, node_deficit(usage, node_count, float(NODE_ADD_THRESHOLD)))]
+            if len(nodes_to_add) > 0:
+                print("Adding nodes: {}".format(nodes_to_add), flush=True)
+                started = time.time()
+                add_node_to_cluster(','.join(nodes_to_add), MASTER_IP, cluster_name, user, passwd, pk, pk_passwd, port)
+                # sealos 返回时节点不一定 Ready，之后每次检查节点状态时确认
+                pending_node_adds.append((started, set(nodes_to_add)))
+                # 节点数变化后利用率的基准不同，重新积累样本
+                node_forecaster.reset()
         
-        if cpu_usage < float(NODE_DELETE_THRESHOLD) and memory_usage < float(NODE_DELETE_THRESHOLD):
+        if scale_down:
             cluster_name = 'default'
-            for node in backup_nodes_in:
-                delete_node_from_cluster(node, MASTER_IP, cluster_name, force=True)
+            # 移除后使用率回到两个阈值的中间，避免移除后马上又要扩容
+            target = (float(NODE_ADD_THRESHOLD) + float(NODE_DELETE_THRESHOLD)) / 2
+            surplus = -node_deficit(usage, node_count, target)
+            nodes_to_delete = drain_backup_nodes(backup_nodes_in[:surplus]) if surplus > 0 else []
+            if nodes_to_delete:
+                print("Deleting nodes: {}".format(nodes_to_delete), flush=True)
+                # Pod 已经驱逐完成，--force 只用于跳过确认
+                delete_node_from_cluster(','.join(nodes_to_delete), MASTER_IP, cluster_name, force=True)
+                node_forecaster.reset()
                     
-        cmd = "kubectl get nodes --no-headers -o custom-columns=':metadata.name',':status.conditions[?(@.type==\"Ready\")].status' --kubeconfig=/etc/kubernetes/admin.conf"
-        result = subprocess.run(cmd, shell=True, check=True, capture_output=True, universal_newlines=True)
-        lines = result.stdout.strip().split('\n')
-        
-        for line in lines:
-            parts = line.split()
-            node_name = parts[0]
-            ready = parts[1]
+        nodes = list_nodes()
+        record_ready_nodes(nodes)
+        for node in nodes:
+            node_name = node['metadata']['name']
+            ready = node_ready(node)
             
             if node_name in backup_nodes and ready == 'True':
                 print(f"Node {node_name} is ready, cordoning it")
-                cmd = f"kubectl cordon {node_name} --kubeconfig=/etc/kubernetes/admin.conf"
-                subprocess.run(cmd, shell=True, check=True)
+                cordon_node(node_name)
         
         scale_nodes_flag = False
 
@@ -955,8 +1312,10 @@ def stress_testing_api():
         test_data = request.args.get('test_data')
         qps = request.args.get('qps')
         max_latency = request.args.get('max_latency')
-        stress_test(stress_id, stress_type, namespace, app_list, port, core_api, test_data, qps, max_latency)
-        return jsonify({'message': 'Stress testing started successfully'}), 200
+        job = stress_test(stress_id, stress_type, namespace, app_list, port, core_api, test_data, qps, max_latency,
+                          job_engine.submit)
+        return jsonify({'message': 'Stress testing started successfully', 'job_id': job.id,
+                        'status_url': '/api/jobs/' + job.id}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -991,9 +1350,32 @@ def mock_run_test_api():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-if __name__ == '__main__':
+scheduler = None
+background_started = False
+
+def job_running(job_id):
+    """任务仍在本进程或其他 worker 中排队或运行"""
+    job = job_engine.get(job_id)
+    return job is not None and not job.finished()
+
+def init_app():
+    """每个进程启动时执行的初始化，可以重复执行"""
     init_db()
+    reap_orphan_results(job_running)
+    resume_controller.init_db()
     init_configmap()
+
+def start_informers():
+    """启动集群资源的 watch 缓存，只读接口使用，每个 worker 进程都启动"""
+    if ENABLE_INFORMER:
+        cluster_cache.start()
+
+def start_background_tasks():
+    """启动工作负载缓存和定时缩放任务，多进程部署时只在持有 leader 锁的进程中执行"""
+    global scheduler, background_started
+    background_started = True
+    if ENABLE_INFORMER:
+        workload_cache.start()
     # 创建定时任务调度器
     if ENABLE_WORKLOAD_SCALING or ENABLE_NODE_SCALING:
         scheduler = BackgroundScheduler()
@@ -1001,9 +1383,25 @@ if __name__ == '__main__':
             scheduler.add_job(scale_high_priority_workloads, 'interval', minutes=1)
         if ENABLE_NODE_SCALING:
             scheduler.add_job(scale_nodes, 'interval', minutes=1)
+        if SCALING_MODE == 'usage':
+            scheduler.add_job(usage_tracker.sample, 'interval', seconds=METRICS_INTERVAL)
+        if shared_state:
+            scheduler.add_job(publish_scaling_state, 'interval', seconds=METRICS_INTERVAL)
         scheduler.start()
+
+def stop_background_tasks():
+    if scheduler:
+        scheduler.shutdown()
+    cluster_cache.stop()
+    workload_cache.stop()
+
+if __name__ == '__main__':
+    # 开发模式：单进程，生产环境使用 gunicorn -c gunicorn.conf.py wsgi:app
+    init_app()
+    start_informers()
+    start_background_tasks()
     try:
         app.run(debug=True, host='0.0.0.0', port=5002)
     finally:
-        scheduler.shutdown()
+        stop_background_tasks()
 
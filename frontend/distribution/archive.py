@@ -0,0 +1,122 @@
+import hashlib
+import os
+import threading
+import uuid
+import zipfile
+
+# 环境变量：下载时每次读取的字节数
+DOWNLOAD_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CHUNK_SIZE') or str(1024 * 1024))
+# 只有这些文本文件需要压缩，镜像 tar 包和 blob 原样存储，避免无意义的重复压缩
+DEFLATE_SUFFIXES = ('.yaml', '.yml', '.json')
+
+class _ChunkSink:
+    """zipfile 的输出目标，不可 seek，写入的数据由生成器取走后发送给客户端"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks = self.chunks
+        self.chunks = []
+        return chunks
+
+def list_files(workdir):
+    """按固定顺序返回 workdir 中的所有文件 (绝对路径, 压缩包内路径)"""
+    items = []
+    for root, dirs, files in os.walk(workdir):
+        dirs.sort()
+        for file_name in sorted(files):
+            path = os.path.join(root, file_name)
+            items.append((path, os.path.relpath(path, workdir)))
+    return items
+
+def _zip_info(path, arcname):
+    # from_file 会记录文件大小，超过 4G 的文件据此自动使用 zip64
+    zinfo = zipfile.ZipInfo.from_file(path, arcname)
+    if arcname.endswith(DEFLATE_SUFFIXES):
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+    else:
+        zinfo.compress_type = zipfile.ZIP_STORED
+    return zinfo
+
+def stream_zip(workdir, chunk_size=None):
+    """边打包边输出 zip 数据，压缩包不会写入磁盘"""
+    chunk_size = chunk_size or DOWNLOAD_CHUNK_SIZE
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as zf:
+        for path, arcname in list_files(workdir):
+            with open(path, 'rb') as src, zf.open(_zip_info(path, arcname), 'w') as dst:
+                while True:
+                    data = src.read(chunk_size)
+                    if not data:
+                        break
+                    dst.write(data)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
+
+def archive_etag(workdir):
+    """根据 metadata.json 的内容计算制品的 ETag"""
+    sha256 = hashlib.sha256()
+    metadata_path = os.path.join(workdir, 'metadata.json')
+    if os.path.exists(metadata_path):
+        with open(metadata_path, 'rb') as file:
+            sha256.update(file.read())
+    else:
+        for path, arcname in list_files(workdir):
+            stat = os.stat(path)
+            sha256.update('{}:{}:{}\n'.format(arcname, stat.st_size, stat.st_mtime_ns).encode())
+    return sha256.hexdigest()[:32]
+
+def _newest_mtime(workdir):
+    newest = os.stat(workdir).st_mtime
+    for path, _ in list_files(workdir):
+        newest = max(newest, os.stat(path).st_mtime)
+    return newest
+
+_build_locks = {}
+_build_locks_lock = threading.Lock()
+
+def _build_lock(zip_path):
+    with _build_locks_lock:
+        if zip_path not in _build_locks:
+            _build_locks[zip_path] = threading.Lock()
+        return _build_locks[zip_path]
+
+def cached_archive(workdir, zip_path, chunk_size=None):
+    """返回 (zip_path, etag)，只有制品内容变化时才重新打包"""
+    chunk_size = chunk_size or DOWNLOAD_CHUNK_SIZE
+    etag_path = zip_path + '.etag'
+    with _build_lock(zip_path):
+        etag = archive_etag(workdir)
+        if os.path.exists(zip_path) and os.path.exists(etag_path):
+            with open(etag_path, 'r') as file:
+                cached_etag = file.read().strip()
+            if cached_etag == etag and _newest_mtime(workdir) <= os.stat(zip_path).st_mtime:
+                return zip_path, etag
+
+        print('build archive:', zip_path, flush=True)
+        temp_path = zip_path + '.tmp-' + uuid.uuid4().hex
+        try:
+            with zipfile.ZipFile(temp_path, 'w', allowZip64=True) as zf:
+                for path, arcname in list_files(workdir):
+                    with open(path, 'rb') as src, zf.open(_zip_info(path, arcname), 'w') as dst:
+                        while True:
+                            data = src.read(chunk_size)
+                            if not data:
+                                break
+                            dst.write(data)
+            os.replace(temp_path, zip_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        with open(etag_path, 'w') as file:
+            file.write(etag)
+        return zip_path, etag
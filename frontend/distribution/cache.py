@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# 环境变量：只读查询结果的缓存秒数
+READ_CACHE_TTL = float(os.getenv('READ_CACHE_TTL') or '5')
+
+def make_etag(value):
+    """按内容计算 ETag（不带引号），内容不变时 ETag 不变"""
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()[:20]
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlightCache:
+    """短时缓存只读查询的结果；同一个键同时只有一个加载在进行，并发的调用方等待并共享它的结果"""
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else READ_CACHE_TTL
+        self.entries = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, loader):
+        """返回 (值, ETag)，缓存过期时调用 loader() 重新加载"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.time():
+                return entry[1], entry[2]
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            value = loader()
+            call.result = (value, make_etag(value))
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                # 加载期间被 invalidate 时，calls 中已经不是这次加载，结果不写入缓存
+                if self.calls.get(key) is call:
+                    del self.calls[key]
+                    if call.error is None:
+                        self.entries[key] = (time.time() + self.ttl, call.result[0], call.result[1])
+            call.done.set()
+        return call.result
+
+    def invalidate(self, key):
+        """写操作之后调用，之后的读取重新加载"""
+        with self.lock:
+            self.entries.pop(key, None)
+            self.calls.pop(key, None)
+
+class SharedSnapshots:
+    """通过 sqlite 在 worker 进程之间共享快照，只有运行定时任务的 leader 写入，其他 worker 读取"""
+
+    def __init__(self, database):
+        self.database = database
+        self.local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS shared_snapshots (
+            key TEXT PRIMARY KEY,
+            updated_at REAL NOT NULL,
+            data TEXT NOT NULL
+        )
+        ''')
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = sqlite3.connect(self.database, timeout=30)
+        return conn
+
+    def put(self, key, value):
+        conn = self._conn()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO shared_snapshots (key, updated_at, data) VALUES (?, ?, ?)',
+                         (key, time.time(), json.dumps(value)))
+
+    def get(self, key):
+        """返回 (值, 写入时间)，没有快照时返回 (None, None)"""
+        row = self._conn().execute('SELECT data, updated_at FROM shared_snapshots WHERE key = ?', (key,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else (None, None)
@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+from collections import deque
+import numpy as np
+
+# 环境变量：是否在预测到即将超过扩容阈值时提前扩容
+ENABLE_PREDICTIVE_SCALING = bool((os.getenv('ENABLE_PREDICTIVE_SCALING') or 'false') == 'true')
+# 环境变量：拟合趋势使用的历史时长（秒）
+FORECAST_WINDOW_SECONDS = int(os.getenv('FORECAST_WINDOW_SECONDS') or '1800')
+# 环境变量：拟合需要的最少样本数
+FORECAST_MIN_SAMPLES = int(os.getenv('FORECAST_MIN_SAMPLES') or '5')
+# 环境变量：趋势拟合优度 R² 的下限，低于该值认为没有明显趋势
+FORECAST_MIN_R2 = float(os.getenv('FORECAST_MIN_R2') or '0.6')
+# 环境变量：新节点从开始加入到 Ready 的预估秒数，有实测值后使用实测值
+NODE_ADD_LEAD_SECONDS = float(os.getenv('NODE_ADD_LEAD_SECONDS') or '600')
+# 实测加入耗时的 EWMA 系数
+LEAD_TIME_ALPHA = 0.5
+
+class Forecaster:
+    """保存集群利用率的滚动历史，用线性趋势预测何时超过阈值"""
+
+    def __init__(self, threshold, window=None, min_samples=None, min_r2=None, lead_time=None):
+        self.threshold = threshold
+        self.window = window or FORECAST_WINDOW_SECONDS
+        self.min_samples = min_samples or FORECAST_MIN_SAMPLES
+        self.min_r2 = min_r2 if min_r2 is not None else FORECAST_MIN_R2
+        self.lead_time = lead_time or NODE_ADD_LEAD_SECONDS
+        self.measured_lead_time = None
+        self.samples = deque()
+        self.last = None
+        self.lock = threading.Lock()
+
+    def reset(self):
+        """节点数变化后旧样本的容量基准已经不同，清空历史"""
+        with self.lock:
+            self.samples.clear()
+
+    def record_add_duration(self, seconds):
+        with self.lock:
+            if self.measured_lead_time is None:
+                self.measured_lead_time = seconds
+            else:
+                self.measured_lead_time = LEAD_TIME_ALPHA * seconds + (1 - LEAD_TIME_ALPHA) * self.measured_lead_time
+
+    def effective_lead_time(self):
+        return self.measured_lead_time if self.measured_lead_time is not None else self.lead_time
+
+    def observe(self, value, timestamp=None):
+        """加入一个利用率样本（百分比）并返回预测结果"""
+        timestamp = timestamp or time.time()
+        with self.lock:
+            self.samples.append((timestamp, value))
+            while self.samples and self.samples[0][0] < timestamp - self.window:
+                self.samples.popleft()
+        return self.forecast(timestamp)
+
+    def forecast(self, now=None):
+        """拟合 value = slope * t + intercept，返回预测结果和判断依据"""
+        now = now or time.time()
+        with self.lock:
+            samples = list(self.samples)
+        lead_time = self.effective_lead_time()
+        result = {
+            'time': now,
+            'threshold': self.threshold,
+            'samples': len(samples),
+            'lead_time_seconds': lead_time,
+            'current': samples[-1][1] if samples else None,
+            'slope_per_minute': None,
+            'r2': None,
+            'projected': None,
+            'seconds_to_breach': None,
+            'scale_up': False
+        }
+        if len(samples) < self.min_samples:
+            result['reason'] = 'Not enough samples ({} < {})'.format(len(samples), self.min_samples)
+            return self._remember(result)
+
+        times = np.array([sample[0] for sample in samples]) - now
+        values = np.array([sample[1] for sample in samples])
+        if np.ptp(times) == 0:
+            result['reason'] = 'Samples have no time spread'
+            return self._remember(result)
+        slope, intercept = np.polyfit(times, values, 1)
+        fitted = slope * times + intercept
+        total = np.sum((values - values.mean()) ** 2)
+        r2 = 1.0 - np.sum((values - fitted) ** 2) / total if total > 0 else 0.0
+        projected = intercept + slope * lead_time
+        result.update({
+            'slope_per_minute': float(slope * 60),
+            'r2': float(r2),
+            'projected': float(projected)
+        })
+
+        if intercept >= self.threshold:
+            result['reason'] = 'Trend is already above the threshold'
+            return self._remember(result)
+        if slope <= 0:
+            result['reason'] = 'Utilization is not rising'
+            return self._remember(result)
+        seconds_to_breach = (self.threshold - intercept) / slope
+        result['seconds_to_breach'] = float(seconds_to_breach)
+        if r2 < self.min_r2:
+            result['reason'] = 'Trend is too noisy (r2 {:.2f} < {:.2f})'.format(r2, self.min_r2)
+        elif seconds_to_breach > lead_time:
+            result['reason'] = 'Breach in {:.0f}s, later than the {:.0f}s needed to add a node'.format(
+                seconds_to_breach, lead_time)
+        else:
+            result['scale_up'] = True
+            result['reason'] = 'Breach in {:.0f}s, within the {:.0f}s needed to add a node'.format(
+                seconds_to_breach, lead_time)
+        return self._remember(result)
+
+    def _remember(self, result):
+        with self.lock:
+            self.last = result
+        return result
@@ -0,0 +1,15 @@
+import os
+
+# 环境变量：监听地址
+bind = os.getenv('WEB_BIND') or '0.0.0.0:5002'
+# 环境变量：worker 进程数
+workers = int(os.getenv('WEB_WORKERS') or '4')
+# 环境变量：每个 worker 的线程数，导出等长请求只占用一个线程
+threads = int(os.getenv('WEB_THREADS') or '8')
+worker_class = 'gthread'
+# gthread worker 的心跳与请求线程无关，长时间的导出和上传不会触发超时
+timeout = 120
+graceful_timeout = 60
+keepalive = 5
+accesslog = '-'
+errorlog = '-'
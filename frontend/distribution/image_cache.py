@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+import subprocess
+import time
+import uuid
+from image_layout import blob_path, read_manifest, save_layered
+
+# 环境变量：是否启用导出镜像缓存
+EXPORT_CACHE = bool((os.getenv('EXPORT_CACHE') or 'true') == 'true')
+# 环境变量：镜像缓存目录，需要与 SAVE_PATH 在同一文件系统上才能硬链接
+EXPORT_CACHE_PATH = os.getenv('EXPORT_CACHE_PATH') or os.path.join(os.getenv('SAVE_PATH') or '.', '.cache')
+# 环境变量：未被任何制品引用的缓存保留天数
+EXPORT_CACHE_TTL_DAYS = float(os.getenv('EXPORT_CACHE_TTL_DAYS') or '7')
+
+def image_id(name):
+    """返回本地镜像的 ID（即 config 的摘要），镜像不存在时返回 None"""
+    result = subprocess.run(['docker', 'image', 'inspect', '--format', '{{.Id}}', name],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip() or None
+
+def link_or_copy(src, dst):
+    """硬链接缓存文件到制品目录，跨文件系统时退化为复制"""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    # 用访问时间记录缓存的使用，避免被 prune_cache 清理；mtime 保持不变，
+    # 否则硬链接到制品目录的文件也会变新，下载时会重新打包
+    os.utime(src, (time.time(), os.stat(src).st_mtime))
+    if os.path.exists(dst):
+        if os.path.samefile(src, dst):
+            return
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+def _docker_save(name, path):
+    result = subprocess.run(['docker', 'save', name, '-o', path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        print("Error executing command: " + result.stderr.decode().strip(), flush=True)
+        return result.stderr.decode().strip()
+    return None
+
+def _temp_path(directory):
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, '.tmp-' + uuid.uuid4().hex)
+
+def save_archive(name, path):
+    """导出 docker-archive 格式的镜像，返回 (cached, error)"""
+    digest = image_id(name) if EXPORT_CACHE else None
+    if not digest:
+        # 旧文件可能是缓存的硬链接，先删除避免 docker save 原地覆盖缓存
+        if os.path.exists(path):
+            os.remove(path)
+        return False, _docker_save(name, path)
+
+    cache_path = os.path.join(EXPORT_CACHE_PATH, 'images', digest.replace(':', '_') + '.tar')
+    cached = os.path.exists(cache_path)
+    if not cached:
+        temp_path = _temp_path(os.path.dirname(cache_path))
+        err = _docker_save(name, temp_path)
+        if err:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False, err
+        os.replace(temp_path, cache_path)
+    link_or_copy(cache_path, path)
+    return cached, None
+
+def _link_layout_blobs(layout_dir, descriptor, workdir):
+    manifest = read_manifest(layout_dir, descriptor['digest'])
+    digests = [descriptor['digest'], manifest['config']['digest']] + [layer['digest'] for layer in manifest['layers']]
+    for digest in digests:
+        link_or_copy(blob_path(layout_dir, digest), blob_path(workdir, digest))
+    return digests
+
+def save_layout(name, temp_tar_path, workdir):
+    """导出 oci-layout 格式的镜像，缓存目录本身就是一个共享的 OCI layout
+
+    返回 (descriptor, blob 摘要列表, cached)，出错时抛出异常
+    """
+    digest = image_id(name) if EXPORT_CACHE else None
+    if not digest:
+        err = _docker_save(name, temp_tar_path)
+        if err:
+            raise ValueError(err)
+        try:
+            descriptor = save_layered(temp_tar_path, workdir, name)
+        finally:
+            os.remove(temp_tar_path)
+        manifest = read_manifest(workdir, descriptor['digest'])
+        digests = [descriptor['digest'], manifest['config']['digest']] + [layer['digest'] for layer in manifest['layers']]
+        return descriptor, digests, False
+
+    index_path = os.path.join(EXPORT_CACHE_PATH, 'layouts', digest.replace(':', '_') + '.json')
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as file:
+            descriptor = json.load(file)
+        descriptor['annotations']['org.opencontainers.image.ref.name'] = name
+        try:
+            return descriptor, _link_layout_blobs(EXPORT_CACHE_PATH, descriptor, workdir), True
+        except OSError:
+            # 缓存的 blob 被清理过，重新导出
+            pass
+
+    err = _docker_save(name, temp_tar_path)
+    if err:
+        raise ValueError(err)
+    try:
+        descriptor = save_layered(temp_tar_path, EXPORT_CACHE_PATH, name)
+    finally:
+        os.remove(temp_tar_path)
+    temp_index_path = _temp_path(os.path.dirname(index_path))
+    with open(temp_index_path, 'w') as file:
+        file.write(json.dumps(descriptor))
+    os.replace(temp_index_path, index_path)
+    return descriptor, _link_layout_blobs(EXPORT_CACHE_PATH, descriptor, workdir), False
+
+def prune_workdir(workdir, keep):
+    """删除制品目录中不再被引用的旧镜像文件，keep 为需要保留的相对路径集合"""
+    for root, dirs, files in os.walk(workdir, topdown=False):
+        for file_name in files:
+            path = os.path.join(root, file_name)
+            if os.path.relpath(path, workdir) not in keep:
+                os.remove(path)
+        for dir_name in dirs:
+            path = os.path.join(root, dir_name)
+            if not os.listdir(path):
+                os.rmdir(path)
+
+def prune_cache():
+    """清理没有被任何制品硬链接引用且超过保留期未被使用的缓存文件"""
+    if not os.path.exists(EXPORT_CACHE_PATH):
+        return
+    expire = time.time() - EXPORT_CACHE_TTL_DAYS * 86400
+    for root, dirs, files in os.walk(EXPORT_CACHE_PATH):
+        if os.path.relpath(root, EXPORT_CACHE_PATH).startswith('layouts'):
+            continue
+        for file_name in files:
+            path = os.path.join(root, file_name)
+            try:
+                stat = os.stat(path)
+                if stat.st_nlink == 1 and max(stat.st_atime, stat.st_mtime) < expire:
+                    os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,128 @@
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from image_cache import image_id, prune_cache, prune_workdir, save_archive, save_layout
+from image_layout import FORMAT_DOCKER_ARCHIVE, FORMAT_OCI_LAYOUT, blob_path, write_index
+
+# 环境变量：同时拉取的镜像数量
+EXPORT_PULL_CONCURRENCY = int(os.getenv('EXPORT_PULL_CONCURRENCY') or '4')
+# 环境变量：同时保存的镜像数量（docker save 主要受磁盘限制）
+EXPORT_SAVE_CONCURRENCY = int(os.getenv('EXPORT_SAVE_CONCURRENCY') or '2')
+# 环境变量：默认导出格式，docker-archive 或 oci-layout
+EXPORT_FORMAT = os.getenv('EXPORT_FORMAT') or FORMAT_DOCKER_ARCHIVE
+
+def image_file_name(name):
+    return name.replace('/', '_').replace(':', '_') + '.tar'
+
+def _run(args):
+    try:
+        subprocess.run(args, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return None
+    except subprocess.CalledProcessError as e:
+        print("Error executing command: " + e.stderr.decode().strip(), flush=True)
+        return e.stderr.decode().strip()
+
+def export_images(names, workdir, image_format=None, keep=(), pull_concurrency=None, save_concurrency=None, on_stage=None):
+    """并发拉取镜像，每个镜像拉取完成后立即开始保存
+
+    返回 (image_pairs, timings, error)，image_pairs 与传入顺序一致，
+    timings 记录每个镜像的拉取、排队和保存耗时（秒）。
+    oci-layout 格式下 image_pairs 中记录的是镜像 manifest 的摘要而不是 tar 包路径。
+    镜像按 ID 缓存，未变化的镜像直接从缓存硬链接，导出成功后 workdir 中除 keep 以外
+    不再被引用的文件会被删除。
+    每个镜像的拉取、保存完成时调用 on_stage(阶段名, 开始时间, 结束时间, 错误信息)。
+    """
+    image_format = image_format or EXPORT_FORMAT
+    if image_format not in (FORMAT_DOCKER_ARCHIVE, FORMAT_OCI_LAYOUT):
+        return None, [], 'Invalid export format: ' + image_format
+    pull_concurrency = pull_concurrency or EXPORT_PULL_CONCURRENCY
+    save_concurrency = save_concurrency or EXPORT_SAVE_CONCURRENCY
+
+    # 同名镜像只导出一次
+    names = list(dict.fromkeys(names))
+    image_pairs = [{'name': name, 'path': os.path.join(workdir, image_file_name(name))} for name in names]
+    descriptors = [None] * len(names)
+    blob_digests = set()
+    timings = [{'name': name} for name in names]
+    errors = []
+    lock = threading.Lock()
+
+    def save(index, queued_at):
+        if errors:
+            return
+        name = image_pairs[index]['name']
+        path = image_pairs[index]['path']
+        start = time.time()
+        timings[index]['save_wait'] = round(start - queued_at, 3)
+        print('save image:', name, flush=True)
+        if image_format == FORMAT_OCI_LAYOUT:
+            # 拆分进共享的 blobs 目录，临时 tar 包会被删除
+            try:
+                descriptors[index], digests, cached = save_layout(name, path + '.tmp', workdir)
+                with lock:
+                    blob_digests.update(digests)
+                err = None
+            except (OSError, ValueError, KeyError) as e:
+                cached, err = False, str(e)
+        else:
+            cached, err = save_archive(name, path)
+        finished = time.time()
+        timings[index]['save'] = round(finished - start, 3)
+        timings[index]['cached'] = cached
+        if on_stage:
+            on_stage('save ' + name, start, finished, err)
+        if err:
+            with lock:
+                errors.append('Failed to save image, ' + err)
+            return
+        if image_format == FORMAT_DOCKER_ARCHIVE:
+            timings[index]['size'] = os.path.getsize(path)
+
+    with ThreadPoolExecutor(max_workers=save_concurrency) as save_pool:
+        def pull(index):
+            if errors:
+                return
+            name = image_pairs[index]['name']
+            start = time.time()
+            # 按摘要引用的镜像内容不会变化，本地已存在时无需再拉取
+            if '@sha256:' in name and image_id(name):
+                err = None
+            else:
+                print('pull image:', name, flush=True)
+                err = _run(['docker', 'pull', name])
+            finished = time.time()
+            timings[index]['pull'] = round(finished - start, 3)
+            if on_stage:
+                on_stage('pull ' + name, start, finished, err)
+            if err:
+                with lock:
+                    errors.append('Failed to pull image, ' + err)
+                return
+            save_pool.submit(save, index, time.time())
+
+        with ThreadPoolExecutor(max_workers=pull_concurrency) as pull_pool:
+            list(pull_pool.map(pull, range(len(names))))
+
+    if errors:
+        return None, timings, errors[0]
+
+    keep = set(keep)
+    if image_format == FORMAT_OCI_LAYOUT:
+        write_index(workdir, descriptors)
+        image_pairs = [{'name': pair['name'], 'manifest': descriptor['digest']}
+                       for pair, descriptor in zip(image_pairs, descriptors)]
+        keep.update(['index.json', 'oci-layout'])
+        keep.update(os.path.relpath(blob_path(workdir, digest), workdir) for digest in blob_digests)
+    else:
+        keep.update(os.path.basename(pair['path']) for pair in image_pairs)
+    prune_workdir(workdir, keep)
+    prune_cache()
+
+    for timing in timings:
+        timing['total'] = round(timing.get('pull', 0) + timing.get('save_wait', 0) + timing.get('save', 0), 3)
+    slowest = max(timings, key=lambda t: t['total'], default=None)
+    if slowest:
+        print('slowest image: {} ({}s)'.format(slowest['name'], slowest['total']), flush=True)
+    return image_pairs, timings, None
@@ -0,0 +1,182 @@
+import hashlib
+import io
+import json
+import os
+import subprocess
+import tarfile
+import tempfile
+import uuid
+
+# 导出格式：每个镜像一个 docker save 的 tar 包
+FORMAT_DOCKER_ARCHIVE = 'docker-archive'
+# 导出格式：OCI layout，所有镜像共享按内容寻址的 blobs 目录，相同的层只保存一次
+FORMAT_OCI_LAYOUT = 'oci-layout'
+
+MEDIA_TYPE_MANIFEST = 'application/vnd.oci.image.manifest.v1+json'
+MEDIA_TYPE_CONFIG = 'application/vnd.oci.image.config.v1+json'
+MEDIA_TYPE_LAYER = 'application/vnd.oci.image.layer.v1.tar'
+
+ANNOTATION_REF_NAME = 'org.opencontainers.image.ref.name'
+
+CHUNK_SIZE = 1024 * 1024
+
+def blob_path(layout_dir, digest):
+    algorithm, hex_digest = digest.split(':', 1)
+    return os.path.join(layout_dir, 'blobs', algorithm, hex_digest)
+
+def layer_media_type(head):
+    if head[:2] == b'\x1f\x8b':
+        return MEDIA_TYPE_LAYER + '+gzip'
+    if head[:4] == b'\x28\xb5\x2f\xfd':
+        return MEDIA_TYPE_LAYER + '+zstd'
+    return MEDIA_TYPE_LAYER
+
+def digest_from_member_name(member_name):
+    # docker 25+ 导出的 tar 本身就是 OCI 布局，层文件名即为摘要
+    parts = member_name.split('/')
+    if len(parts) == 3 and parts[0] == 'blobs':
+        return parts[1] + ':' + parts[2]
+    return None
+
+def _write_blob(layout_dir, fileobj, known_digest=None):
+    """把 fileobj 写入 blobs 目录，已存在相同摘要的 blob 时直接跳过，返回 (digest, size, head)"""
+    if known_digest and os.path.exists(blob_path(layout_dir, known_digest)):
+        head = fileobj.read(4)
+        return known_digest, os.path.getsize(blob_path(layout_dir, known_digest)), head
+
+    blobs_dir = os.path.join(layout_dir, 'blobs', 'sha256')
+    os.makedirs(blobs_dir, exist_ok=True)
+    temp_path = os.path.join(blobs_dir, '.tmp-' + uuid.uuid4().hex)
+    sha256 = hashlib.sha256()
+    size = 0
+    head = b''
+    try:
+        with open(temp_path, 'wb') as out:
+            while True:
+                data = fileobj.read(CHUNK_SIZE)
+                if not data:
+                    break
+                if not head:
+                    head = data[:4]
+                sha256.update(data)
+                size += len(data)
+                out.write(data)
+        digest = 'sha256:' + sha256.hexdigest()
+        target = blob_path(layout_dir, digest)
+        if os.path.exists(target):
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, target)
+        return digest, size, head
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def _write_json_blob(layout_dir, content):
+    data = json.dumps(content, separators=(',', ':')).encode()
+    digest = 'sha256:' + hashlib.sha256(data).hexdigest()
+    target = blob_path(layout_dir, digest)
+    if not os.path.exists(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_path = target + '.tmp-' + uuid.uuid4().hex
+        with open(temp_path, 'wb') as out:
+            out.write(data)
+        os.replace(temp_path, target)
+    return digest, len(data)
+
+def save_layered(tar_path, layout_dir, name):
+    """把 docker save 生成的 tar 拆分进 OCI layout，返回镜像 manifest 的描述符"""
+    with tarfile.open(tar_path, 'r') as tar:
+        docker_manifest = json.load(tar.extractfile('manifest.json'))
+        if len(docker_manifest) != 1:
+            raise ValueError('Expected exactly one image in ' + tar_path)
+        entry = docker_manifest[0]
+
+        config_name = entry['Config']
+        config_digest, config_size, _ = _write_blob(
+            layout_dir, tar.extractfile(config_name), digest_from_member_name(config_name))
+
+        layers = []
+        for layer_name in entry['Layers']:
+            digest, size, head = _write_blob(
+                layout_dir, tar.extractfile(layer_name), digest_from_member_name(layer_name))
+            layers.append({'mediaType': layer_media_type(head), 'digest': digest, 'size': size})
+
+    manifest = {
+        'schemaVersion': 2,
+        'mediaType': MEDIA_TYPE_MANIFEST,
+        'config': {'mediaType': MEDIA_TYPE_CONFIG, 'digest': config_digest, 'size': config_size},
+        'layers': layers,
+        'annotations': {ANNOTATION_REF_NAME: name}
+    }
+    manifest_digest, manifest_size = _write_json_blob(layout_dir, manifest)
+    return {
+        'mediaType': MEDIA_TYPE_MANIFEST,
+        'digest': manifest_digest,
+        'size': manifest_size,
+        'annotations': {ANNOTATION_REF_NAME: name}
+    }
+
+def write_index(layout_dir, descriptors):
+    """写入 oci-layout 和 index.json"""
+    with open(os.path.join(layout_dir, 'oci-layout'), 'w') as file:
+        file.write(json.dumps({'imageLayoutVersion': '1.0.0'}))
+    with open(os.path.join(layout_dir, 'index.json'), 'w') as file:
+        file.write(json.dumps({'schemaVersion': 2, 'manifests': descriptors}))
+
+def read_manifest(layout_dir, manifest_digest):
+    with open(blob_path(layout_dir, manifest_digest), 'r') as file:
+        return json.load(file)
+
+def write_docker_archive(layout_dir, manifest_digest, name, fileobj):
+    """从 OCI layout 中按需组装 docker load 可以识别的 tar 流"""
+    manifest = read_manifest(layout_dir, manifest_digest)
+    config_digest = manifest['config']['digest']
+    layer_digests = [layer['digest'] for layer in manifest['layers']]
+
+    def member_name(digest):
+        return 'blobs/' + digest.replace(':', '/')
+
+    docker_manifest = json.dumps([{
+        'Config': member_name(config_digest),
+        'RepoTags': [name],
+        'Layers': [member_name(digest) for digest in layer_digests]
+    }]).encode()
+
+    with tarfile.open(fileobj=fileobj, mode='w|') as tar:
+        added = set()
+        for digest in [config_digest] + layer_digests:
+            if digest in added:
+                continue
+            added.add(digest)
+            path = blob_path(layout_dir, digest)
+            info = tarfile.TarInfo(member_name(digest))
+            info.size = os.path.getsize(path)
+            with open(path, 'rb') as blob:
+                tar.addfile(info, blob)
+        info = tarfile.TarInfo('manifest.json')
+        info.size = len(docker_manifest)
+        tar.addfile(info, io.BytesIO(docker_manifest))
+
+def docker_load(layout_dir, manifest_digest, name):
+    """不落盘地把 OCI layout 中的镜像加载到 docker，返回错误信息或 None"""
+    with tempfile.TemporaryFile() as stderr:
+        p = subprocess.Popen(['docker', 'load'], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr)
+        write_error = None
+        try:
+            write_docker_archive(layout_dir, manifest_digest, name, p.stdin)
+        except (OSError, ValueError, KeyError) as e:
+            write_error = str(e)
+        finally:
+            try:
+                p.stdin.close()
+            except BrokenPipeError:
+                pass
+        p.wait()
+        stderr.seek(0)
+        error_output = stderr.read().decode().strip()
+    if p.returncode != 0:
+        print("Error executing command: " + error_output, flush=True)
+        return error_output or write_error or 'docker load failed'
+    return write_error
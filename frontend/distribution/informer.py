@@ -0,0 +1,324 @@
+import functools
+import json
+import os
+import threading
+import time
+from kube import KubeError, get_client
+from accounting import PRIORITY_LABEL
+from resources import node_capacity, pod_counted, pod_limits, usage_percent
+
+# 环境变量：是否使用 watch 维护的集群资源缓存，关闭后每次统计都全量列出 Pod
+ENABLE_INFORMER = bool((os.getenv('ENABLE_INFORMER') or 'true') == 'true')
+# 环境变量：单次 watch 请求的超时秒数，到期后从上次的 resourceVersion 继续 watch
+INFORMER_WATCH_TIMEOUT = int(os.getenv('INFORMER_WATCH_TIMEOUT') or '300')
+# 出错后重试的最长等待秒数
+INFORMER_MAX_BACKOFF = 30
+
+ADDED = 'ADDED'
+MODIFIED = 'MODIFIED'
+DELETED = 'DELETED'
+
+def object_key(obj):
+    metadata = obj['metadata']
+    return metadata.get('namespace', '') + '/' + metadata['name']
+
+class _Expired(Exception):
+    """resourceVersion 已过期（410 Gone），需要重新 list"""
+
+class Informer:
+    """list + watch 一类资源，并把变化以 handler(事件类型, 旧对象, 新对象) 的形式回调
+
+    params 作为查询参数同时用于 list 和 watch，如 labelSelector
+    """
+
+    def __init__(self, path, handler, name=None, client=None, **params):
+        self.path = path
+        self.params = params
+        self.handler = handler
+        self.name = name or path
+        self.client = client
+        self.store = {}
+        self.store_lock = threading.Lock()
+        self.resource_version = None
+        self.synced = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='informer-' + self.name, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def items(self):
+        """返回缓存中所有对象的列表副本"""
+        with self.store_lock:
+            return list(self.store.values())
+
+    def _client(self):
+        return self.client or get_client()
+
+    def _run(self):
+        backoff = 1
+        need_list = True
+        while not self.stopped.is_set():
+            try:
+                if need_list:
+                    self._list()
+                    need_list = False
+                self._watch()
+                backoff = 1
+            except _Expired:
+                need_list = True
+            except Exception as e:
+                print('Informer {} error: {}'.format(self.name, str(e)), flush=True)
+                self.stopped.wait(backoff)
+                backoff = min(backoff * 2, INFORMER_MAX_BACKOFF)
+
+    def _list(self):
+        """全量 list，与本地缓存比对后只回调有变化的对象"""
+        pager = self._client().list(self.path, **self.params)
+        items = {object_key(item): item for item in pager}
+        for key in [key for key in self.store if key not in items]:
+            with self.store_lock:
+                old = self.store.pop(key)
+            self.handler(DELETED, old, None)
+        for key, item in items.items():
+            old = self.store.get(key)
+            if old is None or old['metadata'].get('resourceVersion') != item['metadata'].get('resourceVersion'):
+                with self.store_lock:
+                    self.store[key] = item
+                self.handler(MODIFIED if old else ADDED, old, item)
+        self.resource_version = pager.metadata.get('resourceVersion')
+        self.synced.set()
+
+    def _watch(self):
+        params = {
+            'watch': '1',
+            'allowWatchBookmarks': 'true',
+            'resourceVersion': self.resource_version,
+            'timeoutSeconds': INFORMER_WATCH_TIMEOUT
+        }
+        params.update(self.params)
+        client = self._client()
+        response = client.session.get(client.server + self.path, params=params, stream=True,
+                                      timeout=(10, INFORMER_WATCH_TIMEOUT + 30))
+        with response:
+            if response.status_code == 410:
+                raise _Expired()
+            if response.status_code >= 400:
+                raise KubeError(response.status_code, response.text)
+            buffer = b''
+            # chunk_size=None 时数据到达即返回，不会等凑满一个块
+            for chunk in response.iter_content(chunk_size=None):
+                if self.stopped.is_set():
+                    return
+                buffer += chunk
+                lines = buffer.split(b'\n')
+                buffer = lines.pop()
+                for line in lines:
+                    if line.strip():
+                        self._dispatch(json.loads(line))
+
+    def _dispatch(self, event):
+        event_type = event.get('type')
+        obj = event.get('object', {})
+        if event_type == 'ERROR':
+            if obj.get('code') == 410:
+                raise _Expired()
+            raise KubeError(obj.get('code'), obj.get('message'))
+        self.resource_version = obj['metadata'].get('resourceVersion') or self.resource_version
+        if event_type == 'BOOKMARK':
+            return
+        key = object_key(obj)
+        with self.store_lock:
+            if event_type == DELETED:
+                old = self.store.pop(key, None)
+            else:
+                old = self.store.get(key)
+                self.store[key] = obj
+        if event_type == DELETED:
+            if old is not None:
+                self.handler(DELETED, old, None)
+        else:
+            self.handler(MODIFIED if old else ADDED, old, obj)
+
+class ClusterCache:
+    """watch 节点和 Pod，增量维护集群、节点、命名空间三个维度的 limits 总和"""
+
+    def __init__(self, client=None):
+        self.lock = threading.Lock()
+        self.nodes = {}
+        self.pods = {}
+        self.capacity = [0.0, 0.0]
+        self.limits = [0.0, 0.0]
+        self.by_node = {}
+        self.by_namespace = {}
+        self.node_informer = Informer('/api/v1/nodes', self._on_node, 'nodes', client)
+        self.pod_informer = Informer('/api/v1/pods', self._on_pod, 'pods', client)
+
+    def start(self):
+        self.node_informer.start()
+        self.pod_informer.start()
+
+    def stop(self):
+        self.node_informer.stop()
+        self.pod_informer.stop()
+
+    def synced(self):
+        return self.node_informer.synced.is_set() and self.pod_informer.synced.is_set()
+
+    def wait_synced(self, timeout=None):
+        deadline = time.time() + timeout if timeout is not None else None
+        for informer in (self.node_informer, self.pod_informer):
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            if not informer.synced.wait(remaining):
+                return False
+        return True
+
+    def _on_node(self, event_type, old, new):
+        with self.lock:
+            name = (new or old)['metadata']['name']
+            previous = self.nodes.pop(name, (0.0, 0.0))
+            current = node_capacity(new) if new else (0.0, 0.0)
+            if new:
+                self.nodes[name] = current
+            self.capacity[0] += current[0] - previous[0]
+            self.capacity[1] += current[1] - previous[1]
+
+    @staticmethod
+    def _add(totals, key, cpu, memory, count):
+        entry = totals.setdefault(key, [0.0, 0.0, 0])
+        entry[0] += cpu
+        entry[1] += memory
+        entry[2] += count
+        if entry[2] <= 0:
+            del totals[key]
+
+    def _on_pod(self, event_type, old, new):
+        key = object_key(new or old)
+        if new and pod_counted(new):
+            cpu, memory = pod_limits(new)
+            current = (new['spec'].get('nodeName') or '', new['metadata'].get('namespace', ''), cpu, memory)
+        else:
+            current = None
+        with self.lock:
+            previous = self.pods.pop(key, None)
+            if previous:
+                node, namespace, cpu, memory = previous
+                self.limits[0] -= cpu
+                self.limits[1] -= memory
+                self._add(self.by_node, node, -cpu, -memory, -1)
+                self._add(self.by_namespace, namespace, -cpu, -memory, -1)
+            if current:
+                node, namespace, cpu, memory = current
+                self.pods[key] = current
+                self.limits[0] += cpu
+                self.limits[1] += memory
+                self._add(self.by_node, node, cpu, memory, 1)
+                self._add(self.by_namespace, namespace, cpu, memory, 1)
+            if not self.pods:
+                # 没有 Pod 时清零，避免浮点误差累积
+                self.limits = [0.0, 0.0]
+
+    def node_capacities(self):
+        """返回 {节点名: (CPU 核数, 内存 Gi)}，缓存未同步时返回 None"""
+        if not self.synced():
+            return None
+        with self.lock:
+            return dict(self.nodes)
+
+    def total_capacity(self):
+        """返回集群总容量 (CPU 核数, 内存 Gi)，缓存未同步时返回 None"""
+        if not self.synced():
+            return None
+        with self.lock:
+            return tuple(self.capacity)
+
+    def usage(self):
+        """返回 (CPU 百分比, 内存百分比)，缓存未同步时返回 (None, None)"""
+        if not self.synced():
+            return None, None
+        with self.lock:
+            return usage_percent(self.limits[0], self.capacity[0]), usage_percent(self.limits[1], self.capacity[1])
+
+    def snapshot(self):
+        with self.lock:
+            def entries(totals):
+                return {key: {'cpu_limits': round(cpu, 3), 'memory_limits_gi': round(memory, 3), 'pods': count}
+                        for key, (cpu, memory, count) in totals.items()}
+            nodes = entries(self.by_node)
+            for name, (cpu, memory) in self.nodes.items():
+                nodes.setdefault(name, {'cpu_limits': 0.0, 'memory_limits_gi': 0.0, 'pods': 0})
+                nodes[name].update({'cpu_capacity': cpu, 'memory_capacity_gi': round(memory, 3)})
+            return {
+                'synced': self.synced(),
+                'cpu_capacity': self.capacity[0],
+                'memory_capacity_gi': round(self.capacity[1], 3),
+                'cpu_limits': round(self.limits[0], 3),
+                'memory_limits_gi': round(self.limits[1], 3),
+                'cpu_usage_percent': usage_percent(self.limits[0], self.capacity[0]),
+                'memory_usage_percent': usage_percent(self.limits[1], self.capacity[1]),
+                'nodes': nodes,
+                'namespaces': entries(self.by_namespace)
+            }
+
+WORKLOAD_TYPES = ('deployment', 'statefulset')
+
+def priority_candidate(workload_type, workload):
+    """解析工作负载的优先级标签和 limits 占用（副本数 × Pod 模板 limits），标签不是整数时返回 None"""
+    metadata = workload['metadata']
+    try:
+        priority = int((metadata.get('labels') or {}).get(PRIORITY_LABEL, ''))
+    except ValueError:
+        return None
+    spec = workload.get('spec', {})
+    replicas = spec.get('replicas', 1)
+    cpu, memory = pod_limits(spec.get('template', {}))
+    return {
+        'type': workload_type,
+        'namespace': metadata['namespace'],
+        'name': metadata['name'],
+        'priority': priority,
+        'replicas': replicas,
+        'cpu': cpu * replicas,
+        'memory': memory * replicas
+    }
+
+class WorkloadCache:
+    """只 watch 带优先级标签的 deployment 和 statefulset，标签在对象变化时解析一次"""
+
+    def __init__(self, client=None):
+        self.lock = threading.Lock()
+        self.workloads = {}
+        self.informers = [Informer('/apis/apps/v1/{}s'.format(workload_type),
+                                   functools.partial(self._on_workload, workload_type), workload_type + 's', client,
+                                   labelSelector=PRIORITY_LABEL)
+                          for workload_type in WORKLOAD_TYPES]
+
+    def start(self):
+        for informer in self.informers:
+            informer.start()
+
+    def stop(self):
+        for informer in self.informers:
+            informer.stop()
+
+    def synced(self):
+        return all(informer.synced.is_set() for informer in self.informers)
+
+    def _on_workload(self, workload_type, event_type, old, new):
+        key = workload_type + '/' + object_key(new or old)
+        candidate = priority_candidate(workload_type, new) if new else None
+        with self.lock:
+            if candidate:
+                self.workloads[key] = candidate
+            else:
+                self.workloads.pop(key, None)
+
+    def candidates(self):
+        """返回优先级标签合法的工作负载列表"""
+        with self.lock:
+            return list(self.workloads.values())
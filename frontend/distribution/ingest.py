@@ -0,0 +1,282 @@
+import os
+import re
+import shutil
+import struct
+import threading
+import uuid
+import zipfile
+import zlib
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+# 环境变量：上传时每次从请求体读取的字节数
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE') or str(1024 * 1024))
+
+_LOCAL_HEADER = struct.Struct('<4sHHHHHLLLHH')
+_LOCAL_SIGNATURE = b'PK\x03\x04'
+_CENTRAL_SIGNATURE = b'PK\x01\x02'
+_END_SIGNATURE = b'PK\x05\x06'
+_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+_FLAG_ENCRYPTED = 0x01
+_FLAG_DATA_DESCRIPTOR = 0x08
+_ZIP64_EXTRA = 0x0001
+
+class _ChunkReader:
+    """把字节块迭代器包装成可以精确读取 n 个字节、并支持回退的读取器"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+        self.eof = False
+
+    def _fill(self, size):
+        while len(self.buffer) < size and not self.eof:
+            try:
+                self.buffer += next(self.chunks)
+            except StopIteration:
+                self.eof = True
+
+    def read(self, size):
+        """读取最多 size 个字节，只有到达结尾时才会少于 size"""
+        self._fill(size)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def read_exact(self, size):
+        data = self.read(size)
+        if len(data) != size:
+            raise zipfile.BadZipFile('Unexpected end of zip stream')
+        return data
+
+    def read_some(self):
+        """读取当前缓冲区或下一个数据块"""
+        self._fill(1)
+        data, self.buffer = self.buffer, b''
+        return data
+
+    def unread(self, data):
+        self.buffer = data + self.buffer
+
+    def drain(self):
+        self.buffer = b''
+        for _ in self.chunks:
+            pass
+
+def _safe_path(dest, name):
+    path = os.path.normpath(os.path.join(dest, name))
+    if os.path.isabs(name) or not path.startswith(os.path.normpath(dest) + os.sep):
+        raise zipfile.BadZipFile('Illegal path in zip: ' + name)
+    return path
+
+def _zip64_sizes(extra, compressed_size, file_size):
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, size = struct.unpack('<HH', extra[offset:offset + 4])
+        if header_id == _ZIP64_EXTRA:
+            data = extra[offset + 4:offset + 4 + size]
+            values = list(struct.unpack('<%dQ' % (len(data) // 8), data[:len(data) // 8 * 8]))
+            if file_size == 0xFFFFFFFF and values:
+                file_size = values.pop(0)
+            if compressed_size == 0xFFFFFFFF and values:
+                compressed_size = values.pop(0)
+            return compressed_size, file_size, True
+        offset += 4 + size
+    return compressed_size, file_size, False
+
+def _read_descriptor(reader, zip64):
+    data = reader.read_exact(4)
+    if data != _DESCRIPTOR_SIGNATURE:
+        reader.unread(data)
+    if zip64:
+        return struct.unpack('<LQQ', reader.read_exact(20))
+    return struct.unpack('<LLL', reader.read_exact(12))
+
+def _copy_known_size(reader, out, size, decompressor):
+    crc = 0
+    written = 0
+    remaining = size
+    while remaining > 0:
+        data = reader.read(min(remaining, UPLOAD_CHUNK_SIZE))
+        if not data:
+            raise zipfile.BadZipFile('Unexpected end of zip stream')
+        remaining -= len(data)
+        if decompressor:
+            data = decompressor.decompress(data)
+        crc = zlib.crc32(data, crc)
+        written += len(data)
+        out.write(data)
+    if decompressor:
+        data = decompressor.flush()
+        crc = zlib.crc32(data, crc)
+        written += len(data)
+        out.write(data)
+    return crc, written
+
+def _copy_deflated_until_end(reader, out):
+    decompressor = zlib.decompressobj(-15)
+    crc = 0
+    written = 0
+    while not decompressor.eof:
+        data = reader.read_some()
+        if not data:
+            raise zipfile.BadZipFile('Unexpected end of zip stream')
+        data = decompressor.decompress(data)
+        crc = zlib.crc32(data, crc)
+        written += len(data)
+        out.write(data)
+    reader.unread(decompressor.unused_data)
+    return crc, written
+
+def _copy_stored_until_descriptor(reader, out, zip64):
+    """未压缩且大小未知的条目：扫描数据描述符签名，并用 CRC 和长度确认边界"""
+    crc = 0
+    written = 0
+    pending = b''
+    exhausted = False
+    descriptor_formats = ('<LQQ', '<LLL') if zip64 else ('<LLL', '<LQQ')
+    longest = struct.calcsize('<LQQ')
+    while True:
+        index = pending.find(_DESCRIPTOR_SIGNATURE)
+        while index != -1:
+            if len(pending) - index - 4 < longest and not exhausted:
+                break
+            candidate_crc = zlib.crc32(pending[:index], crc)
+            candidate_size = written + index
+            for descriptor_format in descriptor_formats:
+                raw = pending[index + 4:index + 4 + struct.calcsize(descriptor_format)]
+                if len(raw) != struct.calcsize(descriptor_format):
+                    continue
+                if struct.unpack(descriptor_format, raw) == (candidate_crc, candidate_size, candidate_size):
+                    out.write(pending[:index])
+                    reader.unread(pending[index + 4 + len(raw):])
+                    return candidate_crc, candidate_size
+            index = pending.find(_DESCRIPTOR_SIGNATURE, index + 1)
+
+        # 签名之前的数据已确认属于文件内容，末尾保留可能被截断的签名
+        safe = index if index != -1 else max(0, len(pending) - len(_DESCRIPTOR_SIGNATURE) + 1)
+        if safe:
+            crc = zlib.crc32(pending[:safe], crc)
+            written += safe
+            out.write(pending[:safe])
+            pending = pending[safe:]
+        if exhausted:
+            raise zipfile.BadZipFile('Data descriptor not found')
+        data = reader.read_some()
+        exhausted = not data
+        pending += data
+
+def extract_zip_stream(chunks, dest):
+    """边接收边解压 zip 数据流到 dest，依次处理每个本地文件头，不需要先保存整个压缩包
+
+    返回解压出的文件列表
+    """
+    reader = _ChunkReader(chunks)
+    names = []
+    while True:
+        signature = reader.read(4)
+        if signature in (_CENTRAL_SIGNATURE, _END_SIGNATURE) or (not signature and names):
+            reader.drain()
+            return names
+        if signature != _LOCAL_SIGNATURE:
+            raise zipfile.BadZipFile('File is not a zip file')
+        header = _LOCAL_HEADER.unpack(signature + reader.read_exact(_LOCAL_HEADER.size - 4))
+        _, _, flags, method, _, _, crc, compressed_size, file_size, name_length, extra_length = header
+        name = reader.read_exact(name_length).decode('utf-8' if flags & 0x800 else 'cp437')
+        extra = reader.read_exact(extra_length)
+        compressed_size, file_size, zip64 = _zip64_sizes(extra, compressed_size, file_size)
+        if flags & _FLAG_ENCRYPTED:
+            raise zipfile.BadZipFile('Encrypted zip is not supported: ' + name)
+        if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise zipfile.BadZipFile('Unsupported compression method for ' + name)
+
+        path = _safe_path(dest, name)
+        if name.endswith('/'):
+            os.makedirs(path, exist_ok=True)
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path, 'wb') as out:
+            if not flags & _FLAG_DATA_DESCRIPTOR:
+                decompressor = zlib.decompressobj(-15) if method == zipfile.ZIP_DEFLATED else None
+                actual_crc, actual_size = _copy_known_size(reader, out, compressed_size, decompressor)
+            elif method == zipfile.ZIP_DEFLATED:
+                actual_crc, actual_size = _copy_deflated_until_end(reader, out)
+                crc, _, file_size = _read_descriptor(reader, zip64)
+            else:
+                actual_crc, actual_size = _copy_stored_until_descriptor(reader, out, zip64)
+                crc, file_size = actual_crc, actual_size
+        if actual_crc != crc or actual_size != file_size:
+            raise zipfile.BadZipFile('Bad CRC-32 for file ' + name)
+        names.append(name)
+
+def multipart_file_chunks(stream, boundary, field_name='file', chunk_size=None):
+    """从 multipart/form-data 请求体中边读边取出指定文件字段的内容"""
+    chunk_size = chunk_size or UPLOAD_CHUNK_SIZE
+    decoder = MultipartDecoder(boundary.encode())
+    current = None
+    while True:
+        chunk = stream.read(chunk_size)
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, NeedData):
+            if isinstance(event, File):
+                current = event.name
+            elif isinstance(event, Data):
+                if current == field_name and event.data:
+                    yield event.data
+                if not event.more_data:
+                    current = None
+            elif isinstance(event, Epilogue):
+                return
+            else:
+                current = None
+            event = decoder.next_event()
+        if not chunk:
+            return
+
+def raw_chunks(stream, chunk_size=None):
+    chunk_size = chunk_size or UPLOAD_CHUNK_SIZE
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def new_staging_dir(save_path):
+    """每个请求使用独立的暂存目录，与最终目录在同一文件系统上以便原子重命名"""
+    staging = os.path.join(save_path, '.staging', uuid.uuid4().hex)
+    os.makedirs(staging)
+    return staging
+
+# RFC 1123：命名空间是 label，应用名是 subdomain
+_DNS1123_LABEL = re.compile(r'^[a-z0-9]([-a-z0-9]*[a-z0-9])?$')
+_DNS1123_SUBDOMAIN = re.compile(r'^[a-z0-9]([-a-z0-9]*[a-z0-9])?(\.[a-z0-9]([-a-z0-9]*[a-z0-9])?)*$')
+
+def app_target(save_path, namespace, appname):
+    """校验元数据中的命名空间和应用名，返回应用在 save_path 下的目录，不合法时抛出 ValueError"""
+    if not isinstance(namespace, str) or len(namespace) > 63 or not _DNS1123_LABEL.match(namespace):
+        raise ValueError('Invalid namespace: {!r}'.format(namespace))
+    if not isinstance(appname, str) or len(appname) > 253 or not _DNS1123_SUBDOMAIN.match(appname):
+        raise ValueError('Invalid app name: {!r}'.format(appname))
+    root = os.path.realpath(save_path)
+    target = os.path.realpath(os.path.join(root, namespace, appname))
+    if os.path.dirname(os.path.dirname(target)) != root:
+        raise ValueError('App directory escapes save path: ' + target)
+    return target
+
+_swap_lock = threading.Lock()
+
+def swap_into_place(staging, target):
+    """把暂存目录换到目标位置，目标不存在时只需一次原子重命名"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with _swap_lock:
+        try:
+            os.rename(staging, target)
+            return
+        except OSError:
+            if not os.path.isdir(target):
+                raise
+        # Linux 上无法原子替换非空目录，先把旧目录移开再换入新目录
+        old = staging + '-old'
+        os.rename(target, old)
+        os.rename(staging, target)
+    shutil.rmtree(old, ignore_errors=True)
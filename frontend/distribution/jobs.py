@@ -0,0 +1,402 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# 环境变量：各类任务的并发数，格式为 类型=并发数，逗号分隔
+JOB_CONCURRENCY = os.getenv('JOB_CONCURRENCY') or 'export=2,upload=2,deploy=2,push=2,stress=1'
+# 环境变量：任务结束后保留状态的秒数
+JOB_RETENTION_SECONDS = int(os.getenv('JOB_RETENTION_SECONDS') or '86400')
+# 环境变量：保存任务状态的 sqlite 文件，多进程部署时各 worker 通过它查询其他进程中的任务，为空时只保存在内存中
+JOB_DATABASE = os.getenv('JOB_DATABASE') or ''
+# SSE 连接无事件时发送心跳的间隔
+SSE_KEEPALIVE_SECONDS = 15
+# 读取其他进程中的任务事件时的轮询间隔
+SSE_POLL_SECONDS = 1
+# 环境变量：运行任务的 worker 刷新心跳的间隔秒数
+JOB_HEARTBEAT_SECONDS = float(os.getenv('JOB_HEARTBEAT_SECONDS') or '10')
+# 环境变量：未结束的任务超过该秒数没有心跳时，认为所在 worker 已退出，标记为失败
+JOB_ORPHAN_SECONDS = float(os.getenv('JOB_ORPHAN_SECONDS') or '60')
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+STATUS_SKIPPED = 'skipped'
+
+def parse_concurrency(value):
+    limits = {}
+    for item in value.split(','):
+        if '=' in item:
+            job_type, limit = item.split('=', 1)
+            limits[job_type.strip()] = max(1, int(limit))
+    return limits
+
+class JobStore:
+    """把任务状态和事件写入 sqlite，任务所在进程之外的 worker 也能查询"""
+
+    def __init__(self, database):
+        self.database = database
+        self.local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            finished_at REAL,
+            heartbeat REAL,
+            snapshot TEXT NOT NULL
+        )
+        ''')
+        # 旧版本创建的表没有心跳列
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]
+        if 'heartbeat' not in columns:
+            conn.execute('ALTER TABLE jobs ADD COLUMN heartbeat REAL')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS job_events (
+            job_id TEXT NOT NULL,
+            event_id INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (job_id, event_id)
+        )
+        ''')
+        conn.commit()
+
+    def _conn(self):
+        # sqlite 连接不能跨线程使用，每个线程一个
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = sqlite3.connect(self.database, timeout=30)
+        return conn
+
+    def save(self, snapshot, event):
+        conn = self._conn()
+        with conn:
+            conn.execute('''
+            INSERT OR REPLACE INTO jobs (id, type, created_at, finished_at, heartbeat, snapshot) VALUES (?, ?, ?, ?, ?, ?)
+            ''', (snapshot['id'], snapshot['type'], snapshot['created_at'], snapshot['finished_at'], time.time(),
+                  json.dumps(snapshot)))
+            conn.execute('''
+            INSERT OR REPLACE INTO job_events (job_id, event_id, data) VALUES (?, ?, ?)
+            ''', (snapshot['id'], event['id'], json.dumps(event)))
+
+    def touch(self, job_ids):
+        """刷新本进程中未结束任务的心跳"""
+        if not job_ids:
+            return
+        conn = self._conn()
+        with conn:
+            conn.executemany('UPDATE jobs SET heartbeat = ? WHERE id = ? AND finished_at IS NULL',
+                             [(time.time(), job_id) for job_id in job_ids])
+
+    def reap_orphans(self):
+        """把心跳超时的未结束任务标记为失败，并追加最后一个状态事件，SSE 轮询随之结束"""
+        now = time.time()
+        conn = self._conn()
+        query = 'SELECT id, snapshot FROM jobs WHERE finished_at IS NULL AND COALESCE(heartbeat, 0) < ?'
+        if not conn.execute(query, (now - JOB_ORPHAN_SECONDS,)).fetchone():
+            return
+        # 多个 worker 可能同时发现同一个任务，在写事务中重新检查
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(query, (now - JOB_ORPHAN_SECONDS,)).fetchall()
+            for job_id, data in rows:
+                snapshot = json.loads(data)
+                error = 'Worker {} stopped while the job was {}'.format(snapshot.get('owner'), snapshot['status'])
+                snapshot.update({'status': STATUS_FAILED, 'finished_at': now, 'status_code': 500, 'error': error})
+                event_id = conn.execute('SELECT COALESCE(MAX(event_id), 0) + 1 FROM job_events WHERE job_id = ?',
+                                        (job_id,)).fetchone()[0]
+                event = {'id': event_id, 'event': 'status', 'time': now, 'status': STATUS_FAILED, 'result': None,
+                         'error': error}
+                conn.execute('UPDATE jobs SET finished_at = ?, snapshot = ? WHERE id = ?',
+                             (now, json.dumps(snapshot), job_id))
+                conn.execute('INSERT INTO job_events (job_id, event_id, data) VALUES (?, ?, ?)',
+                             (job_id, event_id, json.dumps(event)))
+                print('Job {} orphaned: {}'.format(job_id, error), flush=True)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def load(self, job_id):
+        self.reap_orphans()
+        row = self._conn().execute('SELECT snapshot FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list(self, job_type=None):
+        self.reap_orphans()
+        if job_type:
+            rows = self._conn().execute('SELECT snapshot FROM jobs WHERE type = ? ORDER BY created_at', (job_type,))
+        else:
+            rows = self._conn().execute('SELECT snapshot FROM jobs ORDER BY created_at')
+        return [json.loads(row[0]) for row in rows.fetchall()]
+
+    def events(self, job_id, after=0):
+        rows = self._conn().execute('''
+        SELECT data FROM job_events WHERE job_id = ? AND event_id > ? ORDER BY event_id
+        ''', (job_id, after)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def cleanup(self, expire):
+        conn = self._conn()
+        with conn:
+            conn.execute('''
+            DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?)
+            ''', (expire,))
+            conn.execute('DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?', (expire,))
+
+class StageFailed(Exception):
+    """在阶段内抛出，阶段记录为失败，调用方捕获后返回错误响应"""
+
+class Job:
+    def __init__(self, job_type, description='', store=None):
+        self.id = uuid.uuid4().hex
+        self.type = job_type
+        self.description = description
+        self.status = STATUS_QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.stages = []
+        self.result = None
+        self.status_code = None
+        self.error = None
+        self.events = []
+        self.store = store
+        self.condition = threading.Condition()
+
+    def emit(self, event, **data):
+        with self.condition:
+            data.update({'id': len(self.events) + 1, 'event': event, 'time': time.time()})
+            self.events.append(data)
+            if self.store:
+                self.store.save(self.snapshot(), data)
+            self.condition.notify_all()
+
+    def add_stage(self, name, started_at, finished_at, status=STATUS_SUCCEEDED, **extra):
+        """记录一个已经完成的阶段，用于在线程池中自行计时的子任务"""
+        stage = {
+            'name': name,
+            'status': status,
+            'started_at': started_at,
+            'finished_at': finished_at,
+            'duration': round(finished_at - started_at, 3)
+        }
+        stage.update(extra)
+        with self.condition:
+            self.stages.append(stage)
+        self.emit('stage', **stage)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started_at = time.time()
+        self.emit('stage_started', name=name)
+        try:
+            yield
+        except Exception as e:
+            self.add_stage(name, started_at, time.time(), STATUS_FAILED, error=str(e))
+            raise
+        self.add_stage(name, started_at, time.time())
+
+    def snapshot(self):
+        with self.condition:
+            return {
+                'id': self.id,
+                'type': self.type,
+                'description': self.description,
+                'status': self.status,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'duration': round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else None,
+                'stages': list(self.stages),
+                'result': self.result,
+                'status_code': self.status_code,
+                'error': self.error,
+                'owner': os.getpid()
+            }
+
+    def finished(self):
+        return self.status in (STATUS_SUCCEEDED, STATUS_FAILED)
+
+class StoredJob:
+    """在其他 worker 进程中运行的任务，状态和事件从 JobStore 读取"""
+
+    def __init__(self, store, snapshot):
+        self.store = store
+        self.data = snapshot
+        self.id = snapshot['id']
+        self.type = snapshot['type']
+        self.status = snapshot['status']
+
+    def snapshot(self):
+        return self.data
+
+    def refresh(self):
+        self.data = self.store.load(self.id) or self.data
+        self.status = self.data['status']
+
+    def finished(self):
+        return self.status in (STATUS_SUCCEEDED, STATUS_FAILED)
+
+def stage(job, name):
+    """job 为 None（同步执行）时不记录阶段"""
+    if job is None:
+        return contextlib.nullcontext()
+    return job.stage(name)
+
+def stage_recorder(job):
+    """返回记录已完成阶段的回调，job 为 None 时返回 None"""
+    if job is None:
+        return None
+
+    def record(name, started_at, finished_at, error=None):
+        if error:
+            job.add_stage(name, started_at, finished_at, STATUS_FAILED, error=error)
+        else:
+            job.add_stage(name, started_at, finished_at)
+    return record
+
+class JobEngine:
+    """按任务类型限制并发的后台任务执行器"""
+
+    def __init__(self, limits=None, default_limit=2, store=None):
+        self.limits = limits if limits is not None else parse_concurrency(JOB_CONCURRENCY)
+        self.default_limit = default_limit
+        self.store = store
+        self.pools = {}
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.heartbeat = None
+
+    def _pool(self, job_type):
+        with self.lock:
+            if job_type not in self.pools:
+                self.pools[job_type] = ThreadPoolExecutor(
+                    max_workers=self.limits.get(job_type, self.default_limit),
+                    thread_name_prefix='job-' + job_type)
+            return self.pools[job_type]
+
+    def submit(self, job_type, fn, *args, description=''):
+        """提交任务，fn(job, *args) 返回 (结果, HTTP 状态码)"""
+        self.cleanup()
+        job = Job(job_type, description, self.store)
+        with self.lock:
+            self.jobs[job.id] = job
+            if self.store and self.heartbeat is None:
+                self.heartbeat = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+                self.heartbeat.start()
+        job.emit('status', status=STATUS_QUEUED)
+        self._pool(job_type).submit(self._run, job, fn, args)
+        return job
+
+    def _run(self, job, fn, args):
+        job.started_at = time.time()
+        job.status = STATUS_RUNNING
+        job.emit('status', status=STATUS_RUNNING)
+        try:
+            result, status_code = fn(job, *args)
+            error = result.get('error') if isinstance(result, dict) else None
+            status = STATUS_FAILED if status_code >= 400 else STATUS_SUCCEEDED
+        except Exception as e:
+            print('Error in job {}: {}'.format(job.id, str(e)), flush=True)
+            result, status_code, error, status = None, 500, str(e), STATUS_FAILED
+        # 状态和最后一个事件一起更新，SSE 读到结束状态时一定能读到最后一个事件
+        with job.condition:
+            job.result = result
+            job.status_code = status_code
+            job.error = error
+            job.finished_at = time.time()
+            job.status = status
+            job.emit('status', status=status, result=result, error=error)
+
+    def _heartbeat(self):
+        # 其他 worker 根据心跳判断任务所在进程是否还在运行
+        while True:
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+            with self.lock:
+                running = [job.id for job in self.jobs.values() if not job.finished()]
+            try:
+                self.store.touch(running)
+            except Exception as e:
+                print('Error updating job heartbeat: {}'.format(str(e)), flush=True)
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None and self.store:
+            snapshot = self.store.load(job_id)
+            if snapshot:
+                return StoredJob(self.store, snapshot)
+        return job
+
+    def list(self, job_type=None):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        jobs = [job for job in jobs if not job_type or job.type == job_type]
+        if self.store:
+            local = set(job.id for job in jobs)
+            jobs += [StoredJob(self.store, snapshot) for snapshot in self.store.list(job_type)
+                     if snapshot['id'] not in local]
+        return jobs
+
+    def cleanup(self):
+        expire = time.time() - JOB_RETENTION_SECONDS
+        with self.lock:
+            for job_id in [job_id for job_id, job in self.jobs.items()
+                           if job.finished() and job.finished_at < expire]:
+                del self.jobs[job_id]
+        if self.store:
+            self.store.cleanup(expire)
+
+def _format_event(event):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(event['id'], event['event'], json.dumps(event))
+
+def _stored_sse_events(job, last_event_id):
+    """轮询 JobStore 输出其他进程中任务的事件"""
+    sent = last_event_id
+    idle = 0
+    while True:
+        job.refresh()
+        # 先读状态再读事件，读到结束状态时一定能读到最后一个事件
+        done = job.finished()
+        events = job.store.events(job.id, sent)
+        for event in events:
+            sent = event['id']
+            yield _format_event(event)
+        if done:
+            return
+        idle = 0 if events else idle + SSE_POLL_SECONDS
+        if idle >= SSE_KEEPALIVE_SECONDS:
+            idle = 0
+            yield ': keepalive\n\n'
+        time.sleep(SSE_POLL_SECONDS)
+
+def sse_events(job, last_event_id=0):
+    """以 Server-Sent Events 格式输出任务事件，任务结束后关闭连接"""
+    if isinstance(job, StoredJob):
+        yield from _stored_sse_events(job, last_event_id)
+        return
+    sent = last_event_id
+    while True:
+        with job.condition:
+            if len(job.events) <= sent and not job.finished():
+                job.condition.wait(SSE_KEEPALIVE_SECONDS)
+            events = job.events[sent:]
+            done = job.finished()
+        if not events:
+            if done:
+                return
+            yield ': keepalive\n\n'
+            continue
+        for event in events:
+            sent = event['id']
+            yield _format_event(event)
+        if done and sent >= len(job.events):
+            return
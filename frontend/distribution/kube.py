@@ -0,0 +1,348 @@
+import atexit
+import base64
+import codecs
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import requests
+import yaml
+from requests.adapters import HTTPAdapter
+
+# 环境变量：访问集群使用的 kubeconfig
+KUBECONFIG = os.getenv('KUBECONFIG') or '/etc/kubernetes/admin.conf'
+# 环境变量：到 API Server 的连接池大小
+KUBE_POOL_SIZE = int(os.getenv('KUBE_POOL_SIZE') or '10')
+# 环境变量：请求 API Server 的超时秒数
+KUBE_TIMEOUT = float(os.getenv('KUBE_TIMEOUT') or '30')
+# 环境变量：列出资源时每页的条数，0 表示不分页
+KUBE_LIST_PAGE_SIZE = int(os.getenv('KUBE_LIST_PAGE_SIZE') or '500')
+# 环境变量：驱逐节点上 Pod 的最长等待秒数，超时后放弃移除该节点
+NODE_DRAIN_TIMEOUT = float(os.getenv('NODE_DRAIN_TIMEOUT') or '600')
+# 驱逐被 PodDisruptionBudget 拒绝后重试的间隔秒数
+DRAIN_RETRY_INTERVAL = 5
+# 列表响应每次读取的字节数
+LIST_CHUNK_SIZE = 64 * 1024
+
+PATCH_STRATEGIC = 'application/strategic-merge-patch+json'
+PATCH_MERGE = 'application/merge-patch+json'
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+class KubeError(Exception):
+    """API Server 返回的错误，status 为 HTTP 状态码"""
+
+    def __init__(self, status, message):
+        super().__init__('{} {}'.format(status, message))
+        self.status = status
+        self.message = message
+
+class ListParser:
+    """增量解析 List 响应：items 中的对象解析完一个就交出一个，不在内存中保留整个响应
+
+    items 以外的顶层字段（kind、metadata 等）保存在 fields 中
+    """
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.state = 'start'
+        self.fields = {}
+        self.key = None
+
+    def _peek(self):
+        """跳过空白，返回下一个字符，缓冲区已读完时返回空字符串"""
+        self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+        return self.buffer[self.pos:self.pos + 1]
+
+    def _value(self, eof):
+        """从当前位置解析一个完整的值，数据不够时返回 (False, None)"""
+        try:
+            value, end = self.decoder.raw_decode(self.buffer, self.pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            return False, None
+        # 数字等标量可能被块边界截断，只有后面还有数据时才算完整
+        if end == len(self.buffer) and not eof and not isinstance(value, (dict, list, str)):
+            return False, None
+        self.pos = end
+        return True, value
+
+    def _expect(self, chars):
+        char = self._peek()
+        if not char:
+            return None
+        if char not in chars:
+            raise ValueError('Unexpected {!r} in list response'.format(char))
+        self.pos += 1
+        return char
+
+    def feed(self, data, eof=False):
+        # 只在每次收到数据时丢弃已解析的部分，避免每解析一个对象就复制一次缓冲区
+        self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(data, final=eof)
+        self.pos = 0
+        while True:
+            if self.state == 'start':
+                if not self._expect('{'):
+                    return
+                self.state = 'key'
+            elif self.state == 'key':
+                if self._peek() == '}':
+                    self.pos += 1
+                    self.state = 'end'
+                    continue
+                complete, self.key = self._value(eof)
+                if not complete:
+                    return
+                self.state = 'colon'
+            elif self.state == 'colon':
+                if not self._expect(':'):
+                    return
+                self.state = 'value'
+            elif self.state == 'value':
+                char = self._peek()
+                if self.key == 'items' and char == '[':
+                    self.pos += 1
+                    self.state = 'item'
+                    continue
+                complete, value = self._value(eof)
+                if not complete:
+                    return
+                self.fields[self.key] = value
+                self.state = 'next_key'
+            elif self.state == 'next_key':
+                char = self._expect(',}')
+                if not char:
+                    return
+                self.state = 'key' if char == ',' else 'end'
+            elif self.state in ('item', 'next_item'):
+                char = self._peek()
+                if char == ']':
+                    self.pos += 1
+                    self.state = 'next_key'
+                    continue
+                if self.state == 'next_item':
+                    if not self._expect(','):
+                        return
+                    self.state = 'item'
+                    continue
+                complete, value = self._value(eof)
+                if not complete:
+                    return
+                self.state = 'next_item'
+                yield value
+            else:
+                return
+
+    def close(self):
+        yield from self.feed(b'', eof=True)
+        if self.state != 'end':
+            raise ValueError('Truncated list response')
+
+class ListPager:
+    """按 limit/continue 分页列出资源，逐页流式解析，遍历结束后 metadata 为最后一页的 metadata"""
+
+    def __init__(self, client, path, limit=None, **params):
+        self.client = client
+        self.path = path
+        self.limit = KUBE_LIST_PAGE_SIZE if limit is None else limit
+        self.params = params
+        self.metadata = {}
+
+    def __iter__(self):
+        continue_token = None
+        while True:
+            params = dict(self.params)
+            if self.limit:
+                params['limit'] = self.limit
+            if continue_token:
+                params['continue'] = continue_token
+            response = self.client.session.get(self.client.server + self.path, params=params,
+                                               stream=True, timeout=KUBE_TIMEOUT)
+            with response:
+                if response.status_code >= 400:
+                    raise KubeError(response.status_code, response.text)
+                parser = ListParser()
+                for chunk in response.iter_content(chunk_size=LIST_CHUNK_SIZE):
+                    yield from parser.feed(chunk)
+                yield from parser.close()
+            self.metadata = parser.fields.get('metadata') or {}
+            continue_token = self.metadata.get('continue')
+            if not continue_token:
+                return
+
+def _find(items, name):
+    for item in items or []:
+        if item.get('name') == name:
+            return item
+    raise ValueError('{} not found in kubeconfig'.format(name))
+
+class KubeClient:
+    """复用 TLS 连接的 Kubernetes API 客户端，只加载一次 kubeconfig"""
+
+    def __init__(self, kubeconfig=None, pool_size=None):
+        self.temp_files = []
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size or KUBE_POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._load(kubeconfig or KUBECONFIG)
+
+    def _data_file(self, data):
+        # requests 只接受证书文件路径，把 kubeconfig 中内嵌的证书写入仅当前用户可读的临时文件
+        fd, path = tempfile.mkstemp(prefix='kube-', suffix='.pem')
+        with os.fdopen(fd, 'wb') as file:
+            file.write(base64.b64decode(data))
+        self.temp_files.append(path)
+        return path
+
+    def _load(self, kubeconfig):
+        with open(kubeconfig, 'r') as file:
+            config = yaml.safe_load(file)
+        context_name = config.get('current-context') or config['contexts'][0]['name']
+        context = _find(config.get('contexts'), context_name)['context']
+        cluster = _find(config.get('clusters'), context['cluster'])['cluster']
+        user = _find(config.get('users'), context['user'])['user'] if context.get('user') else {}
+
+        self.server = cluster['server'].rstrip('/')
+        if cluster.get('insecure-skip-tls-verify'):
+            self.session.verify = False
+        elif cluster.get('certificate-authority-data'):
+            self.session.verify = self._data_file(cluster['certificate-authority-data'])
+        elif cluster.get('certificate-authority'):
+            self.session.verify = cluster['certificate-authority']
+
+        if user.get('client-certificate-data'):
+            self.session.cert = (self._data_file(user['client-certificate-data']),
+                                 self._data_file(user['client-key-data']))
+        elif user.get('client-certificate'):
+            self.session.cert = (user['client-certificate'], user['client-key'])
+        if user.get('token'):
+            self.session.headers['Authorization'] = 'Bearer ' + user['token']
+
+    def close(self):
+        self.session.close()
+        for path in self.temp_files:
+            if os.path.exists(path):
+                os.remove(path)
+        self.temp_files = []
+
+    def request(self, method, path, body=None, content_type='application/json', **kwargs):
+        """发送请求并返回解析后的 JSON，状态码不是 2xx 时抛出 KubeError"""
+        headers = kwargs.pop('headers', {})
+        if body is not None:
+            headers['Content-Type'] = content_type
+            kwargs['data'] = body if isinstance(body, (bytes, str)) else json.dumps(body)
+        kwargs.setdefault('timeout', KUBE_TIMEOUT)
+        response = self.session.request(method, self.server + path, headers=headers, **kwargs)
+        if response.status_code >= 400:
+            try:
+                message = response.json().get('message', response.text)
+            except ValueError:
+                message = response.text
+            raise KubeError(response.status_code, message)
+        if not response.content:
+            return None
+        return response.json()
+
+    def get(self, path, **params):
+        return self.request('GET', path, params=params or None)
+
+    def list(self, path, limit=None, **params):
+        return ListPager(self, path, limit, **params)
+
+    def post(self, path, body):
+        return self.request('POST', path, body)
+
+    def patch(self, path, body, content_type=PATCH_STRATEGIC):
+        return self.request('PATCH', path, body, content_type)
+
+    def delete(self, path, body=None):
+        return self.request('DELETE', path, body)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """返回进程内共享的客户端，第一次调用时加载 kubeconfig"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = KubeClient()
+            atexit.register(_client.close)
+        return _client
+
+def list_nodes():
+    return get_client().list('/api/v1/nodes')
+
+def list_pods():
+    return get_client().list('/api/v1/pods')
+
+def list_workloads(workload_type, **params):
+    """列出所有命名空间的 deployment 或 statefulset，params 可以带 labelSelector 在服务端过滤"""
+    return get_client().list('/apis/apps/v1/{}s'.format(workload_type), **params)
+
+def node_ready(node):
+    for condition in node.get('status', {}).get('conditions', []):
+        if condition.get('type') == 'Ready':
+            return condition.get('status')
+    return None
+
+def cordon_node(name):
+    get_client().patch('/api/v1/nodes/' + name, {'spec': {'unschedulable': True}})
+
+def uncordon_node(name):
+    get_client().patch('/api/v1/nodes/' + name, {'spec': {'unschedulable': False}})
+
+def evict_pod(namespace, name):
+    """通过 Eviction API 驱逐 Pod，被 PodDisruptionBudget 拒绝时返回 False"""
+    body = {
+        'apiVersion': 'policy/v1',
+        'kind': 'Eviction',
+        'metadata': {'name': name, 'namespace': namespace}
+    }
+    try:
+        get_client().post('/api/v1/namespaces/{}/pods/{}/eviction'.format(namespace, name), body)
+    except KubeError as e:
+        if e.status == 404:
+            return True
+        # 429：违反 PDB；500：匹配到多个 PDB，都稍后重试
+        if e.status in (429, 500):
+            return False
+        raise
+    return True
+
+def _drainable(pod):
+    """DaemonSet 和静态 Pod 不驱逐，已结束的 Pod 不需要驱逐"""
+    if pod.get('status', {}).get('phase') in ('Succeeded', 'Failed'):
+        return False
+    metadata = pod['metadata']
+    if 'kubernetes.io/config.mirror' in (metadata.get('annotations') or {}):
+        return False
+    return not any(owner.get('kind') == 'DaemonSet' for owner in metadata.get('ownerReferences') or [])
+
+def drain_node(name, timeout=None):
+    """封锁节点并逐个驱逐 Pod，遵守 PodDisruptionBudget；超时返回 False，节点保持封锁状态"""
+    deadline = time.time() + (timeout or NODE_DRAIN_TIMEOUT)
+    cordon_node(name)
+    while True:
+        pods = [pod for pod in get_client().list('/api/v1/pods', fieldSelector='spec.nodeName=' + name)
+                if _drainable(pod)]
+        if not pods:
+            return True
+        for pod in pods:
+            metadata = pod['metadata']
+            # 已经在删除中的 Pod 只等待其退出
+            if metadata.get('deletionTimestamp'):
+                continue
+            if not evict_pod(metadata['namespace'], metadata['name']):
+                print('Eviction of {}/{} blocked by disruption budget'.format(metadata['namespace'], metadata['name']),
+                      flush=True)
+        if time.time() >= deadline:
+            return False
+        time.sleep(DRAIN_RETRY_INTERVAL)
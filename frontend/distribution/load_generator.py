@@ -0,0 +1,186 @@
+import asyncio
+import json
+import math
+import os
+import aiohttp
+from kube import get_client
+
+# 环境变量：每次压测的持续秒数
+STRESS_DURATION = float(os.getenv('STRESS_DURATION') or '60')
+# 环境变量：压测目标地址模板，可用 {namespace}、{app}、{port}，为空时通过 API Server 查询应用 Service 的 ClusterIP
+STRESS_TARGET_URL = os.getenv('STRESS_TARGET_URL') or ''
+# 环境变量：同时在途的最大请求数，同时也是连接池大小
+STRESS_MAX_INFLIGHT = int(os.getenv('STRESS_MAX_INFLIGHT') or '1000')
+# 环境变量：单个请求的超时秒数，超时计为错误
+STRESS_REQUEST_TIMEOUT = float(os.getenv('STRESS_REQUEST_TIMEOUT') or '10')
+
+class LatencyHistogram:
+    """HDR 风格的对数-线性直方图，单位微秒
+
+    每个 2 的幂区间分成 64 个子桶，相对误差不超过 1/64，内存占用与样本数无关
+    """
+
+    SUB_BUCKET_BITS = 7
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+    HALF = SUB_BUCKETS >> 1
+    # 最大记录 1 小时，更大的值按最大值记录
+    MAX_VALUE = 3600 * 1000 * 1000
+
+    def __init__(self):
+        self.counts = [0] * (self._index(self.MAX_VALUE) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    @classmethod
+    def _index(cls, value):
+        if value < cls.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS
+        return cls.SUB_BUCKETS + (shift - 1) * cls.HALF + ((value >> shift) - cls.HALF)
+
+    @classmethod
+    def _highest_equivalent(cls, index):
+        if index < cls.SUB_BUCKETS:
+            return index
+        shift = (index - cls.SUB_BUCKETS) // cls.HALF + 1
+        sub_bucket = (index - cls.SUB_BUCKETS) % cls.HALF + cls.HALF
+        return ((sub_bucket + 1) << shift) - 1
+
+    def record(self, value):
+        value = min(max(int(value), 0), self.MAX_VALUE)
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percentile):
+        """返回 percentile 分位的值（所在子桶的上界，不超过最大值），没有样本时返回 None"""
+        if not self.count:
+            return None
+        target = max(1, math.ceil(percentile / 100 * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._highest_equivalent(index), self.max)
+        return self.max
+
+def target_url(namespace, app, port):
+    """压测目标的基础地址"""
+    if STRESS_TARGET_URL:
+        return STRESS_TARGET_URL.format(namespace=namespace, app=app, port=port).rstrip('/')
+    service = get_client().get('/api/v1/namespaces/{}/services/{}'.format(namespace, app))
+    return 'http://{}:{}'.format(service['spec']['clusterIP'], port)
+
+class TargetStats:
+    def __init__(self, url):
+        self.url = url
+        self.histogram = LatencyHistogram()
+        self.sent = 0
+        self.errors = 0
+        # 从开始到发出最后一个请求的秒数，不含等待最后一批响应的时间
+        self.send_window = 0.0
+
+async def _drive(session, stats, method, body, headers, qps, duration, inflight):
+    """开环、恒定到达率：第 i 个请求在 start + i / qps 发出，不等待之前的请求完成
+
+    延迟从计划发出时间算起，服务端变慢导致的排队也计入延迟，避免协调遗漏
+    """
+    loop = asyncio.get_event_loop()
+    total = int(qps * duration)
+    start = loop.time()
+    tasks = []
+
+    async def fire(intended):
+        try:
+            async with session.request(method, stats.url, data=body, headers=headers) as response:
+                await response.read()
+                ok = response.status < 400
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            ok = False
+        finally:
+            inflight.release()
+        if ok:
+            stats.histogram.record((loop.time() - intended) * 1000000)
+        else:
+            stats.errors += 1
+
+    for i in range(total):
+        intended = start + i / qps
+        delay = intended - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await inflight.acquire()
+        stats.sent += 1
+        stats.send_window = loop.time() - start
+        tasks.append(asyncio.ensure_future(fire(intended)))
+    if tasks:
+        await asyncio.gather(*tasks)
+
+async def run_load(urls, qps, duration=None, test_data=''):
+    """以每个目标 qps 的到达率同时压测所有 urls，返回每个目标的 TargetStats"""
+    duration = duration or STRESS_DURATION
+    method, body, headers = 'GET', None, {}
+    if test_data:
+        method, body = 'POST', test_data.encode()
+        try:
+            json.loads(test_data)
+            headers['Content-Type'] = 'application/json'
+        except ValueError:
+            pass
+    connector = aiohttp.TCPConnector(limit=STRESS_MAX_INFLIGHT)
+    timeout = aiohttp.ClientTimeout(total=STRESS_REQUEST_TIMEOUT)
+    inflight = asyncio.Semaphore(STRESS_MAX_INFLIGHT)
+    targets = [TargetStats(url) for url in urls]
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await asyncio.gather(*[_drive(session, stats, method, body, headers, qps, duration, inflight)
+                               for stats in targets])
+    return targets
+
+def summarize(targets, max_latency):
+    """汇总所有目标的结果，延迟单位毫秒；p99 不超过 max_latency 且没有错误时认为满足要求"""
+    histogram = LatencyHistogram()
+    for stats in targets:
+        histogram.merge(stats.histogram)
+    sent = sum(stats.sent for stats in targets)
+    errors = sum(stats.errors for stats in targets)
+    send_window = max([stats.send_window for stats in targets] or [0])
+
+    def ms(value):
+        return round(value / 1000, 3) if value is not None else None
+
+    p99 = ms(histogram.percentile(99))
+    return {
+        'requests': sent,
+        'errors': errors,
+        'error_rate': errors / sent if sent else None,
+        'achieved_qps': (sent - errors) / send_window if send_window else None,
+        'average_latency': ms(histogram.mean()),
+        'p50_latency': ms(histogram.percentile(50)),
+        'p90_latency': ms(histogram.percentile(90)),
+        'p99_latency': p99,
+        'max_observed_latency': ms(histogram.max) if histogram.count else None,
+        'latency_met': p99 is not None and p99 <= max_latency and errors == 0,
+        'targets': [{
+            'url': stats.url,
+            'requests': stats.sent,
+            'errors': stats.errors,
+            'average_latency': ms(stats.histogram.mean()),
+            'p99_latency': ms(stats.histogram.percentile(99))
+        } for stats in targets]
+    }
@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+from collections import deque
+import requests
+from kube import get_client, list_nodes
+from resources import cpu_cores, memory_gi, node_capacity, usage_percent
+
+# 环境变量：缩放依据，limits（limits 之和占容量的比例）或 usage（metrics API 的实际用量）
+SCALING_MODE = os.getenv('SCALING_MODE') or 'limits'
+# 环境变量：metrics API 地址，为空时通过 API Server 访问 metrics.k8s.io
+METRICS_URL = os.getenv('METRICS_URL') or ''
+# 环境变量：采样间隔秒数
+METRICS_INTERVAL = int(os.getenv('METRICS_INTERVAL') or '15')
+# 环境变量：保留的样本数
+METRICS_WINDOW = int(os.getenv('METRICS_WINDOW') or '240')
+# 环境变量：EWMA 平滑系数，越小越平滑
+METRICS_EWMA_ALPHA = float(os.getenv('METRICS_EWMA_ALPHA') or '0.3')
+# 环境变量：连续多少次判断超过阈值才触发缩放
+SCALING_SUSTAIN = int(os.getenv('SCALING_SUSTAIN') or '3')
+# 环境变量：回到正常状态需要越过阈值的百分点
+SCALING_HYSTERESIS = float(os.getenv('SCALING_HYSTERESIS') or '5')
+
+NODE_METRICS_PATH = '/apis/metrics.k8s.io/v1beta1/nodes'
+
+STATE_HIGH = 'high'
+STATE_NORMAL = 'normal'
+STATE_LOW = 'low'
+
+def fetch_node_usage():
+    """读取每个节点的实际用量，返回 {节点名: (CPU 核数, 内存 Gi)}"""
+    if METRICS_URL:
+        response = requests.get(METRICS_URL.rstrip('/') + NODE_METRICS_PATH, timeout=10)
+        response.raise_for_status()
+        items = response.json()['items']
+    else:
+        items = get_client().list(NODE_METRICS_PATH)
+    return {item['metadata']['name']: (cpu_cores(item['usage']['cpu']), memory_gi(item['usage']['memory']))
+            for item in items}
+
+class UsageTracker:
+    """定时采样集群实际用量，样本保存在环形缓冲区中，并维护 EWMA 平滑值"""
+
+    def __init__(self, window=None, alpha=None, capacity_source=None):
+        self.samples = deque(maxlen=window or METRICS_WINDOW)
+        self.alpha = alpha if alpha is not None else METRICS_EWMA_ALPHA
+        self.capacity_source = capacity_source
+        self.smoothed = None
+        self.nodes = {}
+        self.lock = threading.Lock()
+
+    def _capacity(self):
+        if self.capacity_source:
+            capacity = self.capacity_source()
+            if capacity:
+                return capacity
+        return {node['metadata']['name']: node_capacity(node) for node in list_nodes()}
+
+    def add(self, cpu, memory, timestamp=None):
+        """加入一个样本（百分比），返回平滑后的 (CPU, 内存)"""
+        with self.lock:
+            if self.smoothed is None:
+                self.smoothed = (cpu, memory)
+            else:
+                self.smoothed = (self.alpha * cpu + (1 - self.alpha) * self.smoothed[0],
+                                 self.alpha * memory + (1 - self.alpha) * self.smoothed[1])
+            self.samples.append({
+                'time': timestamp or time.time(),
+                'cpu': cpu,
+                'memory': memory,
+                'cpu_smoothed': self.smoothed[0],
+                'memory_smoothed': self.smoothed[1]
+            })
+            return self.smoothed
+
+    def sample(self):
+        """采样一次，出错时只打印日志，不影响已有样本"""
+        try:
+            usage = fetch_node_usage()
+            capacity = self._capacity()
+        except Exception as e:
+            print('Error sampling metrics: {}'.format(str(e)), flush=True)
+            return None
+        nodes = {}
+        used = [0.0, 0.0]
+        total = [0.0, 0.0]
+        for name, (cpu_capacity, memory_capacity) in capacity.items():
+            cpu, memory = usage.get(name, (0.0, 0.0))
+            used[0] += cpu
+            used[1] += memory
+            total[0] += cpu_capacity
+            total[1] += memory_capacity
+            nodes[name] = {
+                'cpu_usage_percent': usage_percent(cpu, cpu_capacity),
+                'memory_usage_percent': usage_percent(memory, memory_capacity)
+            }
+        cpu_percent = usage_percent(used[0], total[0])
+        memory_percent = usage_percent(used[1], total[1])
+        if cpu_percent is None or memory_percent is None:
+            return None
+        with self.lock:
+            self.nodes = nodes
+        return self.add(cpu_percent, memory_percent)
+
+    def current(self):
+        """返回平滑后的 (CPU 百分比, 内存百分比)，还没有样本时返回 (None, None)"""
+        with self.lock:
+            return self.smoothed or (None, None)
+
+    def history(self):
+        with self.lock:
+            return list(self.samples)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'mode': SCALING_MODE,
+                'cpu_usage_percent': self.smoothed[0] if self.smoothed else None,
+                'memory_usage_percent': self.smoothed[1] if self.smoothed else None,
+                'samples': len(self.samples),
+                'latest': self.samples[-1] if self.samples else None,
+                'nodes': dict(self.nodes)
+            }
+
+class Hysteresis:
+    """带滞回的阈值判断：连续 sustain 次高于 high 进入 high 状态，连续 sustain 次低于 low 进入 low 状态，
+
+    离开 high/low 状态需要回落/回升越过阈值 margin 个百分点，避免在阈值附近来回触发
+    """
+
+    def __init__(self, high, low=None, sustain=None, margin=None):
+        self.high = high
+        self.low = low
+        self.sustain = sustain or SCALING_SUSTAIN
+        self.margin = margin if margin is not None else SCALING_HYSTERESIS
+        self.state = STATE_NORMAL
+        self.count = 0
+        self.pending = STATE_NORMAL
+
+    def _target(self, value):
+        if self.state == STATE_HIGH and value > self.high - self.margin:
+            return STATE_HIGH
+        if self.state == STATE_LOW and self.low is not None and value < self.low + self.margin:
+            return STATE_LOW
+        if value > self.high:
+            return STATE_HIGH
+        if self.low is not None and value < self.low:
+            return STATE_LOW
+        return STATE_NORMAL
+
+    def update(self, value):
+        """输入一次观测值，返回当前状态"""
+        target = self._target(value)
+        if target == self.state:
+            self.count = 0
+            self.pending = target
+            return self.state
+        # 恢复正常不需要持续，只有进入 high/low 需要连续满足
+        if target == STATE_NORMAL:
+            self.state = STATE_NORMAL
+            self.count = 0
+            return self.state
+        if target == self.pending:
+            self.count += 1
+        else:
+            self.pending = target
+            self.count = 1
+        if self.count >= self.sustain:
+            self.state = target
+            self.count = 0
+        return self.state
@@ -1,92 +1,192 @@
-import subprocess
+import asyncio
+import os
+import re
+import signal
 import time
+from ssh import ssh_command
 
-def add_node_to_cluster(node_ip: str, master_ip: str, cluster_name: str = 'default', user: str = '', passwd: str = '', pk: str = '', pk_passwd: str = '', port: int = 22):
-    command = [
-        'ssh', '-o', 'StrictHostKeyChecking=no', '-o', 'UserKnownHostsFile=/dev/null',
-        '-p', str(port), master_ip,
+# 环境变量：等待 sealos 确认提示的秒数，超时后照常回答，兼容不提示的版本
+NODE_PROMPT_TIMEOUT = float(os.getenv('NODE_PROMPT_TIMEOUT') or '30')
+# 环境变量：加入节点的最长秒数，超时后结束 sealos 进程
+NODE_ADD_TIMEOUT = float(os.getenv('NODE_ADD_TIMEOUT') or '1800')
+# 环境变量：删除节点的最长秒数
+NODE_DELETE_TIMEOUT = float(os.getenv('NODE_DELETE_TIMEOUT') or '900')
+# 结束进程后等待其退出的秒数
+KILL_GRACE_SECONDS = 10
+READ_CHUNK_SIZE = 4096
+
+SUCCESS_MARKER = 'succeeded in scaling this cluster'
+# 确认提示不以换行结尾，需要在未结束的行上匹配
+_PROMPT = re.compile(r'\(y/n\)|\[y/n\]|yes/no', re.IGNORECASE)
+
+class NodeOperationError(Exception):
+    """sealos 节点操作失败或超时"""
+
+def print_event(event):
+    if event['event'] == 'output':
+        print(event['line'], flush=True)
+    else:
+        print('[{} {}] {} {}'.format(event['operation'], event['nodes'], event['event'], event.get('detail', '')).rstrip(),
+              flush=True)
+
+async def _master_command(master_ip, port, remote_command):
+    # 建立或检查主连接会阻塞，放到线程池中执行
+    return await asyncio.get_event_loop().run_in_executor(None, ssh_command, master_ip, port, remote_command)
+
+class _SealosRun:
+    """运行一次 sealos 命令：并发读取 stdout/stderr，出现确认提示时立即回答，按阶段限制时间"""
+
+    def __init__(self, operation, nodes, command, timeout, on_event=None):
+        self.operation = operation
+        self.nodes = nodes
+        self.command = command
+        self.timeout = timeout
+        self.on_event = on_event or print_event
+        self.process = None
+        self.prompted = None
+        self.answered = False
+        self.succeeded = False
+        self.errorlines = []
+        self.events = []
+
+    def emit(self, event, **fields):
+        fields.update({'time': time.time(), 'operation': self.operation, 'nodes': self.nodes, 'event': event})
+        self.events.append(fields)
+        self.on_event(fields)
+
+    async def _answer(self):
+        if self.answered:
+            return
+        self.answered = True
+        try:
+            self.process.stdin.write(b'y\n')
+            await self.process.stdin.drain()
+            self.process.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    async def _line(self, stream, line):
+        line = line.strip()
+        if not line:
+            return
+        self.emit('output', stream=stream, line=line)
+        if SUCCESS_MARKER in line:
+            self.succeeded = True
+        if stream == 'stderr':
+            self.errorlines.append(line)
+
+    async def _read(self, reader, stream):
+        buffer = ''
+        while True:
+            data = await reader.read(READ_CHUNK_SIZE)
+            if not data:
+                break
+            buffer += data.decode(errors='replace')
+            *lines, buffer = buffer.split('\n')
+            for line in lines:
+                await self._line(stream, line)
+            if not self.answered and _PROMPT.search(buffer):
+                self.emit('prompt', detail=buffer.strip())
+                await self._line(stream, buffer)
+                buffer = ''
+                await self._answer()
+                self.prompted.set()
+        await self._line(stream, buffer)
+
+    async def _kill(self):
+        # 进程在独立的进程组中启动，结束整个进程组，避免子进程继续占用管道
+        if self.process.returncode is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            try:
+                await asyncio.wait_for(self.process.wait(), KILL_GRACE_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.timeout
+        self.prompted = asyncio.Event()
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE, start_new_session=True)
+        self.emit('started', detail=' '.join(self.command))
+        readers = asyncio.ensure_future(asyncio.gather(self._read(self.process.stdout, 'stdout'),
+                                                       self._read(self.process.stderr, 'stderr')))
+        prompted = asyncio.ensure_future(self.prompted.wait())
+        try:
+            # 阶段一：等待确认提示，进程提前结束时不再等待
+            await asyncio.wait({prompted, readers}, timeout=min(NODE_PROMPT_TIMEOUT, self.timeout),
+                               return_when=asyncio.FIRST_COMPLETED)
+            if not self.answered and not readers.done():
+                self.emit('prompt_timeout')
+                await self._answer()
+            # 阶段二：等待命令完成
+            remaining = max(0.0, deadline - loop.time())
+            await asyncio.wait_for(asyncio.shield(readers), remaining)
+            await asyncio.wait_for(self.process.wait(), max(0.0, deadline - loop.time()) or KILL_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            self.emit('timeout', detail='{}s'.format(self.timeout))
+            await self._kill()
+            try:
+                await asyncio.wait_for(readers, KILL_GRACE_SECONDS)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            raise NodeOperationError('Timed out after {}s: {} {}'.format(self.timeout, self.operation, self.nodes))
+        finally:
+            prompted.cancel()
+            if self.process.returncode is None:
+                await self._kill()
+
+        if not self.succeeded:
+            self.emit('failed', detail='exit code {}'.format(self.process.returncode))
+            raise NodeOperationError('Error {} node: {}'.format(
+                'adding' if self.operation == 'add' else 'deleting', ' '.join(self.errorlines)))
+        self.emit('succeeded')
+        return self.events
+
+async def add_node_async(node_ip: str, master_ip: str, cluster_name: str = 'default', user: str = '', passwd: str = '', pk: str = '', pk_passwd: str = '', port: int = 22, timeout: float = None, on_event=None):
+    """加入节点，node_ip 可以是逗号分隔的多个 IP；返回进度事件列表，失败或超时抛出 NodeOperationError"""
+    remote_command = [
         'sealos', 'add',
         '--nodes', node_ip,
         '--cluster', cluster_name,
         '--port', str(port)
     ]
-    
+
     if user:
-        command.extend(['--user', user])
+        remote_command.extend(['--user', user])
     if passwd:
-        command.extend(['--passwd', passwd])
+        remote_command.extend(['--passwd', passwd])
     if pk:
-        command.extend(['--pk', pk])
+        remote_command.extend(['--pk', pk])
     if pk_passwd:
-        command.extend(['--pk-passwd', pk_passwd])
-    
-    p = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-    
-    print(' '.join(command))
-    
-    time.sleep(3)
-    
-    success = False
-    errorlines = []
-    
-    try:
-        p.stdin.write('y\n')
-        p.stdin.flush()
-    finally:
-        # # 实时获取输出
-        for line in iter(p.stdout.readline, ''):
-            line_data = line.strip()
-            print(line_data)
-            if "succeeded in scaling this cluster" in line_data:
-                return
-        for line in iter(p.stderr.readline, ''):
-            line_data = line.strip()
-            errorlines.append(line_data)
-            print(line_data)
-
-    if not success:
-        raise Exception("Error adding node: " + ' '.join(errorlines))
+        remote_command.extend(['--pk-passwd', pk_passwd])
 
-# Example usage:
-# add_node_to_cluster('192.168.1.100', user='root', passwd='your_password')
+    command = await _master_command(master_ip, port, remote_command)
+    return await _SealosRun('add', node_ip, command, timeout or NODE_ADD_TIMEOUT, on_event).run()
 
-def delete_node_from_cluster(node_ip: str, master_ip: str, cluster_name: str = 'default', force: bool = False):
-    command = [
-        'ssh', '-o', 'StrictHostKeyChecking=no', '-o', 'UserKnownHostsFile=/dev/null',
-        '-p', str(22), master_ip,
+async def delete_node_async(node_ip: str, master_ip: str, cluster_name: str = 'default', force: bool = False, timeout: float = None, on_event=None):
+    """删除节点，node_ip 可以是逗号分隔的多个 IP"""
+    remote_command = [
         'sealos', 'delete',
         '--nodes', node_ip,
         '--cluster', cluster_name,
     ]
-    
+
     if force:
-        command.append('--force')
-    
-    #result = subprocess.run(command, capture_output=True, universal_newlines=True)
-    p = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-    
-    time.sleep(3)
-    
-    success = False
-    errorlines = []
-    
-    try:
-        p.stdin.write('y\n')
-        p.stdin.flush()
-    finally:
-        # # 实时获取输出
-        for line in iter(p.stdout.readline, ''):
-            line_data = line.strip()
-            print(line_data)
-            if "succeeded in scaling this cluster" in line_data:
-                success = True
-            for line in iter(p.stderr.readline, ''):
-                line_data = line.strip()
-                errorlines.append(line_data)
-                print(line_data)
-                
-    if not success:
-        raise Exception("Error adding node: " + ' '.join(errorlines))
+        remote_command.append('--force')
+
+    command = await _master_command(master_ip, 22, remote_command)
+    return await _SealosRun('delete', node_ip, command, timeout or NODE_DELETE_TIMEOUT, on_event).run()
+
+def add_node_to_cluster(node_ip: str, master_ip: str, cluster_name: str = 'default', user: str = '', passwd: str = '', pk: str = '', pk_passwd: str = '', port: int = 22, timeout: float = None, on_event=None):
+    return asyncio.run(add_node_async(node_ip, master_ip, cluster_name, user, passwd, pk, pk_passwd, port, timeout, on_event))
 
 # Example usage:
-# delete_node_from_cluster('192.168.1.100', user='root', passwd='your_password')
\ No newline at end of file
+# add_node_to_cluster('192.168.1.100', user='root', passwd='your_password')
+
+def delete_node_from_cluster(node_ip: str, master_ip: str, cluster_name: str = 'default', force: bool = False, timeout: float = None, on_event=None):
+    return asyncio.run(delete_node_async(node_ip, master_ip, cluster_name, force, timeout, on_event))
@@ -0,0 +1,97 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import METRICS_INTERVAL
+
+# 环境变量：同时发出的暂停请求数
+PAUSE_CONCURRENCY = int(os.getenv('PAUSE_CONCURRENCY') or '5')
+# 环境变量：请求 applaunchpad 的超时秒数
+LAUNCHPAD_TIMEOUT = float(os.getenv('LAUNCHPAD_TIMEOUT') or '30')
+# 环境变量：暂停成功后至少等待多少秒才再次暂停，已释放的资源需要一段时间才反映到（平滑后的）使用率中
+PAUSE_COOLDOWN = int(os.getenv('PAUSE_COOLDOWN') or str(METRICS_INTERVAL * 8))
+# 优先级大于该值的工作负载可以被暂停
+PREEMPTIBLE_PRIORITY = 1
+# applaunchpad 的接口总是返回 HTTP 200，成功与否由响应体中的 code 表示
+LAUNCHPAD_OK = 200
+# 应用不存在时 applaunchpad 返回的错误信息
+APP_NOT_FOUND_MESSAGE = 'can not find app'
+
+def launchpad_result(response):
+    """解析 applaunchpad 的响应，返回 (是否成功, 应用是否不存在, 错误信息)"""
+    if response.status_code != 200:
+        return False, False, response.text
+    try:
+        body = response.json()
+    except ValueError:
+        return False, False, response.text
+    if not isinstance(body, dict):
+        return False, False, response.text
+    if body.get('code') == LAUNCHPAD_OK:
+        return True, False, ''
+    message = str(body.get('message') or response.text)
+    return False, APP_NOT_FOUND_MESSAGE in message, message
+
+def rank_workloads(candidates, cpu_capacity, memory_capacity):
+    """可暂停的工作负载排序：优先级数值大的在前，同优先级占用容量比例大的在前，已经没有副本的不参与"""
+    def share(workload):
+        cpu = workload['cpu'] / cpu_capacity if cpu_capacity else 0.0
+        memory = workload['memory'] / memory_capacity if memory_capacity else 0.0
+        return max(cpu, memory)
+    preemptible = [workload for workload in candidates
+                   if workload['priority'] > PREEMPTIBLE_PRIORITY and (workload['cpu'] > 0 or workload['memory'] > 0)]
+    return sorted(preemptible, key=lambda workload: (-workload['priority'], -share(workload)))
+
+def select_workloads(candidates, cpu_excess, memory_excess, cpu_capacity, memory_capacity):
+    """按排序依次选择，直到释放的 CPU 和内存都不少于超出的部分（核数、Gi）"""
+    selected = []
+    for workload in rank_workloads(candidates, cpu_capacity, memory_capacity):
+        if cpu_excess <= 0 and memory_excess <= 0:
+            break
+        # 只在仍然超出的维度上有释放的工作负载才值得暂停
+        if (cpu_excess > 0 and workload['cpu'] > 0) or (memory_excess > 0 and workload['memory'] > 0):
+            selected.append(workload)
+            cpu_excess -= workload['cpu']
+            memory_excess -= workload['memory']
+    return selected
+
+class LaunchpadClient:
+    """通过连接池调用 applaunchpad 的应用暂停和启动接口"""
+
+    def __init__(self, base_url, pool_size=None):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size or PAUSE_CONCURRENCY
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def pause(self, namespace, name):
+        # 与原接口保持一致的查询串写法
+        url = "{}/api/pauseApp?namespace={}&&appName={}&&isStop=none".format(self.base_url, namespace, name)
+        return self.session.get(url, timeout=LAUNCHPAD_TIMEOUT)
+
+    def resume(self, namespace, name):
+        url = "{}/api/startApp?namespace={}&&appName={}".format(self.base_url, namespace, name)
+        return self.session.get(url, timeout=LAUNCHPAD_TIMEOUT)
+
+    def _call_workloads(self, method, workloads):
+        def call(workload):
+            try:
+                response = method(workload['namespace'], workload['name'])
+            except requests.RequestException as e:
+                return workload, False, False, str(e)
+            return (workload,) + launchpad_result(response)
+
+        if not workloads:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.pool_size, len(workloads))) as executor:
+            return list(executor.map(call, workloads))
+
+    def pause_workloads(self, workloads):
+        """并发暂停，返回 [(工作负载, 是否成功, 应用是否不存在, 错误信息)]"""
+        return self._call_workloads(self.pause, workloads)
+
+    def resume_workloads(self, workloads):
+        """并发启动，返回 [(工作负载, 是否成功, 应用是否不存在, 错误信息)]"""
+        return self._call_workloads(self.resume, workloads)
@@ -0,0 +1,307 @@
+import hashlib
+import json
+import os
+import re
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+import requests
+from requests.adapters import HTTPAdapter
+from image_layout import FORMAT_OCI_LAYOUT, MEDIA_TYPE_CONFIG, MEDIA_TYPE_MANIFEST, blob_path, digest_from_member_name, layer_media_type, read_manifest
+
+# 集群内置镜像仓库
+LOCAL_REGISTRY = 'sealos.hub:5000'
+# 环境变量：集群内置镜像仓库的访问地址
+LOCAL_REGISTRY_URL = os.getenv('LOCAL_REGISTRY_URL') or 'http://' + LOCAL_REGISTRY
+# 环境变量：集群内置镜像仓库用户名
+LOCAL_REGISTRY_USER = os.getenv('LOCAL_REGISTRY_USER') or 'admin'
+# 环境变量：集群内置镜像仓库密码
+LOCAL_REGISTRY_PASS = os.getenv('LOCAL_REGISTRY_PASS') or 'passw0rd'
+# 环境变量：单个镜像同时上传的 blob 数
+REGISTRY_UPLOAD_CONCURRENCY = int(os.getenv('REGISTRY_UPLOAD_CONCURRENCY') or '4')
+# 环境变量：分块上传 blob 时每块的字节数
+REGISTRY_CHUNK_SIZE = int(os.getenv('REGISTRY_CHUNK_SIZE') or str(64 * 1024 * 1024))
+
+MANIFEST_ACCEPT = ', '.join([
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json'
+])
+
+def target_image_name(name):
+    """把镜像名中的仓库域名替换为 sealos.hub，镜像名不合法时返回 None"""
+    parts = name.split('/')
+    if len(parts) == 3:
+        return LOCAL_REGISTRY + '/' + '/'.join(parts[1:])
+    elif len(parts) == 1:
+        return LOCAL_REGISTRY + '/library/' + name
+    elif len(parts) == 2:
+        return LOCAL_REGISTRY + '/' + name
+    return None
+
+def split_reference(image_name):
+    """把 host/repo:tag 拆分为 (repository, reference)"""
+    name = image_name.split('/', 1)[1] if image_name.startswith(LOCAL_REGISTRY + '/') else image_name
+    if '@' in name:
+        return tuple(name.split('@', 1))
+    last = name.rsplit('/', 1)[-1]
+    if ':' in last:
+        repository, tag = name.rsplit(':', 1)
+        return repository, tag
+    return name, 'latest'
+
+def local_config_digest(file_path, image, image_format):
+    """读取制品中镜像 config 的摘要（即镜像ID），无法确定时返回 None"""
+    try:
+        if image_format == FORMAT_OCI_LAYOUT:
+            return read_manifest(file_path, image['manifest'])['config']['digest']
+        with tarfile.open(image['path'], 'r') as tar:
+            config_name = json.load(tar.extractfile('manifest.json'))[0]['Config']
+    except (OSError, KeyError, IndexError, ValueError, tarfile.TarError):
+        return None
+    # 旧格式为 <hex>.json，docker 25+ 为 blobs/sha256/<hex>
+    match = re.search(r'([0-9a-f]{64})(\.json)?$', config_name)
+    return 'sha256:' + match.group(1) if match else None
+
+class RegistryError(Exception):
+    pass
+
+class RegistryClient:
+    """复用连接的 OCI distribution 客户端"""
+
+    def __init__(self, base_url=None, username=None, password=None, pool_size=10):
+        self.base_url = (base_url or LOCAL_REGISTRY_URL).rstrip('/')
+        self.username = username if username is not None else LOCAL_REGISTRY_USER
+        self.password = password if password is not None else LOCAL_REGISTRY_PASS
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # 内置仓库使用自签名证书
+        self.session.verify = False
+        self.tokens = {}
+        # 已推送的 blob 摘要 -> 仓库，用于跨仓库挂载
+        self.mounted = {}
+        self.lock = threading.Lock()
+
+    def _token(self, challenge, scope):
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        realm = params.pop('realm', None)
+        if not realm:
+            return None
+        if scope:
+            params['scope'] = scope
+        response = self.session.get(realm, params=params, auth=(self.username, self.password), timeout=30)
+        response.raise_for_status()
+        body = response.json()
+        return body.get('token') or body.get('access_token')
+
+    def request(self, method, path, scope=None, **kwargs):
+        """发送请求，按仓库返回的 WWW-Authenticate 自动使用 Basic 或 Bearer 认证"""
+        url = path if path.startswith('http') else self.base_url + path
+        headers = kwargs.pop('headers', {})
+        kwargs.setdefault('timeout', 60)
+        token = self.tokens.get(scope)
+        if token:
+            headers['Authorization'] = 'Bearer ' + token
+            response = self.session.request(method, url, headers=headers, **kwargs)
+        else:
+            response = self.session.request(method, url, headers=headers, auth=(self.username, self.password), **kwargs)
+        if response.status_code != 401:
+            return response
+
+        challenge = response.headers.get('WWW-Authenticate', '')
+        if not challenge.lower().startswith('bearer'):
+            return response
+        token = self._token(challenge, scope)
+        if not token:
+            return response
+        with self.lock:
+            self.tokens[scope] = token
+        headers['Authorization'] = 'Bearer ' + token
+        if hasattr(kwargs.get('data'), 'seek'):
+            kwargs['data'].seek(0)
+        return self.session.request(method, url, headers=headers, **kwargs)
+
+    def remote_config_digest(self, repository, reference):
+        """返回仓库中镜像 config 的摘要，镜像不存在或无法判断时返回 None"""
+        response = self.request('GET', '/v2/{}/manifests/{}'.format(repository, reference),
+                                scope='repository:{}:pull'.format(repository),
+                                headers={'Accept': MANIFEST_ACCEPT})
+        if response.status_code != 200:
+            return None
+        manifest = response.json()
+        return manifest.get('config', {}).get('digest')
+
+    def blob_exists(self, repository, digest):
+        response = self.request('HEAD', '/v2/{}/blobs/{}'.format(repository, digest),
+                                scope='repository:{}:pull'.format(repository))
+        return response.status_code == 200
+
+    def _mount_source(self, digest, repository):
+        with self.lock:
+            source = self.mounted.get(digest)
+        return source if source and source != repository else None
+
+    def upload_blob(self, repository, digest, opener, size):
+        """分块上传 blob，opener(offset, length) 返回可读取该区间的文件对象
+
+        同一客户端已推送过该 blob 到其他仓库时优先跨仓库挂载，不再重复上传
+        """
+        scope = 'repository:{}:pull,push'.format(repository)
+        params = {}
+        source = self._mount_source(digest, repository)
+        if source:
+            params = {'mount': digest, 'from': source}
+        response = self.request('POST', '/v2/{}/blobs/uploads/'.format(repository), scope=scope, params=params)
+        if response.status_code == 201:
+            return
+        if response.status_code != 202:
+            raise RegistryError('Failed to start upload of {}: {} {}'.format(digest, response.status_code, response.text))
+        location = urljoin(self.base_url + '/', response.headers['Location'])
+
+        offset = 0
+        while offset < size:
+            length = min(REGISTRY_CHUNK_SIZE, size - offset)
+            with opener(offset, length) as data:
+                response = self.request('PATCH', location, scope=scope, data=data, headers={
+                    'Content-Type': 'application/octet-stream',
+                    'Content-Length': str(length),
+                    'Content-Range': '{}-{}'.format(offset, offset + length - 1)
+                })
+            if response.status_code != 202:
+                raise RegistryError('Failed to upload {}: {} {}'.format(digest, response.status_code, response.text))
+            location = urljoin(self.base_url + '/', response.headers['Location'])
+            offset += length
+
+        response = self.request('PUT', location, scope=scope, params={'digest': digest},
+                                headers={'Content-Length': '0'})
+        if response.status_code != 201:
+            raise RegistryError('Failed to commit {}: {} {}'.format(digest, response.status_code, response.text))
+        with self.lock:
+            self.mounted[digest] = repository
+
+    def put_manifest(self, repository, reference, data, media_type):
+        response = self.request('PUT', '/v2/{}/manifests/{}'.format(repository, reference),
+                                scope='repository:{}:pull,push'.format(repository),
+                                data=data, headers={'Content-Type': media_type})
+        if response.status_code not in (200, 201):
+            raise RegistryError('Failed to put manifest {}:{}: {} {}'.format(
+                repository, reference, response.status_code, response.text))
+
+class _FileRange:
+    """文件中 [offset, offset+length) 区间的只读视图，作为请求体流式发送，不读入内存"""
+
+    def __init__(self, path, offset, length):
+        self.file = open(path, 'rb')
+        self.offset = offset
+        self.length = length
+        self.seek(0)
+
+    def __len__(self):
+        return self.length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.file.close()
+
+    def seek(self, position, whence=0):
+        self.position = position
+        self.file.seek(self.offset + position)
+
+    def read(self, size=-1):
+        remaining = self.length - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        data = self.file.read(size)
+        self.position += len(data)
+        return data
+
+def _push_blobs(client, repository, blobs):
+    """并发上传仓库中不存在的 blob，blobs 为 (digest, size, opener) 列表"""
+    def push(blob):
+        digest, size, opener = blob
+        if client.blob_exists(repository, digest):
+            return
+        client.upload_blob(repository, digest, opener, size)
+
+    unique = list({blob[0]: blob for blob in blobs}.values())
+    with ThreadPoolExecutor(max_workers=max(1, min(REGISTRY_UPLOAD_CONCURRENCY, len(unique)))) as executor:
+        # 取出结果，子任务的异常在这里抛出
+        list(executor.map(push, unique))
+
+def _archive_blobs(tar_path):
+    """读取 docker save 生成的 tar 的目录，返回 (config 描述符, 层描述符列表, blob 列表)
+
+    blob 直接按偏移量从 tar 中读取，不解包
+    """
+    with tarfile.open(tar_path, 'r') as tar:
+        entry = json.load(tar.extractfile('manifest.json'))
+        if len(entry) != 1:
+            raise RegistryError('Expected exactly one image in ' + tar_path)
+        entry = entry[0]
+        members = {member.name: member for member in tar.getmembers()}
+        config_data = tar.extractfile(entry['Config']).read()
+    config = json.loads(config_data)
+    diff_ids = config.get('rootfs', {}).get('diff_ids', [])
+
+    def opener(member):
+        return lambda offset, length: _FileRange(tar_path, member.offset_data + offset, length)
+
+    config_digest = 'sha256:' + hashlib.sha256(config_data).hexdigest()
+    config_member = members[entry['Config']]
+    blobs = [(config_digest, config_member.size, opener(config_member))]
+    layers = []
+    with open(tar_path, 'rb') as file:
+        for index, layer_name in enumerate(entry['Layers']):
+            member = members[layer_name]
+            # 软链接形式的重复层，指向实际保存的层文件
+            while member.issym() or member.islnk():
+                member = members[os.path.normpath(os.path.join(os.path.dirname(member.name), member.linkname))
+                                 if member.issym() else member.linkname]
+            file.seek(member.offset_data)
+            media_type = layer_media_type(file.read(4))
+            digest = digest_from_member_name(member.name)
+            if not digest:
+                # 旧格式的层文件未压缩，摘要即 config 中对应的 diff_id
+                if media_type != layer_media_type(b'') or index >= len(diff_ids):
+                    raise RegistryError('Unable to determine digest of ' + layer_name)
+                digest = diff_ids[index]
+            layers.append({'mediaType': media_type, 'digest': digest, 'size': member.size})
+            blobs.append((digest, member.size, opener(member)))
+    config_descriptor = {'mediaType': MEDIA_TYPE_CONFIG, 'digest': config_digest, 'size': len(config_data)}
+    return config_descriptor, layers, blobs
+
+def push_archive(client, tar_path, image_name):
+    """不经过 docker，直接把 docker-archive 中的镜像推送为 image_name，返回 manifest 摘要"""
+    repository, reference = split_reference(image_name)
+    config, layers, blobs = _archive_blobs(tar_path)
+    _push_blobs(client, repository, blobs)
+    manifest = json.dumps({
+        'schemaVersion': 2,
+        'mediaType': MEDIA_TYPE_MANIFEST,
+        'config': config,
+        'layers': layers
+    }, separators=(',', ':')).encode()
+    client.put_manifest(repository, reference, manifest, MEDIA_TYPE_MANIFEST)
+    return 'sha256:' + hashlib.sha256(manifest).hexdigest()
+
+def push_layout(client, layout_dir, manifest_digest, image_name):
+    """直接推送 OCI layout 中的镜像，manifest 原样上传，摘要保持不变"""
+    repository, reference = split_reference(image_name)
+    with open(blob_path(layout_dir, manifest_digest), 'rb') as file:
+        manifest_data = file.read()
+    manifest = json.loads(manifest_data)
+
+    def opener(digest):
+        return lambda offset, length: _FileRange(blob_path(layout_dir, digest), offset, length)
+
+    blobs = [(descriptor['digest'], descriptor['size'], opener(descriptor['digest']))
+             for descriptor in [manifest['config']] + manifest['layers']]
+    _push_blobs(client, repository, blobs)
+    client.put_manifest(repository, reference, manifest_data, manifest.get('mediaType', MEDIA_TYPE_MANIFEST))
+    return manifest_digest
@@ -0,0 +1,84 @@
+import functools
+import math
+import re
+from decimal import Decimal, InvalidOperation
+
+# Kubernetes quantity 语法：数字 + 二进制后缀 | 十进制后缀 | 科学计数法指数
+_QUANTITY = re.compile(r'^([+-]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+))(?:([KMGTPE]i)|([numkMGTPE])|[eE]([+-]?[0-9]+))?$')
+_BINARY_SUFFIXES = {'Ki': 2 ** 10, 'Mi': 2 ** 20, 'Gi': 2 ** 30, 'Ti': 2 ** 40, 'Pi': 2 ** 50, 'Ei': 2 ** 60}
+_DECIMAL_EXPONENTS = {'n': -9, 'u': -6, 'm': -3, 'k': 3, 'M': 6, 'G': 9, 'T': 12, 'P': 15, 'E': 18}
+GI = float(2 ** 30)
+
+@functools.lru_cache(maxsize=4096)
+def _parse_quantity(value):
+    # 常见写法走快速路径：纯整数和毫核
+    if value.isdigit():
+        return float(value)
+    if value.endswith('m') and value[:-1].isdigit():
+        return int(value[:-1]) / 1000
+    match = _QUANTITY.match(value)
+    if not match:
+        raise ValueError('Invalid quantity: ' + value)
+    number, binary, decimal, exponent = match.groups()
+    try:
+        amount = Decimal(number)
+    except InvalidOperation:
+        raise ValueError('Invalid quantity: ' + value)
+    if binary:
+        amount *= _BINARY_SUFFIXES[binary]
+    elif decimal:
+        amount = amount.scaleb(_DECIMAL_EXPONENTS[decimal])
+    elif exponent:
+        amount = amount.scaleb(int(exponent))
+    return float(amount)
+
+def parse_quantity(value):
+    """按 Kubernetes quantity 语法解析数量（如 500m、1.5Gi、2G、1e3），返回基本单位的数值"""
+    return _parse_quantity(str(value).strip())
+
+def cpu_cores(value):
+    """把 CPU 数量（如 500m、2）转换为核数，无法解析时按 0 处理"""
+    try:
+        return parse_quantity(value)
+    except ValueError:
+        return 0.0
+
+def memory_gi(value):
+    """把内存数量（如 512Mi、8Gi、1G、1073741824）转换为 Gi，无法解析时按 0 处理"""
+    try:
+        return parse_quantity(value) / GI
+    except ValueError:
+        return 0.0
+
+def pod_counted(pod):
+    """只有运行中和等待调度的 Pod 占用集群资源"""
+    return pod.get('status', {}).get('phase') in ('Running', 'Pending')
+
+def pod_limits(pod):
+    """返回 Pod 所有容器 limits 之和 (CPU 核数, 内存 Gi)"""
+    cpu = 0.0
+    memory = 0.0
+    for container in pod.get('spec', {}).get('containers', []):
+        limits = container.get('resources', {}).get('limits', {})
+        if 'cpu' in limits:
+            cpu += cpu_cores(limits['cpu'])
+        if 'memory' in limits:
+            memory += memory_gi(limits['memory'])
+    return cpu, memory
+
+def node_capacity(node):
+    """返回节点容量 (CPU 核数, 内存 Gi)"""
+    capacity = node.get('status', {}).get('capacity', {})
+    return cpu_cores(capacity.get('cpu', 0)), memory_gi(capacity.get('memory', 0))
+
+def usage_percent(limits, capacity):
+    """返回 limits 占容量的百分比，容量为 0 时返回 None"""
+    if not capacity:
+        return None
+    return limits / capacity * 100
+
+def node_deficit(usage, node_count, target):
+    """按平均节点容量估算使用率降到 target 以下还需要的节点数，负数表示可以移除的节点数"""
+    if not node_count or not target:
+        return 0
+    return math.ceil(node_count * usage / target) - node_count
@@ -0,0 +1,140 @@
+import os
+import sqlite3
+import time
+from stress_test import DATABASE
+
+# 环境变量：使用率低于该值时开始恢复被暂停的工作负载
+RESUME_THRESHOLD = float(os.getenv('RESUME_THRESHOLD') or '40')
+# 环境变量：暂停后至少等待多少秒才允许恢复
+RESUME_AFTER_PAUSE_COOLDOWN = int(os.getenv('RESUME_AFTER_PAUSE_COOLDOWN') or '600')
+# 环境变量：两次恢复之间至少间隔的秒数，等待恢复的工作负载反映到使用率中
+RESUME_COOLDOWN = int(os.getenv('RESUME_COOLDOWN') or '300')
+
+class ResumeController:
+    """记录缩放任务暂停的工作负载及其占用，使用率回落后按优先级恢复
+
+    恢复后的使用率不超过 RESUME_THRESHOLD 与暂停阈值的中间值，避免恢复后再次触发暂停
+    """
+
+    def __init__(self, pause_threshold, database=None):
+        self.pause_threshold = pause_threshold
+        self.database = database or DATABASE
+
+    def init_db(self):
+        conn = sqlite3.connect(self.database)
+        cursor = conn.cursor()
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS paused_workloads (
+            type TEXT NOT NULL,
+            namespace TEXT NOT NULL,
+            name TEXT NOT NULL,
+            priority INTEGER NOT NULL,
+            replicas INTEGER NOT NULL,
+            cpu REAL NOT NULL,
+            memory REAL NOT NULL,
+            paused_at REAL NOT NULL,
+            PRIMARY KEY (type, namespace, name)
+        )
+        ''')
+        # 冷却期的起点保存在数据库中，重启或 leader 切换后仍然有效
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS resume_state (
+            key TEXT PRIMARY KEY,
+            value REAL NOT NULL
+        )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def record_paused(self, workload):
+        conn = sqlite3.connect(self.database)
+        cursor = conn.cursor()
+        cursor.execute('''
+        INSERT OR REPLACE INTO paused_workloads (type, namespace, name, priority, replicas, cpu, memory, paused_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (workload['type'], workload['namespace'], workload['name'], workload['priority'], workload['replicas'],
+              workload['cpu'], workload['memory'], time.time()))
+        conn.commit()
+        conn.close()
+
+    def _set_time(self, key, value):
+        conn = sqlite3.connect(self.database)
+        cursor = conn.cursor()
+        cursor.execute('''
+        INSERT OR REPLACE INTO resume_state (key, value) VALUES (?, ?)
+        ''', (key, value))
+        conn.commit()
+        conn.close()
+
+    def last_times(self):
+        """返回 (最近一次暂停的时间, 最近一次恢复的时间)，暂停时间取仍在等待恢复的记录中最晚的一条"""
+        conn = sqlite3.connect(self.database)
+        cursor = conn.cursor()
+        cursor.execute('SELECT MAX(paused_at) FROM paused_workloads')
+        last_pause = cursor.fetchone()[0] or 0
+        cursor.execute("SELECT value FROM resume_state WHERE key = 'last_resume'")
+        row = cursor.fetchone()
+        conn.close()
+        return last_pause, row[0] if row else 0
+
+    def paused(self):
+        """按恢复顺序返回被暂停的工作负载：优先级数值小的在前，同优先级先暂停的在前"""
+        conn = sqlite3.connect(self.database)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT * FROM paused_workloads ORDER BY priority ASC, paused_at ASC
+        ''')
+        results = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return results
+
+    def forget(self, workload):
+        conn = sqlite3.connect(self.database)
+        cursor = conn.cursor()
+        cursor.execute('''
+        DELETE FROM paused_workloads WHERE type = ? AND namespace = ? AND name = ?
+        ''', (workload['type'], workload['namespace'], workload['name']))
+        conn.commit()
+        conn.close()
+
+    def select(self, cpu_usage, memory_usage, cpu_capacity, memory_capacity):
+        """返回这次可以恢复的工作负载，使用率不够低或处于冷却期时返回空列表"""
+        now = time.time()
+        last_pause, last_resume = self.last_times()
+        if now - last_pause < RESUME_AFTER_PAUSE_COOLDOWN or now - last_resume < RESUME_COOLDOWN:
+            return []
+        if max(cpu_usage, memory_usage) >= RESUME_THRESHOLD:
+            return []
+        target = (RESUME_THRESHOLD + self.pause_threshold) / 2
+        cpu_room = (target - cpu_usage) / 100 * cpu_capacity
+        memory_room = (target - memory_usage) / 100 * memory_capacity
+        selected = []
+        # 严格按优先级顺序，放不下的工作负载之后的都不恢复，避免小的低优先级应用一直抢占空间
+        for workload in self.paused():
+            if workload['cpu'] > cpu_room or workload['memory'] > memory_room:
+                break
+            selected.append(workload)
+            cpu_room -= workload['cpu']
+            memory_room -= workload['memory']
+        return selected
+
+    def resumed(self, workload):
+        self.forget(workload)
+        self._set_time('last_resume', time.time())
+
+    def record_results(self, results):
+        """处理 LaunchpadClient.resume_workloads 的结果，只有确认恢复成功的工作负载才删除记录"""
+        for workload, ok, gone, message in results:
+            if ok:
+                self.resumed(workload)
+                print("Resumed {} {}/{} successfully".format(workload['type'], workload['namespace'], workload['name']))
+            else:
+                self.resume_failed(workload, gone)
+                print("Failed to resume {} {}/{}: {}".format(workload['type'], workload['namespace'], workload['name'], message))
+
+    def resume_failed(self, workload, gone=False):
+        """恢复失败后同样进入冷却期；工作负载已不存在时不再等待恢复"""
+        if gone:
+            self.forget(workload)
+        self._set_time('last_resume', time.time())
@@ -0,0 +1,149 @@
+import atexit
+import hashlib
+import os
+import shlex
+import subprocess
+import threading
+import time
+
+# 环境变量：是否复用到 master 的 SSH 连接（OpenSSH ControlMaster）
+ENABLE_SSH_MULTIPLEXING = bool((os.getenv('ENABLE_SSH_MULTIPLEXING') or 'true') == 'true')
+# 环境变量：ssh 可执行文件，测试时可以指向本地的替身
+SSH_BINARY = os.getenv('SSH_BINARY') or 'ssh'
+# 环境变量：附加的 ssh 参数，如 "-F /path/to/config -i /path/to/key"
+SSH_OPTIONS = os.getenv('SSH_OPTIONS') or ''
+# 环境变量：控制套接字所在目录，路径需要足够短（Unix 套接字路径上限约 100 字节）
+SSH_CONTROL_DIR = os.getenv('SSH_CONTROL_DIR') or '/tmp/deployapp-ssh'
+# 环境变量：最后一个会话结束后主连接保留的秒数
+SSH_CONTROL_PERSIST = int(os.getenv('SSH_CONTROL_PERSIST') or '600')
+# 环境变量：建立连接的超时秒数
+SSH_CONNECT_TIMEOUT = int(os.getenv('SSH_CONNECT_TIMEOUT') or '10')
+# 两次健康检查之间的最短间隔秒数
+SSH_CHECK_INTERVAL = 30
+# -O check 的这些错误说明套接字上没有主连接在监听，可以删除套接字文件
+_NO_MASTER_ERRORS = ('Connection refused', 'No such file or directory')
+
+class SSHError(Exception):
+    """无法建立到远端的主连接"""
+
+class SSHSession:
+    """到一台主机的持久 SSH 连接，其他 ssh 进程通过控制套接字复用它，省去每次的密钥交换和认证"""
+
+    def __init__(self, host, port=22, control_dir=None):
+        self.host = host
+        self.port = int(port)
+        self.control_dir = control_dir or SSH_CONTROL_DIR
+        name = hashlib.sha1('{}:{}'.format(host, port).encode()).hexdigest()[:16]
+        self.control_path = os.path.join(self.control_dir, name)
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def _base(self):
+        return [
+            SSH_BINARY, '-o', 'StrictHostKeyChecking=no', '-o', 'UserKnownHostsFile=/dev/null',
+            '-o', 'ControlPath=' + self.control_path, '-p', str(self.port)
+        ] + shlex.split(SSH_OPTIONS)
+
+    def _control(self, operation):
+        return subprocess.run(self._base() + ['-O', operation, self.host], stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE, universal_newlines=True, timeout=SSH_CONNECT_TIMEOUT)
+
+    def alive(self):
+        """通过控制套接字检查主连接是否可用
+
+        没有主连接在监听时删除残留的套接字文件并返回 False；检查超时或其他错误时主连接可能仍在运行，
+        抛出 SSHError 而不删除套接字，避免留下无人管理的主连接并重复建立
+        """
+        if not os.path.exists(self.control_path):
+            return False
+        try:
+            result = self._control('check')
+        except subprocess.TimeoutExpired:
+            raise SSHError('Timed out checking the master connection to {}:{}'.format(self.host, self.port))
+        if result.returncode == 0:
+            return True
+        if any(error in result.stderr for error in _NO_MASTER_ERRORS):
+            # 主连接异常退出会留下无效的套接字文件，删除后才能重新监听
+            try:
+                os.remove(self.control_path)
+            except FileNotFoundError:
+                pass
+            return False
+        raise SSHError('Error checking the master connection to {}:{}: {}'.format(
+            self.host, self.port, result.stderr.strip()))
+
+    def connect(self):
+        os.makedirs(self.control_dir, mode=0o700, exist_ok=True)
+        command = self._base() + [
+            '-o', 'ControlMaster=yes', '-o', 'ControlPersist={}'.format(SSH_CONTROL_PERSIST),
+            '-o', 'ConnectTimeout={}'.format(SSH_CONNECT_TIMEOUT), '-o', 'BatchMode=yes',
+            '-N', '-f', self.host
+        ]
+        try:
+            result = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                    universal_newlines=True, timeout=SSH_CONNECT_TIMEOUT * 2)
+        except subprocess.TimeoutExpired:
+            raise SSHError('Timed out connecting to {}:{}'.format(self.host, self.port))
+        if result.returncode != 0:
+            raise SSHError('Error connecting to {}:{}: {}'.format(self.host, self.port, result.stderr.strip()))
+        print('SSH master connection to {}:{} established'.format(self.host, self.port), flush=True)
+
+    def ensure(self):
+        """确保主连接可用，断开时重新连接；最近检查过则跳过"""
+        with self.lock:
+            if time.time() - self.checked < SSH_CHECK_INTERVAL and os.path.exists(self.control_path):
+                return
+            if not self.alive():
+                self.connect()
+            self.checked = time.time()
+
+    def command(self, remote_command):
+        """返回在远端执行 remote_command 的 ssh 命令行；主连接不可用时 ssh 会退回普通连接"""
+        try:
+            self.ensure()
+        except SSHError as e:
+            print('{}, falling back to a direct connection'.format(str(e)), flush=True)
+        return self._base() + ['-o', 'ControlMaster=no', self.host] + list(remote_command)
+
+    def run(self, remote_command, timeout=None):
+        """在远端执行命令并等待结束，返回 CompletedProcess"""
+        return subprocess.run(self.command(remote_command), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, universal_newlines=True, timeout=timeout)
+
+    def close(self):
+        with self.lock:
+            if os.path.exists(self.control_path):
+                try:
+                    self._control('exit')
+                except subprocess.TimeoutExpired:
+                    pass
+            self.checked = 0
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(host, port=22):
+    """返回到 host:port 的共享会话"""
+    key = (host, int(port))
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = SSHSession(host, port)
+        return session
+
+def ssh_command(host, port, remote_command):
+    """返回在远端执行命令的 ssh 命令行，开启复用时使用共享会话"""
+    if ENABLE_SSH_MULTIPLEXING:
+        return get_session(host, port).command(remote_command)
+    return [
+        SSH_BINARY, '-o', 'StrictHostKeyChecking=no', '-o', 'UserKnownHostsFile=/dev/null',
+        '-p', str(port)
+    ] + shlex.split(SSH_OPTIONS) + [host] + list(remote_command)
+
+@atexit.register
+def close_sessions():
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
@@ -1,8 +1,26 @@
 
+import asyncio
+import json
 import sqlite3
+import load_generator
 
 DATABASE = 'app.db'
 
+# 在最初的表结构之后增加的列，旧数据库启动时通过 ALTER TABLE 补上
+RESULT_COLUMNS = [
+    ('p50_latency', 'REAL'),
+    ('p90_latency', 'REAL'),
+    ('p99_latency', 'REAL'),
+    ('max_observed_latency', 'REAL'),
+    ('error_rate', 'REAL'),
+    ('total_requests', 'INTEGER'),
+    ('achieved_qps', 'REAL'),
+    ('latency_met', 'INTEGER'),
+    ('detail', 'TEXT'),
+    ('error', 'TEXT'),
+    ('job_id', 'TEXT')
+]
+
 def init_db():
     try:
         conn = sqlite3.connect(DATABASE)
@@ -25,6 +43,10 @@ def init_db():
             status TEXT NOT NULL
         )
         ''')
+        existing = set(row[1] for row in cursor.execute('PRAGMA table_info(results)').fetchall())
+        for column, column_type in RESULT_COLUMNS:
+            if column not in existing:
+                cursor.execute('ALTER TABLE results ADD COLUMN {} {}'.format(column, column_type))
         conn.commit()
         conn.close()
     except Exception as e:
@@ -40,7 +62,8 @@ def init_db():
 # 测试数据: string
 # 期望的QPS: int
 # 最大时延(ms): int
-def stress_test(id, test_type, namespace, appnames, port, core_interface, test_data, qps, max_latency):
+# submit: JobEngine.submit，压测作为 stress 类型的后台任务运行，并发数受 JOB_CONCURRENCY 限制
+def stress_test(id, test_type, namespace, appnames, port, core_interface, test_data, qps, max_latency, submit):
     conn = sqlite3.connect(DATABASE)
     cursor = conn.cursor()
     # 插入数据
@@ -50,7 +73,68 @@ def stress_test(id, test_type, namespace, appnames, port, core_interface, test_d
     ''', (id, test_type, namespace, '|'.join(appnames), port, core_interface, test_data, qps, max_latency, 'processing'))
     conn.commit()
     conn.close()
-    return 'OK'
+    job = submit('stress', run_test_job, id, namespace, appnames, port, core_interface, test_data, qps, max_latency,
+                 description=str(id))
+    # 记录运行压测的任务，进程退出后据此判断压测已中断
+    conn = sqlite3.connect(DATABASE)
+    cursor = conn.cursor()
+    cursor.execute('''
+    UPDATE results SET job_id = ? WHERE id = ?
+    ''', (job.id, id))
+    conn.commit()
+    conn.close()
+    return job
+
+def run_test_job(job, id, namespace, appnames, port, core_interface, test_data, qps, max_latency):
+    error = run_test(id, namespace, appnames, port, core_interface, test_data, qps, max_latency)
+    if error:
+        return {'id': id, 'error': error}, 500
+    return {'id': id}, 200
+
+def reap_orphan_results(job_running):
+    """启动时把任务已经不在运行的 processing 压测标记为失败，job_running(job_id) 判断任务是否仍在运行"""
+    conn = sqlite3.connect(DATABASE)
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT id, job_id FROM results WHERE status = 'processing'
+    ''')
+    orphans = [id for id, job_id in cursor.fetchall() if not job_id or not job_running(job_id)]
+    for id in orphans:
+        cursor.execute('''
+        UPDATE results SET status = 'failed', error = ? WHERE id = ? AND status = 'processing'
+        ''', ('Stress test was interrupted', id))
+        print('Stress test {} was interrupted'.format(id), flush=True)
+    conn.commit()
+    conn.close()
+
+def run_test(id, namespace, appnames, port, core_interface, test_data, qps, max_latency):
+    """对每个应用的核心接口按 qps 恒定到达率压测，结果写回 results 表，出错时返回错误信息"""
+    try:
+        urls = [load_generator.target_url(namespace, appname, port) + '/' + (core_interface or '').lstrip('/')
+                for appname in appnames]
+        targets = asyncio.run(load_generator.run_load(urls, float(qps), test_data=test_data or ''))
+        summary = load_generator.summarize(targets, float(max_latency))
+    except Exception as e:
+        print('Error in stress test {}: {}'.format(id, str(e)), flush=True)
+        conn = sqlite3.connect(DATABASE)
+        cursor = conn.cursor()
+        cursor.execute('''
+        UPDATE results SET status = 'failed', error = ? WHERE id = ?
+        ''', (str(e), id))
+        conn.commit()
+        conn.close()
+        return str(e)
+    conn = sqlite3.connect(DATABASE)
+    cursor = conn.cursor()
+    cursor.execute('''
+    UPDATE results SET average_latency = ?, p50_latency = ?, p90_latency = ?, p99_latency = ?, max_observed_latency = ?,
+    error_rate = ?, total_requests = ?, achieved_qps = ?, latency_met = ?, detail = ?, status = 'success' WHERE id = ?
+    ''', (round(summary['average_latency']) if summary['average_latency'] is not None else None,
+          summary['p50_latency'], summary['p90_latency'], summary['p99_latency'], summary['max_observed_latency'],
+          summary['error_rate'], summary['requests'], summary['achieved_qps'], int(summary['latency_met']),
+          json.dumps(summary['targets']), id))
+    conn.commit()
+    conn.close()
 
 def mock_run_test(id):
     conn = sqlite3.connect(DATABASE)
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from preemption import LaunchpadClient
+from resume import ResumeController
+
+WORKLOAD = {'type': 'deployment', 'namespace': 'ns-test', 'name': 'demo', 'priority': 2, 'replicas': 1,
+            'cpu': 0.5, 'memory': 1.0}
+
+def launchpad_response(body, status_code=200):
+    response = mock.Mock(status_code=status_code, text=str(body))
+    response.json.return_value = body
+    return response
+
+class ResumeResultTest(unittest.TestCase):
+    """applaunchpad 总是返回 HTTP 200，恢复结果只能从响应体的 code 判断"""
+
+    def setUp(self):
+        fd, self.database = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.controller = ResumeController(70, self.database)
+        self.controller.init_db()
+        self.controller.record_paused(WORKLOAD)
+        self.client = LaunchpadClient('http://launchpad')
+
+    def tearDown(self):
+        os.remove(self.database)
+
+    def resume(self, body):
+        with mock.patch.object(self.client.session, 'get', return_value=launchpad_response(body)):
+            self.controller.record_results(self.client.resume_workloads([WORKLOAD]))
+        return [workload['name'] for workload in self.controller.paused()]
+
+    def test_failed_resume_keeps_row(self):
+        self.assertEqual(self.resume({'code': 500, 'message': 'app is running'}), ['demo'])
+
+    def test_successful_resume_removes_row(self):
+        self.assertEqual(self.resume({'code': 200, 'message': ''}), [])
+
+    def test_missing_app_removes_row(self):
+        self.assertEqual(self.resume({'code': 500, 'message': 'can not find app'}), [])
+
+class CooldownTest(unittest.TestCase):
+    """冷却期的起点保存在数据库中，新的进程同样遵守"""
+
+    def setUp(self):
+        fd, self.database = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        controller = ResumeController(70, self.database)
+        controller.init_db()
+        controller.record_paused(WORKLOAD)
+
+    def tearDown(self):
+        os.remove(self.database)
+
+    def test_restart_keeps_pause_cooldown(self):
+        restarted = ResumeController(70, self.database)
+        self.assertEqual(restarted.select(0, 0, 100, 100), [])
+
+    def test_restart_keeps_resume_cooldown(self):
+        controller = ResumeController(70, self.database)
+        controller.resume_failed(WORKLOAD)
+        restarted = ResumeController(70, self.database)
+        with mock.patch('resume.RESUME_AFTER_PAUSE_COOLDOWN', 0):
+            self.assertEqual(restarted.select(0, 0, 100, 100), [])
+        with mock.patch('resume.RESUME_AFTER_PAUSE_COOLDOWN', 0), mock.patch('resume.RESUME_COOLDOWN', 0):
+            self.assertEqual(len(restarted.select(0, 0, 100, 100)), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import fcntl
+import os
+import threading
+
+# 多个 worker 进程共享任务状态，必须在导入 app 之前设置
+os.environ.setdefault('JOB_DATABASE', 'jobs.db')
+
+from app import app, init_app, start_background_tasks, start_informers
+
+# 环境变量：leader 锁文件，持有该文件锁的 worker 运行定时缩放任务
+SCHEDULER_LOCK_FILE = os.getenv('SCHEDULER_LOCK_FILE') or '/tmp/deployapp-scheduler.lock'
+# 未成为 leader 的 worker 重新尝试加锁的间隔秒数，leader 退出后由其他 worker 接替
+LEADER_RETRY_SECONDS = 15
+
+class LeaderLock:
+    """基于 flock 的进程间 leader 锁，持有锁的进程退出时内核自动释放"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def acquire(self):
+        """非阻塞加锁，成功返回 True"""
+        if self.file is not None:
+            return True
+        file = open(self.path, 'a')
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return False
+        self.file = file
+        return True
+
+leader_lock = LeaderLock(SCHEDULER_LOCK_FILE)
+
+def _elect():
+    while not leader_lock.acquire():
+        threading.Event().wait(LEADER_RETRY_SECONDS)
+    print('Worker {} is the scheduler leader'.format(os.getpid()), flush=True)
+    start_background_tasks()
+
+init_app()
+# 集群资源缓存只读，每个 worker 都维护一份，只读接口不必回退到全量列出
+start_informers()
+threading.Thread(target=_elect, name='leader-election', daemon=True).start()